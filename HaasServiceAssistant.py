@@ -6,6 +6,15 @@ This script implements a specialized GPT clone that:
 - Connects to the masterData.sqlite3 database.
 - Retrieves service reports and related parts information based on a specified machine model.
 - Uses OpenAI's GPT engine to generate troubleshooting recommendations using both the database context and the user's symptoms.
+- Batch mode triages a JSONL file of tickets ({"id", "model", "serial", "symptoms"} per line): tickets
+  are grouped by model so each model's context is built once, completions run concurrently under
+  request/token rate limits (with retries on 429s, see chatbot_ui/openai_gateway.py), and results
+  are appended to an output JSONL as they finish.  Re-running with the same output file skips
+  tickets that already succeeded, so an interrupted run resumes where it stopped.
+
+Usage
+- Interactive: python HaasServiceAssistant.py
+- Batch:       python HaasServiceAssistant.py --batch tickets.jsonl --output triage.jsonl --concurrency 8 --rate-limit 120 --tokens-per-minute 200000
 
 Requirement
 - masterData.sqlite3 in the same directory (or update the db_path accordingly).
@@ -13,15 +22,31 @@ Requirement
 - OPENAI_API_KEY environment variable set with your OpenAI API key.
 """
 
+import argparse
+import hashlib
+import json
 import os
 import sqlite3
 import sys
-import openai
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Shared data-access helpers live alongside the web app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chatbot_ui'))
+from context_packer import ContextPacker, get_tokenizer
+from issue_summary import issue_tokens
+from model_catalog import ModelResolver, model_filter_sql
+from openai_gateway import OpenAIGateway
+from report_store import ContextBuilder, fetch_reports_with_parts
+
+# Prompt budget per ticket; a model's full report history can be far larger than the context window
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
 
 class SpecializedGPTAgent:
-    def __init__(self, db_path='masterData.sqlite3'):
+    def __init__(self, db_path='masterData.sqlite3', requests_per_minute=None, tokens_per_minute=None):
         self.db_path = db_path
         self.conn = self.connect_database()
+        self.model_resolver = ModelResolver(lambda: self.conn)
         self.system_prompt = (
             "You are a specialized Haas CNC service assistant, an expert in troubleshooting, repairing, and maintaining Haas CNC machinery. "
             "Use the provided service report details and parts information to offer precise and actionable recommendations based on the user's symptoms."
@@ -31,7 +56,14 @@ class SpecializedGPTAgent:
         if not openai_api_key:
             print("Error: OPENAI_API_KEY environment variable is not set.")
             sys.exit(1)
-        self.client = openai.OpenAI(api_key=openai_api_key)
+        # Limits default to OPENAI_CHAT_RPM / OPENAI_CHAT_TPM; 429s are retried with backoff
+        limits = {}
+        if requests_per_minute:
+            limits["chat_rpm"] = requests_per_minute
+        if tokens_per_minute:
+            limits["chat_tpm"] = tokens_per_minute
+        self.gateway = OpenAIGateway.from_env(**limits)
+        self.context_packer = ContextPacker(get_tokenizer("gpt-3.5-turbo"), max_prompt_tokens=PROMPT_TOKEN_BUDGET)
 
     def connect_database(self):
         """
@@ -44,102 +76,247 @@ class SpecializedGPTAgent:
             print("Error connecting to database:", e)
             sys.exit(1)
 
-    def get_service_reports(self, model):
-        """
-        Retrieve service reports from the ServiceReports table that match the specified machine model.
+    def build_context(self, model):
         """
-        cursor = self.conn.cursor()
-        query = """
-        SELECT ServiceReport_id, WorkRequired, ServicePerformed, VerificationTest, Model
-        FROM ServiceReports
-        WHERE Model LIKE ?
+        The model's service reports rendered as packer candidates, built once per model and shared by
+        its tickets.  Reports and their parts are fetched in two set-based queries regardless of how
+        many reports match; build_messages() picks the ones that fit the prompt budget.
         """
-        cursor.execute(query, (f"%{model}%",))
-        rows = cursor.fetchall()
-        reports = []
-        for row in rows:
-            reports.append({
-                "ServiceReport_id": row[0],
-                "WorkRequired": row[1],
-                "ServicePerformed": row[2],
-                "VerificationTest": row[3],
-                "Model": row[4]
+        model_clause, params = model_filter_sql("sr.Model", self.model_resolver.resolve(model), model)
+        reports, parts_by_report = fetch_reports_with_parts(self.conn, model_clause, params)
+        # Newest reports win ties between equally relevant ones
+        by_date = sorted(range(len(reports)), key=lambda i: (str(reports[i][1] or ""), str(reports[i][0])))
+        recency = {index: (rank + 1) / len(reports) for rank, index in enumerate(by_date)}
+        candidates = []
+        for index, (report_id, _date, report_model, _serial, work_required, service_performed, verification) in enumerate(reports):
+            parts = parts_by_report.get(str(report_id), [])
+            section = ContextBuilder()
+            section.line(f"Service Report ID: {report_id}")
+            section.line(f"Model: {report_model or 'N/A'}")
+            section.line("Work Required: " + (work_required or "N/A"))
+            section.line("Service Performed: " + (service_performed or "N/A"))
+            section.line("Verification Test: " + (verification or "N/A"))
+            if parts:
+                section.line("Parts Used:")
+                for part_number, description in parts:
+                    section.line(f" - Part Number: {part_number}, Description: {description}")
+            section.line()
+            candidates.append({
+                "id": str(report_id),
+                "text": section.build(),
+                "tokens": issue_tokens(work_required, service_performed),
+                "recency": recency[index],
             })
-        return reports
+        return candidates
 
-    def get_service_report_parts(self, service_report_id):
+    def build_messages(self, context, model, symptoms, serial=None):
         """
-        Retrieve parts information from the ServiceReportParts table for a given service report.
+        Chat messages for one ticket, given the model's candidates from build_context().
+        Reports sharing the most terms with the symptoms are packed first, within PROMPT_TOKEN_BUDGET.
         """
-        cursor = self.conn.cursor()
-        query = """
-        SELECT PartNumber, Description
-        FROM ServiceReportParts
-        WHERE ServiceReport_id = ?
-        """
-        cursor.execute(query, (service_report_id,))
-        rows = cursor.fetchall()
-        parts = []
-        for row in rows:
-            parts.append({
-                "PartNumber": row[0],
-                "Description": row[1]
-            })
-        return parts
+        user_prompt = f"Machine Model: {model}\n"
+        if serial:
+            user_prompt += f"Serial Number: {serial}\n"
+        user_prompt += (
+            f"User Reported Symptoms: {symptoms}\n\n"
+            "Please analyze the above information and provide a detailed troubleshooting summary, including likely issues, recommended solutions, and any relevant parts information."
+        )
+        if not context:
+            return [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": "No service reports found for the specified model.\n" + user_prompt}
+            ]
+        symptom_tokens = issue_tokens(symptoms, "")
+        candidates = [
+            {"id": c["id"], "text": c["text"], "score": len(symptom_tokens & c["tokens"]) + c["recency"]}
+            for c in context
+        ]
+        packed = self.context_packer.pack(
+            self.system_prompt + "\n\n{0}", "", candidates, [{"role": "user", "content": user_prompt}],
+            candidate_header="Service Report Details:"
+        )
+        return packed["messages"]
 
-    def build_context(self, model):
+    def complete(self, messages):
         """
-        Build a context string containing service report and parts details for the given machine model.
+        Send messages to OpenAI's GPT engine and return the reply text; API errors propagate.
         """
-        reports = self.get_service_reports(model)
-        if not reports:
-            return "No service reports found for the specified model."
-        context = "Service Report Details:\n"
-        for report in reports:
-            parts = self.get_service_report_parts(report["ServiceReport_id"])
-            report["Parts"] = parts
-            context += f"Service Report ID: {report['ServiceReport_id']}\n"
-            context += f"Model: {report.get('Model', 'N/A')}\n"
-            context += "Work Required: " + (report.get("WorkRequired") or "N/A") + "\n"
-            context += "Service Performed: " + (report.get("ServicePerformed") or "N/A") + "\n"
-            context += "Verification Test: " + (report.get("VerificationTest") or "N/A") + "\n"
-            if parts:
-                context += "Parts Used:\n"
-                for part in parts:
-                    context += f" - Part Number: {part['PartNumber']}, Description: {part['Description']}\n"
-            context += "\n"
-        return context
+        response = self.gateway.chat(
+            model="gpt-3.5-turbo",  # Updated model name
+            messages=messages,
+            temperature=1
+        )
+        return response.choices[0].message.content
 
     def generate_response(self, model, symptoms):
         """
         Generate a troubleshooting response from OpenAI's GPT engine using the context from the database and user input.
         """
         context = self.build_context(model)
-        user_prompt = (
-            f"Machine Model: {model}\n"
-            f"User Reported Symptoms: {symptoms}\n\n"
-            "Please analyze the above information and provide a detailed troubleshooting summary, including likely issues, recommended solutions, and any relevant parts information."
-        )
-        messages = [
-            {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": context + "\n" + user_prompt}
-        ]
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",  # Updated model name
-                messages=messages,
-                temperature=1
-            )
-            return response.choices[0].message.content
+            return self.complete(self.build_messages(context, model, symptoms))
         except Exception as e:
             return "Error generating response: " + str(e)
 
+    def model_key(self, model):
+        """
+        Tickets whose model input resolves to the same Model values (e.g. "vf4" and "VF-4") share a context.
+        """
+        resolved = self.model_resolver.resolve(model)
+        if resolved:
+            return tuple(sorted(resolved))
+        return (model or "").strip().upper()
+
+
+def ticket_id(ticket):
+    """
+    The ticket's own "id", or a hash of its contents (identical tickets are answered once).
+    """
+    if ticket.get("id") not in (None, ""):
+        return str(ticket["id"])
+    content = json.dumps([ticket.get("model"), ticket.get("serial"), ticket.get("symptoms")])
+    return "sha1:" + hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+
+
+def read_tickets(path):
+    """
+    Tickets from a JSONL file; blank lines are skipped and malformed lines reported.
+    """
+    tickets = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                ticket = json.loads(line)
+            except ValueError as e:
+                print(f"Skipping line {line_number} of {path}: {e}")
+                continue
+            if not isinstance(ticket, dict) or not ticket.get("model") or not ticket.get("symptoms"):
+                print(f"Skipping line {line_number} of {path}: needs \"model\" and \"symptoms\"")
+                continue
+            tickets.append(ticket)
+    return tickets
+
+
+def completed_ticket_ids(output_path):
+    """
+    Ids of tickets already answered successfully in an existing output file.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by an interrupted run
+            if result.get("status") == "ok":
+                done.add(result.get("ticket_id"))
+    return done
+
+
+def run_batch(agent, input_path, output_path, concurrency=4):
+    """
+    Answer every ticket in input_path not already answered in output_path; returns a stats dict.
+    Contexts are built on this thread one model at a time, and at most 2 * concurrency tickets are
+    queued ahead of the workers, so only a few models' contexts are held in memory at once.
+    Rate limits and retries are the agent's gateway's.
+    """
+    start = time.time()
+    done = completed_ticket_ids(output_path)
+    pending_tickets = {}
+    skipped = set()
+    for ticket in read_tickets(input_path):
+        key = ticket_id(ticket)
+        if key in done:
+            skipped.add(key)
+        else:
+            pending_tickets.setdefault(key, ticket)
+    stats = {"skipped": len(skipped), "total": len(pending_tickets), "ok": 0, "error": 0, "models": 0}
+    print(f"{stats['total']} tickets to answer ({stats['skipped']} already done in {output_path})")
+
+    by_model = {}
+    for key, ticket in pending_tickets.items():
+        by_model.setdefault(agent.model_key(ticket["model"]), []).append((key, ticket))
+
+    def answer(key, ticket, messages):
+        started = time.time()
+        result = {
+            "ticket_id": key,
+            "model": ticket.get("model"),
+            "serial": ticket.get("serial"),
+            "symptoms": ticket.get("symptoms"),
+        }
+        try:
+            result["response"] = agent.complete(messages)
+            result["status"] = "ok"
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = str(e)
+        result["seconds"] = round(time.time() - started, 3)
+        result["completed_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        return result
+
+    with open(output_path, "a") as out, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = set()
+
+        def collect(block):
+            nonlocal in_flight
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED if block else ALL_COMPLETED)
+            for future in finished:
+                result = future.result()
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+                stats[result["status"]] += 1
+            answered = stats["ok"] + stats["error"]
+            if answered and (answered % 25 == 0 or not in_flight):
+                elapsed = max(time.time() - start, 1e-6)
+                print(f"{answered}/{stats['total']} tickets, {answered / elapsed * 60:.1f} tickets/min")
+
+        for tickets in by_model.values():
+            stats["models"] += 1
+            model = tickets[0][1]["model"]
+            context = agent.build_context(model)
+            for key, ticket in tickets:
+                messages = agent.build_messages(context, ticket["model"], ticket["symptoms"], ticket.get("serial"))
+                in_flight.add(executor.submit(answer, key, ticket, messages))
+                # Backpressure: don't build contexts far ahead of the workers
+                while len(in_flight) >= concurrency * 2:
+                    collect(block=True)
+        if in_flight:
+            collect(block=False)
+
+    stats["seconds"] = round(time.time() - start, 2)
+    stats["tickets_per_minute"] = round((stats["ok"] + stats["error"]) / max(stats["seconds"], 1e-6) * 60, 1)
+    print(
+        f"Answered {stats['ok']} tickets ({stats['error']} errors) for {stats['models']} models "
+        f"in {stats['seconds']}s: {stats['tickets_per_minute']} tickets/min"
+    )
+    return stats
+
 def main():
+    parser = argparse.ArgumentParser(description="Haas CNC service assistant (interactive, or batch over a JSONL ticket file)")
+    parser.add_argument("--db", default="masterData.sqlite3", help="Path to masterData.sqlite3")
+    parser.add_argument("--batch", metavar="TICKETS_JSONL", help="Answer every ticket in this JSONL file")
+    parser.add_argument("--output", help="Results JSONL (appended to; default <tickets>.results.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent completion requests")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Maximum completion requests per minute")
+    parser.add_argument("--tokens-per-minute", type=float, default=None, help="Maximum completion tokens per minute")
+    args = parser.parse_args()
+
+    if args.batch:
+        agent = SpecializedGPTAgent(args.db, requests_per_minute=args.rate_limit, tokens_per_minute=args.tokens_per_minute)
+        output = args.output or os.path.splitext(args.batch)[0] + ".results.jsonl"
+        run_batch(agent, args.batch, output, concurrency=max(args.concurrency, 1))
+        return
+
     print("Specialized GPT Agent for Haas CNC Service Assistance")
     model = input("Enter the machine model (e.g., VF-4): ").strip()
     symptoms = input("Enter the symptoms or issues observed: ").strip()
     
-    agent = SpecializedGPTAgent()
+    agent = SpecializedGPTAgent(args.db)
     response = agent.generate_response(model, symptoms)
     
     print("\n--- GPT Analysis & Recommendations ---\n")
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Retrieval quality vs latency for index configurations.
+
+build_context_with_embeddings() only ever ran inside live chats, so nothing told us whether a
+retrieval change (backend, quantization, truncated search dimensions, chunking, deduplication,
+MMR, lexical-only fallback) found better or worse reports.  This harness runs a labeled query set
+against each configuration and prints one comparison row per configuration:
+
+- recall@k: share of a query's relevant reports among its top k hits (out of min(k, relevant),
+  so a query with 40 relevant reports can still reach 1.0); a deduplicated hit covers its group
+- MRR: mean reciprocal rank of the first hit that is relevant
+- p50/p95 latency of hybrid_retriever.search() (query embeddings are computed beforehand) and
+  of the whole build_context_with_embeddings()
+- vectors stored, on-disk index size (without the embedding cache) and the serving process's
+  resident memory, plus how much of it the store and caches added after import
+
+Labels are JSON lines {"query", "model", "serial", "source_id", "relevant": [report ids]}.  With
+no --labels file one is derived from the database itself: a sampled report's WorkRequired text is
+the query, and the other reports of the same model whose WorkRequired has a token-set Jaccard
+similarity of at least --min-similarity (issue_summary.issue_tokens) are relevant.  The source
+report stays in the index but is removed from the hits before scoring, so it is held out.
+
+Everything is offline: embeddings come from stub_openai.py (hashed bag-of-words vectors, so
+scores compare configurations rather than the real model) and each index is built once per
+settings that change it under --workdir and reused incrementally.  The app reads its settings at
+import time, so every configuration is indexed and then queried in fresh subprocesses (which also
+keeps indexing out of the memory numbers).
+
+    python evaluate_retrieval.py --reports 20000 --configs mmap,mmap-int8,mmap-256d,lexical
+    python evaluate_retrieval.py --db ../masterData.sqlite3 --configs chroma,mmap --no-stub
+    python evaluate_retrieval.py --define "wide:VECTOR_BACKEND=mmap,MMR_LAMBDA=0.3" --configs mmap,wide
+
+Results are written like run_benchmarks.py's, so two runs compare with run_benchmarks.py --compare.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from run_benchmarks import BENCHMARK_DIR, RESULTS_SCHEMA, git_revision, prepare_dataset, summarize
+from stub_openai import StubConfig, StubOpenAIServer
+
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'chatbot_ui'))
+from issue_summary import issue_tokens, jaccard
+
+# Settings per configuration; use_vector=0 ranks on the lexical side alone
+CONFIGURATIONS = {
+    "chroma": {"VECTOR_BACKEND": "chroma"},
+    "mmap": {"VECTOR_BACKEND": "mmap"},
+    "mmap-int8": {"VECTOR_BACKEND": "mmap", "VECTOR_DTYPE": "int8"},
+    "mmap-256d": {"VECTOR_BACKEND": "mmap", "VECTOR_SEARCH_DIMS": "256"},
+    "mmap-chunked": {"VECTOR_BACKEND": "mmap", "CHUNKED_RETRIEVAL": "1"},
+    "mmap-dedup": {"VECTOR_BACKEND": "mmap", "DEDUP_REPORTS": "1"},
+    "mmap-no-mmr": {"VECTOR_BACKEND": "mmap", "MMR_LAMBDA": "1"},
+    "lexical": {"VECTOR_BACKEND": "mmap", "use_vector": "0"},
+}
+# Only these settings change what gets indexed; configurations that agree on them share an index
+INDEX_SETTINGS = ("VECTOR_BACKEND", "VECTOR_DTYPE", "CHUNKED_RETRIEVAL", "DEDUP_REPORTS")
+INDEX_DEFAULTS = {"VECTOR_BACKEND": "chroma", "VECTOR_DTYPE": "float16", "CHUNKED_RETRIEVAL": "0", "DEDUP_REPORTS": "0"}
+
+
+def generate_labels(db_path, count=200, seed=0, min_similarity=0.5, fetch_size=5000):
+    """
+    Pseudo-labeled queries from the database: [{"query", "model", "serial", "source_id", "relevant"}],
+    relevant reports best match first.  Queries without any relevant report are dropped.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    try:
+        max_rowid = conn.execute("SELECT MAX(rowid) FROM ServiceReports").fetchone()[0] or 0
+        sources, attempts = {}, 0
+        while len(sources) < count * 2 and attempts < count * 20 and max_rowid:
+            attempts += 1
+            row = conn.execute(
+                "SELECT CAST(ServiceReport_id AS TEXT), Model, WorkRequired FROM ServiceReports "
+                "WHERE rowid >= ? AND WorkRequired IS NOT NULL AND WorkRequired != '' AND Model IS NOT NULL LIMIT 1",
+                (rng.randint(1, max_rowid),)
+            ).fetchone()
+            if row is not None and row[0] not in sources:
+                tokens = issue_tokens(row[2], "")
+                if tokens:
+                    sources[row[0]] = (row[1], row[2], tokens)
+
+        # One pass over the reports, each compared with the sampled queries of its model
+        by_model = {}
+        for source_id, (model, _, tokens) in sources.items():
+            by_model.setdefault(model, []).append((source_id, tokens))
+        relevant = {source_id: [] for source_id in sources}
+        cursor = conn.execute(
+            "SELECT CAST(ServiceReport_id AS TEXT), Model, WorkRequired FROM ServiceReports WHERE WorkRequired IS NOT NULL"
+        )
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for report_id, model, work_required in rows:
+                queries = by_model.get(model)
+                if not queries:
+                    continue
+                tokens = issue_tokens(work_required, "")
+                for source_id, source_tokens in queries:
+                    if report_id != source_id:
+                        similarity = jaccard(tokens, source_tokens)
+                        if similarity >= min_similarity:
+                            relevant[source_id].append((similarity, report_id))
+    finally:
+        conn.close()
+
+    labels = []
+    for source_id, (model, work_required, _) in sources.items():
+        if relevant[source_id] and len(labels) < count:
+            ranked = sorted(relevant[source_id], key=lambda r: (-r[0], r[1]))
+            labels.append({
+                "query": work_required, "model": model, "serial": "", "source_id": source_id,
+                "relevant": [report_id for _, report_id in ranked],
+            })
+    return labels
+
+
+def load_labels(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_labels(path, labels):
+    with open(path, "w") as f:
+        for label in labels:
+            f.write(json.dumps(label) + "\n")
+
+
+def score_query(hits, label, ks):
+    """{recall@k..., rr} for one query's hits, with the held-out source report removed"""
+    relevant = {str(r) for r in label["relevant"]}
+    source_id = str(label.get("source_id") or "")
+    retrieved = []
+    for hit in hits:
+        covered = {str(hit["report_id"])} | {str(d) for d in hit.get("duplicates") or ()}
+        covered.discard(source_id)
+        if covered:
+            retrieved.append(covered)
+    scores = {}
+    for k in ks:
+        found = set().union(*retrieved[:k]) & relevant if retrieved[:k] else set()
+        scores[f"recall@{k}"] = min(len(found) / min(k, len(relevant)), 1.0)
+    first = next((rank for rank, covered in enumerate(retrieved, start=1) if covered & relevant), None)
+    scores["rr"] = 1.0 / first if first else 0.0
+    return scores
+
+
+def rss_mb():
+    """Current resident memory of this process (peak where /proc isn't available)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def directory_mb(path, exclude=("embedding_cache.sqlite3",)):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            if not any(name.startswith(e) for e in exclude):
+                total += os.path.getsize(os.path.join(root, name))
+    return round(total / (1024 * 1024), 2)
+
+
+def index_key(settings):
+    """Directory name for the index a configuration reads, e.g. mmap-int8-dedup"""
+    settings = dict(INDEX_DEFAULTS, **settings)
+    key = settings["VECTOR_BACKEND"]
+    if key == "mmap":
+        key += "-" + settings["VECTOR_DTYPE"]
+    if settings["CHUNKED_RETRIEVAL"] == "1":
+        key += "-chunked"
+    if settings["DEDUP_REPORTS"] == "1":
+        key += "-dedup"
+    return key
+
+
+def worker_index():
+    import app
+    start = time.perf_counter()
+    stats = app.index_service_reports()
+    return {"seconds": round(time.perf_counter() - start, 3), "scanned": stats.get("scanned", 0),
+            "embedded": stats.get("embedded", 0), "failed": stats.get("failed", 0)}
+
+
+def worker_query(labels, ks, use_vector, warmup=5):
+    import app
+    baseline = rss_mb()
+    conn = app.connect_database()
+    vectors = app.service_reports_collection.instance().count() if use_vector else 0
+    use_vector = use_vector and app.vector_index_ready()
+    embeddings = [app.generate_embedding(q["query"]) if use_vector else None for q in labels]
+    n_results = max(ks) + 1  # Room for the held-out source report
+
+    def search(q, embedding):
+        return app.hybrid_retriever.search(
+            conn, q["query"], model=q.get("model") or None, serial=q.get("serial") or None,
+            n_results=n_results, query_embedding=embedding, use_vector=use_vector
+        )
+
+    for q, embedding in list(zip(labels, embeddings))[:warmup]:
+        search(q, embedding)
+    latencies, context_latencies, scores = [], [], []
+    for q, embedding in zip(labels, embeddings):
+        start = time.perf_counter()
+        hits = search(q, embedding)
+        latencies.append(time.perf_counter() - start)
+        scores.append(score_query(hits, q, ks))
+        if use_vector:
+            start = time.perf_counter()
+            app.build_context_with_embeddings(q.get("model") or None, q.get("serial") or None, q["query"], embedding)
+            context_latencies.append(time.perf_counter() - start)
+
+    quality = {name: round(float(np.mean([s[name] for s in scores])), 4) for name in scores[0]} if scores else {}
+    if "rr" in quality:
+        quality["mrr"] = quality.pop("rr")
+    rss = rss_mb()
+    return {
+        "queries": len(labels),
+        "vector": use_vector,
+        "vectors": vectors,
+        "quality": quality,
+        "search": summarize(latencies),
+        "build_context_with_embeddings": summarize(context_latencies),
+        "memory": {"rss_mb": rss, "rss_added_mb": round(rss - baseline, 1)},
+    }
+
+
+def run_worker(args):
+    """Runs in a subprocess whose environment already holds the configuration"""
+    if args.worker == "index":
+        result = worker_index()
+    else:
+        ks = sorted({int(k) for k in args.k.split(",")})
+        result = worker_query(load_labels(args.labels), ks, args.use_vector)
+    with open(args.result, "w") as f:
+        json.dump(result, f)
+
+
+def run_configuration(phase, name, env, args, labels_path, result_path):
+    command = [sys.executable, os.path.abspath(__file__), "--worker", phase, "--result", result_path,
+               "--labels", labels_path, "--k", args.k]
+    if env.get("use_vector", "1") == "0":
+        command.append("--lexical")
+    child_env = dict(os.environ, **{k: v for k, v in env.items() if k.isupper()})
+    completed = subprocess.run(command, env=child_env, cwd=BENCHMARK_DIR)
+    if completed.returncode != 0:
+        print(f"{name}: {phase} failed with exit code {completed.returncode}")
+        return None
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def parse_definitions(definitions):
+    """'name:VAR=value,VAR=value' -> {name: {VAR: value}}"""
+    configurations = {}
+    for definition in definitions:
+        name, _, settings = definition.partition(":")
+        configurations[name.strip()] = dict(
+            (s.split("=", 1)[0].strip(), s.split("=", 1)[1].strip()) for s in settings.split(",") if "=" in s
+        )
+    return configurations
+
+
+def print_table(results, ks):
+    columns = [f"R@{k}" for k in ks] + ["MRR", "p50 ms", "p95 ms", "ctx p95", "vectors", "index MB", "RSS MB"]
+    width = max([len(name) for name in results] + [6])
+    print(f"{'config':<{width}} " + " ".join(f"{c:>8}" for c in columns))
+    for name, result in results.items():
+        if "quality" not in result:
+            print(f"{name:<{width}} failed")
+            continue
+        quality = result["quality"]
+        values = [quality.get(f"recall@{k}", 0) for k in ks] + [quality.get("mrr", 0)]
+        context = result["build_context_with_embeddings"]
+        cells = [f"{v:>8.3f}" for v in values] + [
+            f"{result['search'].get('p50_ms', 0):>8.2f}", f"{result['search'].get('p95_ms', 0):>8.2f}",
+            f"{context['p95_ms']:>8.2f}" if context.get("count") else f"{'-':>8}",
+            f"{result['vectors']:>8}", f"{result['index_mb']:>8.1f}", f"{result['memory']['rss_mb']:>8.1f}",
+        ]
+        print(f"{name:<{width}} " + " ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare retrieval quality and latency across index configurations")
+    parser.add_argument("--configs", default="mmap,mmap-int8,mmap-256d,mmap-dedup,lexical",
+                        help=f"Comma-separated configurations: {', '.join(CONFIGURATIONS)} or --define'd ones")
+    parser.add_argument("--define", action="append", default=[], metavar="NAME:VAR=VALUE,...",
+                        help="Add a configuration from app settings (use_vector=0 for lexical only)")
+    parser.add_argument("--db", default=None, help="Evaluate on this database instead of a synthetic one")
+    parser.add_argument("--reports", type=int, default=10000, help="Synthetic service reports")
+    parser.add_argument("--machines", type=int, default=None, help="Synthetic machines (default reports / 20)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for data and query sampling")
+    parser.add_argument("--regenerate", action="store_true", help="Rebuild the database even if a matching one exists")
+    parser.add_argument("--workdir", default=os.path.join(BENCHMARK_DIR, ".work"), help="Database and index location")
+    parser.add_argument("--labels", default=None, help="Labeled queries (JSON lines); generated here if missing")
+    parser.add_argument("--queries", type=int, default=200, help="Queries to generate")
+    parser.add_argument("--min-similarity", type=float, default=0.5, help="WorkRequired Jaccard for a generated label")
+    parser.add_argument("--k", default="1,5,10", help="Comma-separated cutoffs for recall@k")
+    parser.add_argument("--reindex", action="store_true", help="Build every index from empty")
+    parser.add_argument("--no-stub", action="store_true", help="Use the OPENAI_BASE_URL/OPENAI_API_KEY already set")
+    parser.add_argument("--output", default=os.path.join(BENCHMARK_DIR, "results"), help="Directory for result JSON")
+    parser.add_argument("--label", default="retrieval", help="Name for this run, used in the result file name")
+    parser.add_argument("--worker", choices=["index", "query"], help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    parser.add_argument("--lexical", dest="use_vector", action="store_false", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    configurations = dict(CONFIGURATIONS, **parse_definitions(args.define))
+    names = [n.strip() for n in args.configs.split(",") if n.strip()]
+    unknown = [n for n in names if n not in configurations]
+    if unknown:
+        parser.error(f"Unknown configuration(s): {', '.join(unknown)}")
+    ks = sorted({int(k) for k in args.k.split(",")})
+
+    started = datetime.now(timezone.utc)
+    if args.db:
+        db_path = os.path.abspath(args.db)
+        workdir = os.path.join(args.workdir, "db-" + hashlib.sha256(db_path.encode("utf-8")).hexdigest()[:8])
+        dataset = {"path": db_path}
+        os.makedirs(workdir, exist_ok=True)
+    else:
+        workdir = os.path.join(args.workdir, f"r{args.reports}-s{args.seed}")
+        os.makedirs(workdir, exist_ok=True)
+        db_path, dataset = prepare_dataset(args, workdir)
+
+    labels_path = args.labels or os.path.join(workdir, f"labels-q{args.queries}-s{args.seed}-j{args.min_similarity:g}.jsonl")
+    if os.path.exists(labels_path):
+        labels = load_labels(labels_path)
+        print(f"Loaded {len(labels)} labeled queries from {labels_path}")
+    else:
+        start = time.time()
+        labels = generate_labels(db_path, args.queries, args.seed, args.min_similarity)
+        write_labels(labels_path, labels)
+        print(f"Generated {len(labels)} labeled queries in {time.time() - start:.1f}s: {labels_path}")
+    if not labels:
+        print("No labeled queries; lower --min-similarity")
+        return
+
+    stub = None
+    base_env = {"HAAS_DB_PATH": db_path, "INDEX_ON_STARTUP": "0", "ANSWER_CACHE_SIZE": "0"}
+    if not args.no_stub:
+        stub = StubOpenAIServer(config=StubConfig(embedding_latency=0.0, embedding_latency_per_input=0.0, seed=args.seed)).start()
+        base_env.update(OPENAI_BASE_URL=stub.base_url, OPENAI_API_KEY="stub")
+        print(f"Stub OpenAI API on {stub.base_url}")
+
+    results, indexed = {}, {}
+    try:
+        for name in names:
+            settings = configurations[name]
+            key = index_key(settings)
+            vector_dir = os.path.join(workdir, f"eval-index-{key}")
+            env = dict(base_env, VECTOR_DB_DIR=vector_dir, INDEX_SNAPSHOT_DIR=os.path.join(vector_dir, "snapshots"), **settings)
+            result_path = os.path.join(workdir, f"eval-{name}.json")
+            if key not in indexed:
+                if args.reindex:
+                    shutil.rmtree(vector_dir, ignore_errors=True)
+                print(f"{name}: indexing into {vector_dir}")
+                indexed[key] = run_configuration("index", name, env, args, labels_path, result_path)
+            if indexed[key] is None:
+                results[name] = {"settings": settings, "error": "indexing failed"}
+                continue
+            print(f"{name}: querying")
+            result = run_configuration("query", name, env, args, labels_path, result_path)
+            if result is None:
+                results[name] = {"settings": settings, "error": "querying failed"}
+                continue
+            result.update(settings=settings, index=key, index_mb=directory_mb(vector_dir), indexing=indexed[key])
+            results[name] = result
+    finally:
+        if stub is not None:
+            stub.stop()
+
+    print()
+    print_table(results, ks)
+
+    report = {
+        "schema": RESULTS_SCHEMA,
+        "label": args.label,
+        "timestamp": started.isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "config": {"configs": names, "k": ks, "queries": len(labels), "min_similarity": args.min_similarity,
+                   "labels": os.path.abspath(labels_path)},
+        "stub": stub.config.as_dict() if stub is not None else None,
+        "dataset": dataset,
+        "results": results,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    name = "-".join(filter(None, [started.strftime("%Y%m%dT%H%M%SZ"), report["git"]["commit"], args.label]))
+    path = os.path.join(args.output, name + ".json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+Load benchmarks for the chatbot against a synthetic database and a local OpenAI stand-in.
+
+Measures, in order (each can be skipped):
+
+1. dataset: generate the synthetic database (synthetic_db.py) and build the catalog, FTS index and
+   issue summary; reused across runs with the same --reports/--machines/--seed.
+2. indexing: index_service_reports() into an empty vector store, then again with nothing changed
+   (the incremental no-op pass every later run pays).
+3. context: build_context() and build_context_with_embeddings() latency over sampled queries,
+   with query embeddings computed beforehand so only retrieval and rendering are timed.
+4. chat: end-to-end POST /chat (or /chat/stream) under closed-loop concurrent load, with
+   p50/p95/p99 latency, throughput and the mean time per instrumented stage.
+
+The OpenAI API is replaced by stub_openai.py (latency set with --embedding-latency,
+--chat-latency, --token-latency; --error-rate answers a share of calls with 429 to exercise the
+gateway's retries), so runs are repeatable and free.  Each run writes one JSON file
+to --output named after the time, commit and --label; compare two of them with --compare:
+
+    python run_benchmarks.py --reports 100000 --concurrency 1,8,32 --label baseline
+    python run_benchmarks.py --compare results/A.json results/B.json
+
+Everything runs in this process: the Flask app (or with --server asgi, the ASGI app under
+uvicorn) is served on a local port.  --url sends the chat load to an already running server
+instead; it should be started against the same database, vector store and stub.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'chatbot_ui'))
+
+from stub_openai import StubConfig, StubOpenAIServer
+from synthetic_db import describe, generate, prepare, sample_queries
+
+RESULTS_SCHEMA = 1
+
+
+def summarize(seconds):
+    """Latency summary in milliseconds"""
+    if not seconds:
+        return {"count": 0}
+    values = np.asarray(seconds, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCHMARK_DIR, capture_output=True, text=True
+        ).stdout.strip() != ""
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def prepare_dataset(args, workdir):
+    db_path = os.path.join(workdir, "masterData.sqlite3")
+    wanted = {"reports": args.reports, "machines": args.machines or max(args.reports // 20, 10), "seed": args.seed}
+    existing = describe(db_path)
+    if existing and not args.regenerate and all(existing.get(k) == v for k, v in wanted.items()):
+        print(f"Reusing synthetic database {db_path}")
+        return db_path, dict(existing, reused=True)
+    dataset = generate(db_path, args.reports, args.machines, args.seed)
+    dataset.update(prepare(db_path))
+    dataset["reused"] = False
+    return db_path, dataset
+
+
+def configure_app_environment(args, db_path, vector_dir, stub):
+    """The app reads these at import time, so set them before importing it"""
+    os.environ["HAAS_DB_PATH"] = db_path
+    os.environ["VECTOR_DB_DIR"] = vector_dir
+    os.environ["VECTOR_BACKEND"] = args.vector_backend
+    os.environ["INDEX_ON_STARTUP"] = "0"
+    os.environ["CHUNKED_RETRIEVAL"] = "1" if args.chunked else "0"
+    os.environ["DEDUP_REPORTS"] = "1" if args.dedup else "0"
+    if not args.answer_cache:
+        os.environ["ANSWER_CACHE_SIZE"] = "0"
+    if stub is not None:
+        os.environ["OPENAI_BASE_URL"] = stub.base_url
+        os.environ["OPENAI_API_KEY"] = "stub"
+
+
+def stub_counts(stub):
+    return stub.stats.snapshot() if stub is not None else {}
+
+
+def count_delta(before, after):
+    return {k: after[k] - before.get(k, 0) for k in after if k != "peak_in_flight" and after[k] != before.get(k, 0)}
+
+
+def run_indexing(app, stub):
+    results = {}
+    for name in ("initial", "incremental"):
+        before = stub_counts(stub)
+        start = time.perf_counter()
+        stats = app.index_service_reports()
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            "seconds": round(elapsed, 3),
+            "scanned": stats.get("scanned", 0),
+            "embedded": stats.get("embedded", 0),
+            "failed": stats.get("failed", 0),
+            "rows_per_sec": round(stats.get("scanned", 0) / max(elapsed, 1e-9), 1),
+            "embedded_per_sec": round(stats.get("embedded", 0) / max(elapsed, 1e-9), 1),
+            "api_calls": count_delta(before, stub_counts(stub)),
+        }
+        if "duplicates" in stats:
+            results[name]["duplicates"] = stats["duplicates"]
+            results[name]["groups"] = stats.get("groups")
+        print(f"Indexing ({name}): {results[name]}")
+    return results
+
+
+def run_context(app, queries, warmup=5):
+    embeddings = [app.generate_embedding(q["query"]) for q in queries]
+    for q, embedding in list(zip(queries, embeddings))[:warmup]:
+        app.build_context(q["model"], q["serial"])
+        app.build_context_with_embeddings(q["model"], q["serial"], q["query"], embedding)
+
+    plain, retrieval = [], []
+    candidates = []
+    for q, embedding in zip(queries, embeddings):
+        start = time.perf_counter()
+        app.build_context(q["model"], q["serial"])
+        plain.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        _, found = app.build_context_with_embeddings(q["model"], q["serial"], q["query"], embedding)
+        retrieval.append(time.perf_counter() - start)
+        candidates.append(len(found))
+    results = {
+        "build_context": summarize(plain),
+        "build_context_with_embeddings": dict(
+            summarize(retrieval), vector_ready=app.vector_index_ready(), mean_candidates=round(float(np.mean(candidates)), 2)
+        ),
+    }
+    print(f"Context: {results}")
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LocalServer:
+    """The Flask app (werkzeug, threaded) or the ASGI app (uvicorn) on a daemon thread"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.port = free_port()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        if self.kind == "asgi":
+            try:
+                import uvicorn
+            except ImportError:
+                sys.exit("--server asgi needs uvicorn (pip install uvicorn)")
+            import asgi
+            config = uvicorn.Config(asgi.application, host="127.0.0.1", port=self.port, log_level="warning", lifespan="off")
+            self._server = uvicorn.Server(config)
+            threading.Thread(target=self._server.run, name="bench-asgi", daemon=True).start()
+            deadline = time.time() + 30
+            while not self._server.started and time.time() < deadline:
+                time.sleep(0.05)
+        else:
+            from werkzeug.serving import WSGIRequestHandler, make_server
+            import app
+
+            class QuietHandler(WSGIRequestHandler):
+                def log_request(self, *args, **kwargs):
+                    pass
+
+            self._server = make_server("127.0.0.1", self.port, app.app, threaded=True, request_handler=QuietHandler)
+            threading.Thread(target=self._server.serve_forever, name="bench-flask", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.kind == "asgi":
+            self._server.should_exit = True
+        else:
+            self._server.shutdown()
+
+
+def post_chat(url, body, stream, timeout):
+    """One request: (seconds, seconds to first token or None, response JSON or None, error or None)"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    start = time.perf_counter()
+    try:
+        conn.request(
+            "POST", "/chat/stream" if stream else "/chat", body=json.dumps(body),
+            headers={"Content-Type": "application/json"}
+        )
+        response = conn.getresponse()
+        if response.status != 200:
+            response.read()
+            return time.perf_counter() - start, None, None, f"HTTP {response.status}"
+        if not stream:
+            payload = json.loads(response.read())
+            elapsed = time.perf_counter() - start
+            error = payload["response"] if payload.get("response", "").startswith("Error") else None
+            return elapsed, None, payload, error
+        first_token, event, meta, error = None, None, {}, None
+        for raw in response:
+            line = raw.decode("utf-8").rstrip("\r\n")
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                data = json.loads(line[6:])
+                if event == "token" and first_token is None:
+                    first_token = time.perf_counter() - start
+                elif event == "meta":
+                    meta = data
+                elif event == "error":
+                    error = data.get("message")
+        return time.perf_counter() - start, first_token, meta, error
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        return time.perf_counter() - start, None, None, f"{e.__class__.__name__}: {e}"
+    finally:
+        conn.close()
+
+
+def run_conversation(url, query, turns, stream, timeout):
+    """One client conversation: the first turn opens a session, follow-ups reuse it"""
+    results = []
+    session_id = None
+    for turn in range(turns):
+        message = query["query"] if turn == 0 else f"Follow-up {turn}: what else should I check for {query['model']}?"
+        if turns == 1:
+            body = {"model": query["model"], "serial": query["serial"], "conversation": [{"role": "user", "content": message}]}
+        else:
+            body = {"model": query["model"], "serial": query["serial"], "message": message}
+            if session_id:
+                body["session_id"] = session_id
+        result = post_chat(url, body, stream, timeout)
+        results.append(result)
+        payload = result[2] or {}
+        session_id = payload.get("session_id") or session_id
+    return results
+
+
+def histogram_means(before, after, scale=1.0):
+    """Mean observation per label between two Histogram.snapshot()s"""
+    means = {}
+    for key, (count, total) in after.items():
+        prev_count, prev_total = before.get(key, (0, 0.0))
+        if count > prev_count:
+            means[key[0]] = round((total - prev_total) / (count - prev_count) * scale, 3)
+    return means
+
+
+def counter_delta(before, after):
+    """Increase per label (joined with "/") between two Counter.snapshot()s"""
+    return {"/".join(key) or "total": round(value - before.get(key, 0), 3) for key, value in after.items() if value != before.get(key, 0)}
+
+
+def run_chat(url, queries, concurrency, requests, turns, stream, timeout, in_process, stub):
+    from metrics import LLM_TOKENS, STAGE_SECONDS
+    from openai_gateway import COALESCED_TOTAL, RETRIES_TOTAL
+
+    conversations = [queries[i % len(queries)] for i in range(max(requests // turns, 1))]
+    # Warm up connections, lazy resources and caches outside the measurement
+    run_conversation(url, queries[-1], 1, stream, timeout)
+
+    stages_before = STAGE_SECONDS.snapshot() if in_process else {}
+    tokens_before = LLM_TOKENS.snapshot() if in_process else {}
+    retries_before, coalesced_before = RETRIES_TOTAL.snapshot(), COALESCED_TOTAL.snapshot()
+    calls_before = stub_counts(stub)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        finished = list(pool.map(lambda q: run_conversation(url, q, turns, stream, timeout), conversations))
+    wall = time.perf_counter() - start
+
+    results = [r for conversation in finished for r in conversation]
+    errors = [r[3] for r in results if r[3]]
+    ok = [r for r in results if not r[3]]
+    summary = {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "turns": turns,
+        "stream": stream,
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:3],
+        "cached": sum(1 for r in ok if (r[2] or {}).get("cached")),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(results) / max(wall, 1e-9), 2),
+        "latency": summarize([r[0] for r in ok]),
+        "api_calls": count_delta(calls_before, stub_counts(stub)),
+    }
+    if stream:
+        summary["first_token"] = summarize([r[1] for r in ok if r[1] is not None])
+    if in_process:
+        summary["stage_mean_ms"] = histogram_means(stages_before, STAGE_SECONDS.snapshot(), scale=1000)
+        summary["mean_tokens"] = histogram_means(tokens_before, LLM_TOKENS.snapshot())
+        summary["gateway_retries"] = counter_delta(retries_before, RETRIES_TOTAL.snapshot())
+        summary["gateway_coalesced"] = counter_delta(coalesced_before, COALESCED_TOTAL.snapshot())
+    print(f"Chat x{concurrency}: {summary['latency']} ({summary['throughput_rps']} req/s, {len(errors)} errors)")
+    return summary
+
+
+def flatten(results, prefix=""):
+    """Numeric leaves keyed by dotted path; chat runs are keyed by concurrency"""
+    flat = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            flat.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(results, list):
+        for item in results:
+            if isinstance(item, dict) and "concurrency" in item:
+                flat.update(flatten(item, f"{prefix}c{item['concurrency']}."))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        flat[prefix.rstrip(".")] = results
+    return flat
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    for name, run in (("old", old), ("new", new)):
+        print(f"{name}: {run.get('label') or ''} {run['git'].get('commit')} {run['timestamp']} "
+              f"({run['dataset'].get('reports')} reports, stub {run.get('stub', {}).get('chat_latency')}s chat latency)")
+    if old.get("config") != new.get("config"):
+        print("Note: the runs were made with different settings")
+    old_flat, new_flat = flatten(old["results"]), flatten(new["results"])
+    width = max((len(k) for k in old_flat), default=10)
+    print(f"{'metric':<{width}} {'old':>12} {'new':>12} {'change':>9}")
+    for key in sorted(set(old_flat) & set(new_flat)):
+        a, b = old_flat[key], new_flat[key]
+        change = f"{(b - a) / a * 100:+.1f}%" if a else ""
+        print(f"{key:<{width}} {a:>12g} {b:>12g} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark indexing, context building and /chat on synthetic data")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files and exit")
+    parser.add_argument("--reports", type=int, default=10000, help="Synthetic service reports")
+    parser.add_argument("--machines", type=int, default=None, help="Synthetic machines (default reports / 20)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for data and query sampling")
+    parser.add_argument("--regenerate", action="store_true", help="Rebuild the database even if a matching one exists")
+    parser.add_argument("--workdir", default=os.path.join(BENCHMARK_DIR, ".work"), help="Database and vector store location")
+    parser.add_argument("--vector-backend", default=os.getenv("VECTOR_BACKEND", "chroma"), choices=["chroma", "mmap"])
+    parser.add_argument("--chunked", action="store_true", help="Section-chunked retrieval (CHUNKED_RETRIEVAL=1)")
+    parser.add_argument("--dedup", action="store_true", help="Near-duplicate grouping (DEDUP_REPORTS=1)")
+    parser.add_argument("--skip", default="", help="Comma-separated stages to skip: indexing, context, chat")
+    parser.add_argument("--queries", type=int, default=200, help="Sampled queries for the context and chat stages")
+    parser.add_argument("--server", default="flask", choices=["flask", "asgi"], help="How to serve the app for the chat stage")
+    parser.add_argument("--url", default=None, help="Send chat load to this running server instead")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated client concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Chat requests per concurrency level")
+    parser.add_argument("--turns", type=int, default=1, help="Turns per conversation (>1 uses server-side sessions)")
+    parser.add_argument("--stream", action="store_true", help="Use /chat/stream and record time to first token")
+    parser.add_argument("--answer-cache", action="store_true", help="Leave the semantic answer cache on")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request client timeout in seconds")
+    parser.add_argument("--no-stub", action="store_true", help="Use the OPENAI_BASE_URL/OPENAI_API_KEY already set")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Stub seconds per embeddings request")
+    parser.add_argument("--chat-latency", type=float, default=0.4, help="Stub seconds to the first chat token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Stub seconds per further chat token")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="Stub words per chat answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of stub requests answered with 429")
+    parser.add_argument("--output", default=os.path.join(BENCHMARK_DIR, "results"), help="Directory for result JSON")
+    parser.add_argument("--label", default="", help="Name for this run, used in the result file name")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    skip = {s.strip() for s in args.skip.split(",") if s.strip()}
+    workdir = os.path.join(args.workdir, f"r{args.reports}-s{args.seed}")
+    os.makedirs(workdir, exist_ok=True)
+    started = datetime.now(timezone.utc)
+    db_path, dataset = prepare_dataset(args, workdir)
+
+    stub = None
+    if not args.no_stub:
+        stub = StubOpenAIServer(config=StubConfig(
+            embedding_latency=args.embedding_latency, chat_latency=args.chat_latency,
+            token_latency=args.token_latency, answer_tokens=args.answer_tokens, error_rate=args.error_rate,
+            seed=args.seed,
+        )).start()
+        print(f"Stub OpenAI API on {stub.base_url}")
+
+    # Indexing is measured from an empty vector store every run
+    vector_dir = os.path.join(workdir, f"vectordb-{args.vector_backend}")
+    if "indexing" not in skip:
+        shutil.rmtree(vector_dir, ignore_errors=True)
+    configure_app_environment(args, db_path, vector_dir, stub)
+    import app
+
+    results = {}
+    if "indexing" not in skip:
+        results["indexing"] = run_indexing(app, stub)
+
+    queries = sample_queries(db_path, args.queries, seed=args.seed)
+    if "context" not in skip:
+        results.update(run_context(app, queries))
+
+    if "chat" not in skip:
+        server = None
+        url = args.url
+        if url is None:
+            server = LocalServer(args.server).start()
+            url = server.url
+        try:
+            results["chat"] = [
+                run_chat(url, queries, int(c), args.requests, max(args.turns, 1), args.stream, args.timeout,
+                         in_process=server is not None, stub=stub)
+                for c in args.concurrency.split(",") if c.strip()
+            ]
+        finally:
+            if server is not None:
+                server.stop()
+
+    report = {
+        "schema": RESULTS_SCHEMA,
+        "label": args.label,
+        "timestamp": started.isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output", "label", "workdir", "regenerate")},
+        "stub": stub.config.as_dict() if stub is not None else None,
+        "dataset": dataset,
+        "results": results,
+    }
+    if stub is not None:
+        report["stub_totals"] = stub.stats.snapshot()
+        stub.stop()
+
+    os.makedirs(args.output, exist_ok=True)
+    name = "-".join(filter(None, [started.strftime("%Y%m%dT%H%M%SZ"), report["git"]["commit"], args.label]))
+    path = os.path.join(args.output, name + ".json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI API, for benchmarks.
+
+Serves POST /v1/embeddings and POST /v1/chat/completions (plain and streamed) with simulated
+latency, so indexing and /chat can be measured without network variance or API cost:
+
+- Embeddings are deterministic hashed bag-of-words vectors (same text, same vector; texts that
+  share words are close), returned as floats or base64 like the real API.
+- Chat answers are a canned reply of --answer-tokens words with a usage block; streams send one
+  word per chunk after --chat-latency, then --token-latency per word.
+- --error-rate answers that share of requests with 429, to exercise client retries.
+
+    python stub_openai.py --port 8099 --embedding-latency 0.05 --chat-latency 0.4
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=stub python app.py
+
+GET /stats returns request counts and the peak number of requests in flight.
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+ANSWER_TEXT = (
+    "Based on similar service reports, start by checking the alarm history and the related connectors. "
+    "Earlier visits on this model resolved the issue by replacing the listed part and recalibrating. "
+    "Verify the repair with the warm-up program before returning the machine to production."
+).split()
+
+_WORD_RE = re.compile(r"[a-z0-9][a-z0-9\-]*")
+
+
+def hashed_embedding(text, dims):
+    """Unit vector with one signed bucket per word (plus adjacent word pairs)"""
+    vector = np.zeros(dims, dtype=np.float32)
+    words = _WORD_RE.findall(text.lower())
+    for feature in words + [a + " " + b for a, b in zip(words, words[1:])]:
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dims] += 1.0 if (h >> 31) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+class StubConfig:
+    def __init__(self, embedding_latency=0.05, embedding_latency_per_input=0.0005, chat_latency=0.4,
+                 token_latency=0.01, answer_tokens=120, dims=1536, jitter=0.2, error_rate=0.0, seed=None):
+        self.embedding_latency = embedding_latency
+        self.embedding_latency_per_input = embedding_latency_per_input
+        self.chat_latency = chat_latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.dims = dims
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    def delay(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds * (1 + self.jitter * (2 * self.random.random() - 1)))
+
+    def as_dict(self):
+        return {k: v for k, v in vars(self).items() if k != "random"}
+
+
+class StubStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def inc(self, key, amount=1):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts, peak_in_flight=self.peak_in_flight)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    @property
+    def stats(self):
+        return self.server.stats
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self.send_json(dict(self.stats.snapshot(), config=self.config.as_dict()))
+        else:
+            self.send_json({"error": {"message": "not found"}}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json({"error": {"message": "invalid JSON body"}}, status=400)
+            return
+
+        self.stats.begin()
+        try:
+            if self.config.error_rate and self.config.random.random() < self.config.error_rate:
+                self.stats.inc("rate_limited")
+                self.send_json(
+                    {"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}},
+                    status=429, headers={"Retry-After": "0.1"}
+                )
+            elif self.path.endswith("/embeddings"):
+                self.embeddings(payload)
+            elif self.path.endswith("/chat/completions"):
+                self.chat_completions(payload)
+            else:
+                self.send_json({"error": {"message": f"unsupported path {self.path}"}}, status=404)
+        finally:
+            self.stats.end()
+
+    def embeddings(self, payload):
+        texts = payload.get("input") or []
+        if isinstance(texts, str):
+            texts = [texts]
+        self.stats.inc("embedding_requests")
+        self.stats.inc("embedding_inputs", len(texts))
+        self.config.delay(self.config.embedding_latency + self.config.embedding_latency_per_input * len(texts))
+
+        dims = payload.get("dimensions") or self.config.dims
+        data = []
+        for i, text in enumerate(texts):
+            vector = hashed_embedding(text if isinstance(text, str) else " ".join(map(str, text)), dims)
+            if payload.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(str(t).split()) for t in texts)
+        self.send_json({
+            "object": "list", "data": data, "model": payload.get("model", "stub-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def chat_completions(self, payload):
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in payload.get("messages", [])) // 4
+        max_tokens = payload.get("max_tokens") or self.config.answer_tokens
+        words = [ANSWER_TEXT[i % len(ANSWER_TEXT)] for i in range(min(self.config.answer_tokens, max_tokens))]
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)}
+        completion_id = f"chatcmpl-stub{zlib.crc32(json.dumps(payload).encode('utf-8')):08x}"
+        base = {"id": completion_id, "created": int(time.time()), "model": payload.get("model", "stub-chat")}
+
+        if not payload.get("stream"):
+            self.stats.inc("chat_requests")
+            self.config.delay(self.config.chat_latency + self.config.token_latency * len(words))
+            self.send_json(dict(base, object="chat.completion", choices=[{
+                "index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop",
+            }], usage=usage))
+            return
+
+        self.stats.inc("chat_stream_requests")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(choices, **extra):
+            chunk = dict(base, object="chat.completion.chunk", choices=choices, **extra)
+            self.send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        self.config.delay(self.config.chat_latency)
+        event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for i, word in enumerate(words):
+            if i:
+                self.config.delay(self.config.token_latency)
+            event([{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            event([], usage=usage)
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.send_chunk(b"")
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, host="127.0.0.1", port=0, config=None):
+        super().__init__((host, port), StubHandler)
+        self.config = config or StubConfig()
+        self.stats = StubStats()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """Serve on a daemon thread; returns self"""
+        self._thread = threading.Thread(target=self.serve_forever, name="stub-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local OpenAI API stand-in with simulated latency")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embeddings request")
+    parser.add_argument("--embedding-latency-per-input", type=float, default=0.0005, help="Extra seconds per input text")
+    parser.add_argument("--chat-latency", type=float, default=0.4, help="Seconds to the first chat token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Seconds per further chat token")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="Words in each chat answer")
+    parser.add_argument("--dims", type=int, default=1536, help="Embedding dimensions")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency varies uniformly by +/- this fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        embedding_latency=args.embedding_latency, embedding_latency_per_input=args.embedding_latency_per_input,
+        chat_latency=args.chat_latency, token_latency=args.token_latency, answer_tokens=args.answer_tokens,
+        dims=args.dims, jitter=args.jitter, error_rate=args.error_rate,
+    )
+    server = StubOpenAIServer(args.host, args.port, config)
+    print(f"Stub OpenAI API on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
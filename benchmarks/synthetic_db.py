@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Synthetic masterData.sqlite3 for benchmarks.
+
+Generates Machines, ServiceReports and ServiceReportParts with the columns the app reads, at any
+scale, from a seeded random generator so the same arguments always produce the same database.
+Report text is assembled from per-component symptom / fix / part templates (with alarm codes and
+part numbers), so lexical search, vector search and issue clustering behave roughly as they do on
+real data: a few hundred recurring issues, each reported many times with varying wording.
+
+    python synthetic_db.py --db /tmp/bench.sqlite3 --reports 100000 --prepare
+
+--prepare also builds what a deployment has next to the raw tables: the model catalog and lookup
+indexes, the FTS5 lexical index, the alarm-code / part-number index, the per-machine timelines and
+the common-issue summary.
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chatbot_ui'))
+
+SCHEMA = """
+CREATE TABLE Machines (
+    Serial TEXT PRIMARY KEY,
+    Model TEXT,
+    Install_Date TEXT
+);
+CREATE TABLE ServiceReports (
+    ServiceReport_id INTEGER PRIMARY KEY,
+    Model TEXT,
+    Serial TEXT,
+    WorkRequired TEXT,
+    ServicePerformed TEXT,
+    VerificationTest TEXT,
+    Date TEXT,
+    Failure_Type TEXT,
+    ServiceType TEXT
+);
+CREATE TABLE ServiceReportParts (
+    ServiceReport_id INTEGER,
+    PartNumber TEXT,
+    Description TEXT
+);
+CREATE TABLE BenchmarkDataset (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+MODELS = [
+    "VF-1", "VF-2", "VF-2SS", "VF-3", "VF-4", "VF-4SS", "VF-5/40", "VF-6", "VF-10", "VF-12",
+    "Mini Mill", "DM-2", "DT-1", "TM-1P", "TM-2", "UMC-500", "UMC-750", "UMC-1000", "EC-400",
+    "GR-510", "ST-10", "ST-20", "ST-30", "ST-40", "DS-30Y",
+]
+
+# component: (symptoms, fixes, [(part number, description)])
+COMPONENTS = {
+    "spindle": (
+        ["Spindle will not orient, alarm 108", "Spindle noise at high RPM", "Spindle overheating after warm-up",
+         "Alarm 102 spindle drive fault during tool change", "Spindle drawbar not releasing tool"],
+        ["Replaced spindle encoder and recalibrated orientation", "Replaced spindle bearings and ran break-in",
+         "Adjusted drawbar force and replaced belleville springs", "Cleaned spindle cooling lines and replaced fan"],
+        [("32-0123", "Spindle encoder"), ("93-1000", "Drawbar spring set"), ("30-0400", "Spindle bearing kit")],
+    ),
+    "tool changer": (
+        ["Tool changer jammed, alarm 161", "Carousel will not rotate", "Tool changer double arm out of position",
+         "Alarm 116 tool in pocket not detected", "ATC slow to index"],
+        ["Realigned carousel and replaced index switch", "Replaced ATC motor and reset origin",
+         "Adjusted double arm to spindle alignment", "Replaced pocket sensor and cleaned carousel"],
+        [("62-0014", "ATC motor"), ("36-3002", "Carousel index switch"), ("20-7290", "Tool pocket")],
+    ),
+    "coolant": (
+        ["Coolant pump not running", "Low coolant pressure alarm 151", "Through-spindle coolant leaking",
+         "Coolant overflow at chip tray"],
+        ["Replaced coolant pump motor", "Replaced TSC seal and filter", "Cleared clogged coolant lines",
+         "Replaced coolant level sensor"],
+        [("30-3300", "Coolant pump motor"), ("59-9052", "TSC seal"), ("25-6640", "Coolant filter")],
+    ),
+    "axis": (
+        ["X axis overtravel, alarm 501", "Y axis servo overload alarm 154", "Z axis drifting on power down",
+         "Backlash on X axis over spec", "Axis motor overcurrent alarm 180"],
+        ["Replaced axis servo motor and re-set grid offset", "Replaced ballscrew support bearing",
+         "Reset travel limits and recalibrated home", "Replaced amplifier and checked cabling"],
+        [("62-0016", "Servo motor"), ("30-1219", "Ballscrew bearing"), ("32-5020", "Servo amplifier")],
+    ),
+    "hydraulics": (
+        ["Hydraulic pressure low, alarm 123", "Counterbalance losing pressure", "Hydraulic unit noisy"],
+        ["Recharged hydraulic counterbalance", "Replaced hydraulic pump and filter", "Replaced pressure switch"],
+        [("58-1650", "Hydraulic pump"), ("58-3140", "Pressure switch")],
+    ),
+    "electrical": (
+        ["Machine will not power on", "Low voltage alarm 160", "Control resets intermittently",
+         "Ground fault alarm 174"],
+        ["Replaced main power supply", "Repaired loose phase connection", "Replaced I/O PCB",
+         "Replaced control fan and cleaned cabinet"],
+        [("32-4080", "Power supply"), ("32-3083", "I/O PCB"), ("36-4020", "Cabinet fan")],
+    ),
+    "lubrication": (
+        ["Low lube alarm 135", "Way lube not dispensing", "Grease pump fault"],
+        ["Replaced lube pump and primed lines", "Replaced lube level switch", "Cleared blocked metering units"],
+        [("93-3253", "Lube pump"), ("36-3015", "Lube level switch")],
+    ),
+    "turret": (
+        ["Turret will not clamp, alarm 213", "Turret indexing to wrong station", "Turret crash damage"],
+        ["Adjusted turret clamp switch", "Replaced turret motor and re-set station 1", "Realigned turret and checked tools"],
+        [("62-0021", "Turret motor"), ("36-3090", "Turret clamp switch")],
+    ),
+}
+
+LATHE_COMPONENTS = ["turret", "spindle", "coolant", "axis", "hydraulics", "electrical", "lubrication"]
+MILL_COMPONENTS = ["spindle", "tool changer", "coolant", "axis", "hydraulics", "electrical", "lubrication"]
+
+NOTES = [
+    "", "", "Customer reports problem started after a crash.", "Intermittent, happens a few times a shift.",
+    "Machine in production, needs to be running by Monday.", "Second visit for this issue.",
+    "Operator noticed after moving machine.", "Shop is running two shifts.",
+]
+VERIFICATIONS = [
+    "Ran machine OK", "Ran warm-up program and customer part, no alarms", "Verified with test cut, within tolerance",
+    "Cycled 50 tool changes without fault", "Ran spindle through full RPM range, temperatures normal", "",
+]
+FAILURE_TYPES = ["Mechanical", "Electrical", "Operator", "Software", "Wear", ""]
+SERVICE_TYPES = ["Warranty", "Billable", "Preventive Maintenance", "Install", "Goodwill"]
+
+
+def components_for(model):
+    return LATHE_COMPONENTS if model.startswith(("ST-", "DS-")) else MILL_COMPONENTS
+
+
+def _random_date(rng, start, days):
+    return (start + timedelta(days=rng.randrange(days))).isoformat()
+
+
+def generate(db_path, reports=10000, machines=None, seed=0, batch_size=20000):
+    """Write a fresh synthetic database to db_path; returns a dict describing it"""
+    start = time.time()
+    rng = random.Random(seed)
+    machines = machines or max(reports // 20, 10)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.executescript(SCHEMA)
+
+        # Model popularity is skewed like a real installed base
+        weights = [1.0 / (i + 1) ** 0.6 for i in range(len(MODELS))]
+        fleet = []
+        for i in range(machines):
+            serial = str(1000000 + i * 7 + rng.randrange(7))
+            model = rng.choices(MODELS, weights)[0]
+            fleet.append((serial, model, _random_date(rng, date(2008, 1, 1), 15 * 365)))
+        conn.executemany("INSERT INTO Machines (Serial, Model, Install_Date) VALUES (?, ?, ?)", fleet)
+
+        report_rows, part_rows = [], []
+        parts_total = 0
+        for report_id in range(1, reports + 1):
+            serial, model, _ = fleet[rng.randrange(machines)]
+            component = rng.choice(components_for(model))
+            symptoms, fixes, parts = COMPONENTS[component]
+            symptom = rng.choice(symptoms)
+            fix = rng.choice(fixes)
+            note = rng.choice(NOTES)
+            work_required = f"{symptom}. {note}".strip()
+            service_performed = f"Diagnosed {component}. {fix}."
+            used = rng.sample(parts, rng.randrange(min(len(parts), 3) + 1))
+            if used:
+                service_performed += " Parts: " + ", ".join(p[0] for p in used) + "."
+            report_rows.append((
+                report_id, model, serial, work_required, service_performed, rng.choice(VERIFICATIONS),
+                _random_date(rng, date(2015, 1, 1), 10 * 365), rng.choice(FAILURE_TYPES), rng.choice(SERVICE_TYPES),
+            ))
+            part_rows.extend((report_id, number, description) for number, description in used)
+            if len(report_rows) >= batch_size:
+                parts_total += _flush(conn, report_rows, part_rows)
+        parts_total += _flush(conn, report_rows, part_rows)
+
+        description = {
+            "reports": reports, "machines": machines, "parts": parts_total, "seed": seed,
+            "generate_seconds": round(time.time() - start, 3),
+        }
+        conn.executemany(
+            "INSERT INTO BenchmarkDataset (key, value) VALUES (?, ?)",
+            [(k, json.dumps(v)) for k, v in description.items()]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"Generated {reports} reports for {machines} machines in {description['generate_seconds']:.1f}s: {db_path}")
+    return description
+
+
+def _flush(conn, report_rows, part_rows):
+    conn.executemany(
+        "INSERT INTO ServiceReports (ServiceReport_id, Model, Serial, WorkRequired, ServicePerformed, "
+        "VerificationTest, Date, Failure_Type, ServiceType) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        report_rows
+    )
+    conn.executemany("INSERT INTO ServiceReportParts (ServiceReport_id, PartNumber, Description) VALUES (?, ?, ?)", part_rows)
+    conn.commit()
+    count = len(part_rows)
+    report_rows.clear()
+    part_rows.clear()
+    return count
+
+
+def describe(db_path):
+    """The description stored by generate(), or None if db_path isn't a synthetic database"""
+    if not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT key, value FROM BenchmarkDataset").fetchall()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+    return {k: json.loads(v) for k, v in rows}
+
+
+def prepare(db_path):
+    """WAL, model catalog + indexes, FTS5, identifier index, machine timelines and issue summary, as a deployment would have; returns timings"""
+    from db_pool import enable_wal
+    from hybrid_search import bootstrap_fts
+    from identifier_index import bootstrap_identifiers
+    from issue_summary import refresh_summary
+    from machine_timeline import bootstrap_timeline
+    from model_catalog import bootstrap
+
+    timings = {}
+    enable_wal(db_path)
+    start = time.time()
+    bootstrap(db_path)
+    timings["catalog_seconds"] = round(time.time() - start, 3)
+
+    start = time.time()
+    bootstrap_fts(db_path)
+    timings["fts_seconds"] = round(time.time() - start, 3)
+
+    start = time.time()
+    bootstrap_identifiers(db_path)
+    timings["identifier_index_seconds"] = round(time.time() - start, 3)
+
+    start = time.time()
+    bootstrap_timeline(db_path)
+    timings["timeline_seconds"] = round(time.time() - start, 3)
+
+    start = time.time()
+    conn = sqlite3.connect(db_path)
+    try:
+        refresh_summary(conn, rebuild=True)
+    finally:
+        conn.close()
+    timings["issue_summary_seconds"] = round(time.time() - start, 3)
+    return timings
+
+
+def sample_queries(db_path, count=200, seed=0, serial_share=0.5):
+    """
+    Benchmark requests drawn from the database's own machines: [{"model", "serial", "query"}].
+    About serial_share of them name a serial number, the rest only the model.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    try:
+        max_rowid = conn.execute("SELECT MAX(rowid) FROM Machines").fetchone()[0] or 0
+        queries = []
+        while len(queries) < count and max_rowid:
+            row = conn.execute(
+                "SELECT Serial, Model FROM Machines WHERE rowid >= ? LIMIT 1", (rng.randint(1, max_rowid),)
+            ).fetchone()
+            if row is None:
+                continue
+            serial, model = row
+            component = rng.choice(components_for(model))
+            symptom = rng.choice(COMPONENTS[component][0])
+            question = rng.choice([
+                "{s}. What should I check first?",
+                "Customer says: {s}. How was this fixed before?",
+                "{s} - which parts were replaced on similar machines?",
+                "What causes {s_lower}?",
+            ]).format(s=symptom, s_lower=symptom.lower())
+            queries.append({"model": model, "serial": serial if rng.random() < serial_share else "", "query": question})
+        return queries
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic service report database for benchmarks")
+    parser.add_argument("--db", required=True, help="Output path (overwritten)")
+    parser.add_argument("--reports", type=int, default=10000, help="Number of service reports")
+    parser.add_argument("--machines", type=int, default=None, help="Number of machines (default reports / 20)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--prepare", action="store_true", help="Also build the catalog, FTS and identifier indexes and issue summary")
+    args = parser.parse_args()
+    generate(args.db, args.reports, args.machines, args.seed)
+    if args.prepare:
+        print(prepare(args.db))
+
+
+if __name__ == "__main__":
+    main()
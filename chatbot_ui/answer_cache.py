@@ -0,0 +1,162 @@
+"""
+Semantic answer cache for /chat.
+
+Technicians ask the same questions about the same machines all the time.  Answers are cached
+under (canonical model, serial, conversation shape) and matched by cosine similarity of the query
+embedding, so "VF-2 spindle won't orient" can be answered from a stored reply to "spindle won't
+orient on my VF2" without retrieval or a completion call.
+
+Entries expire after ttl_seconds, the cache is LRU-bounded to max_entries, and entries for a model
+are invalidated when new or changed service reports for that model are indexed (either directly
+via invalidate_model, or through the per-model update times the indexer records).
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from model_catalog import canonical_model, model_family
+
+
+def conversation_key(conversation):
+    """Length plus a digest of every turn before the latest user message"""
+    prior = conversation[:-1] if conversation else []
+    digest = hashlib.sha256()
+    for message in prior:
+        digest.update(f"{message.get('role')}\x00{message.get('content')}\x01".encode("utf-8"))
+    return len(conversation), digest.hexdigest()[:16]
+
+
+class SemanticAnswerCache:
+    def __init__(self, max_entries=5000, ttl_seconds=24 * 3600, threshold=0.95, model_update_times=None,
+                 refresh_seconds=30):
+        """
+        model_update_times: optional callable returning {model_family: unix time of last index change},
+        polled at most every refresh_seconds so indexing done by another process also invalidates.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.model_update_times = model_update_times
+        self.refresh_seconds = refresh_seconds
+        self._entries = OrderedDict()  # entry id -> entry
+        self._buckets = {}  # bucket key -> set of entry ids
+        self._updated = {}  # model family -> last invalidation time
+        self._updated_checked = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _bucket(model, serial, conversation):
+        # The exact model, not its family: a VF-4SS answer may not apply to a VF-4
+        return (canonical_model(model), (serial or "").strip(), conversation_key(conversation))
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _refresh_update_times(self):
+        if self.model_update_times is None or time.time() - self._updated_checked < self.refresh_seconds:
+            return
+        self._updated_checked = time.time()
+        try:
+            for family, updated in self.model_update_times().items():
+                if updated > self._updated.get(family, 0):
+                    self._updated[family] = updated
+        except Exception as e:
+            print(f"Warning: could not read model update times: {e}")
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            bucket = self._buckets.get(entry["bucket"])
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[entry["bucket"]]
+
+    def _is_stale(self, entry, now):
+        if now - entry["created"] > self.ttl_seconds:
+            return True
+        # "*" marks changes whose model is unknown (e.g. deleted reports) and applies to every family
+        updated = max(self._updated.get(model_family(entry["bucket"][0]), 0), self._updated.get("*", 0))
+        return entry["created"] < updated
+
+    def lookup(self, model, serial, conversation, embedding):
+        """Return a cached answer for a sufficiently similar query, or None"""
+        if embedding is None:
+            return None
+        query = self._normalize(embedding)
+        bucket_key = self._bucket(model, serial, conversation)
+        now = time.time()
+        with self._lock:
+            self._refresh_update_times()
+            best_id, best_score = None, -1.0
+            for entry_id in list(self._buckets.get(bucket_key, ())):
+                entry = self._entries[entry_id]
+                if self._is_stale(entry, now):
+                    self._remove(entry_id)
+                    continue
+                score = float(entry["vector"] @ query)
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_id)
+                self.hits += 1
+                return self._entries[best_id]["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, model, serial, conversation, embedding, answer):
+        if embedding is None:
+            return
+        bucket_key = self._bucket(model, serial, conversation)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "bucket": bucket_key,
+                "vector": self._normalize(embedding),
+                "answer": answer,
+                "created": time.time(),
+            }
+            self._buckets.setdefault(bucket_key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_model(self, model):
+        family = model_family(model or "")
+        with self._lock:
+            self._updated[family] = time.time()
+            for bucket_key in [b for b in self._buckets if model_family(b[0]) == family]:
+                for entry_id in list(self._buckets.get(bucket_key, ())):
+                    self._remove(entry_id)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
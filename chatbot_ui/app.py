@@ -1,47 +1,166 @@
 import os
-import sqlite3
-import openai
-import numpy as np
-import chromadb
-from chromadb.utils import embedding_functions
-from flask import Flask, render_template, request, jsonify
-from datetime import datetime
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from lazy_resource import LazyResource
+from openai_gateway import OpenAIGateway
+from metrics import REGISTRY, record_span, record_usage, request_trace, span
+from background_jobs import BackgroundJob
+from indexer import CHUNK_COLLECTION_NAME, COLLECTION_NAME, IncrementalIndexer, open_collection, read_model_update_times
+from answer_cache import SemanticAnswerCache
+from embedding_cache import EmbeddingCache, CachedOpenAIEmbeddingFunction, embed_with_cache
+from db_pool import ConnectionManager
+from context_packer import ContextPacker, get_tokenizer
+from chunking import matched_sections
+from hybrid_search import HybridRetriever
+from identifier_index import describe_identifier
+from near_duplicates import DuplicateGroups
+from snapshots import SnapshotWatcher, active_snapshot, read_pointer
+from vector_store import MmapVectorStore
+from issue_summary import summary_exists, top_issues
+from machine_timeline import find_machine, machine_timeline, timeline_exists
+from model_catalog import ModelResolver, model_filter_sql
+from session_store import SessionStore
+from report_store import ContextBuilder, fetch_parts, fetch_reports, format_parts
 import json
 import time
 
 # Initialize Flask app
 app = Flask(__name__)
 
-# Initialize the OpenAI client with your API key
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-db_path = os.path.join(os.path.dirname(__file__), '..', 'masterData.sqlite3')
+# The OpenAI gateway, embedding function, vector store and tokenizer are built on first use
+# (see lazy_resource.py) so importing the app is fast and startup never blocks on them.
+# All API calls go through the gateway: rate limits, retries on 429s, coalescing of identical
+# requests and micro-batched query embeddings (see openai_gateway.py)
+gateway = LazyResource("OpenAI gateway", OpenAIGateway.from_env)
+# HAAS_DB_PATH / VECTOR_DB_DIR point the app at another database and vector store (e.g. benchmarks/)
+db_path = os.getenv("HAAS_DB_PATH") or os.path.join(os.path.dirname(__file__), '..', 'masterData.sqlite3')
+
+# One reused, read-only connection per worker thread instead of a new connection per request
+db_manager = ConnectionManager(db_path)
+
+# Maps "vf4" / "VF-4" / "VF-4SS" to exact Model values so lookups can use indexes (see model_catalog.py)
+model_resolver = ModelResolver(db_manager.connection)
 
 # Initialize ChromaDB for vector storage
-CHROMA_PERSIST_DIR = os.path.join(os.path.dirname(__file__), 'vectordb')
-openai_ef = embedding_functions.OpenAIEmbeddingFunction(
+CHROMA_PERSIST_DIR = os.getenv("VECTOR_DB_DIR") or os.path.join(os.path.dirname(__file__), 'vectordb')
+
+# CHUNKED_RETRIEVAL=1 indexes reports as issue/solution/verification chunks in a separate
+# collection and puts only the matching sections into the prompt (see chunking.py)
+CHUNKED_RETRIEVAL = os.getenv("CHUNKED_RETRIEVAL", "0") == "1"
+CHUNK_SCORING = os.getenv("CHUNK_SCORING", "max")
+INDEX_STATE_PATH = os.path.join(CHROMA_PERSIST_DIR, 'index_state_chunks.sqlite3' if CHUNKED_RETRIEVAL else 'index_state.sqlite3')
+# DEDUP_REPORTS=1 stores one vector per group of near-duplicate reports and collapses hits to one
+# per group (see near_duplicates.py); MMR_LAMBDA < 1 picks diverse results from a larger pool
+DEDUP_REPORTS = os.getenv("DEDUP_REPORTS", "0") == "1"
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Shared on-disk embedding cache so reindexing and repeated queries don't hit the API again
+embedding_cache = LazyResource(
+    "embedding cache", lambda: EmbeddingCache(os.path.join(CHROMA_PERSIST_DIR, 'embedding_cache.sqlite3'))
+)
+openai_ef = LazyResource("embedding function", lambda: CachedOpenAIEmbeddingFunction(
+    embedding_cache.instance(),
     api_key=os.getenv("OPENAI_API_KEY"),
-    model_name="text-embedding-3-small"
+    model_name=EMBEDDING_MODEL,
+    gateway=gateway.instance()
+))
+
+# Vector backend: "chroma" (default) or "mmap" for the in-process memory-mapped store (see vector_store.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_SEARCH_DIMS = int(os.getenv("VECTOR_SEARCH_DIMS", "0")) or None
+
+# Blue/green index snapshots (see snapshots.py): once one has been activated under SNAPSHOT_ROOT
+# the app serves it instead of the store below, switches to a newly activated (or rolled back)
+# snapshot without a restart, and leaves indexing to the snapshot builds.  The snapshot's side
+# tables (lexical index, timelines, ...) are read from its aux.sqlite3 and switch along with it
+SNAPSHOT_ROOT = os.getenv("INDEX_SNAPSHOT_DIR") or os.path.join(CHROMA_PERSIST_DIR, 'snapshots')
+serving_snapshot = None
+
+def open_snapshot_store(snapshot):
+    """Open a snapshot's vector store, if it was built the way this app retrieves"""
+    mismatches = snapshot.mismatches(backend=VECTOR_BACKEND, chunked=CHUNKED_RETRIEVAL, dedup=DEDUP_REPORTS)
+    if mismatches:
+        raise ValueError(f"Snapshot {snapshot.version} doesn't match this app's settings: {', '.join(mismatches)}")
+    collection = snapshot.open(openai_ef.instance(), search_dims=VECTOR_SEARCH_DIMS)
+    print(f"Opened index snapshot {snapshot.version} with {collection.count()} vectors")
+    return collection
+
+def serve_snapshot_tables(snapshot):
+    """Read the snapshot's side tables ahead of masterData.sqlite3's (older snapshots don't carry usable ones)"""
+    db_manager.set_overlay(snapshot.aux_path if snapshot.serves_side_tables else None)
+    model_resolver.invalidate()
+
+def open_vector_store():
+    """Create or get the collection for service reports"""
+    global serving_snapshot
+    snapshot = active_snapshot(SNAPSHOT_ROOT)
+    if snapshot is not None:
+        collection = open_snapshot_store(snapshot)
+        serve_snapshot_tables(snapshot)
+        serving_snapshot = snapshot
+        return collection
+    if VECTOR_BACKEND == "mmap":
+        collection = MmapVectorStore(
+            os.path.join(CHROMA_PERSIST_DIR, 'mmap_chunk_store' if CHUNKED_RETRIEVAL else 'mmap_store'),
+            embedding_function=openai_ef.instance(),
+            dtype=os.getenv("VECTOR_DTYPE", "float16"),
+            search_dims=VECTOR_SEARCH_DIMS
+        )
+        print(f"Opened memory-mapped vector store with {collection.count()} reports")
+    else:
+        collection = open_collection(
+            CHROMA_PERSIST_DIR, embedding_function=openai_ef.instance(),
+            name=CHUNK_COLLECTION_NAME if CHUNKED_RETRIEVAL else COLLECTION_NAME
+        )
+        print(f"Connected to ChromaDB collection with {collection.count()} reports")
+    return collection
+
+service_reports_collection = LazyResource("vector store", open_vector_store)
+
+def index_state_path():
+    """The index state behind the vectors being served: the snapshot's, or the one indexed in place"""
+    return serving_snapshot.state_path if serving_snapshot is not None else INDEX_STATE_PATH
+
+# Semantic cache of /chat answers; also invalidated by indexing done in other processes (cron)
+answer_cache = SemanticAnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "5000")),
+    ttl_seconds=int(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600))),
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    model_update_times=lambda: read_model_update_times(index_state_path())
 )
-chroma_client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
 
-# Create or get the collection for service reports
-try:
-    service_reports_collection = chroma_client.get_collection(
-        name="service_reports", 
-        embedding_function=openai_ef
-    )
-    print("Connected to existing ChromaDB collection")
-except:
-    service_reports_collection = chroma_client.create_collection(
-        name="service_reports", 
-        embedding_function=openai_ef
-    )
-    print("Created new ChromaDB collection")
+# Prompts are packed into a fixed token budget instead of truncated by character count
+# (see context_packer.py); retrieval returns more reports than fit so the packer can choose
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+REPORT_CANDIDATES = int(os.getenv("REPORT_CANDIDATES", "12"))
+context_packer = LazyResource(
+    "context packer", lambda: ContextPacker(get_tokenizer("gpt-4o-mini"), max_prompt_tokens=PROMPT_TOKEN_BUDGET)
+)
+
+# Server-side chat history and per-session retrieval context (see session_store.py), in a SQLite
+# table shared by all worker processes; SESSION_DB_PATH="" keeps them in memory (one worker only)
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.getenv("SESSION_SPILL_PATH", os.path.join(CHROMA_PERSIST_DIR, 'sessions.sqlite3'))) or None
+SESSION_SCORE_DECAY = 0.5
+session_store = SessionStore(
+    max_sessions=int(os.getenv("SESSION_MAX", "2000")),
+    ttl_seconds=int(os.getenv("SESSION_TTL", str(6 * 3600))),
+    db_path=SESSION_DB_PATH
+)
+
+# Lexical (FTS5) + vector retrieval with SQL pre-filtering and rank fusion (see hybrid_search.py),
+# with reports matching alarm codes / part numbers in the query first (see identifier_index.py)
+hybrid_retriever = HybridRetriever(
+    service_reports_collection, resolve_models=model_resolver.resolve,
+    chunked=CHUNKED_RETRIEVAL, chunk_scoring=CHUNK_SCORING,
+    exact_k=int(os.getenv("EXACT_MATCH_REPORTS", "5")),
+    duplicate_groups=DuplicateGroups(index_state_path) if DEDUP_REPORTS else None,
+    mmr_lambda=MMR_LAMBDA
+)
 
 def connect_database():
+    """Return this thread's pooled read-only connection (close() on it is a no-op)"""
     try:
-        conn = sqlite3.connect(db_path)
-        return conn
+        return db_manager.connection()
     except Exception as e:
         print("Error connecting to database:", e)
         return None
@@ -51,171 +170,142 @@ def generate_embedding(text):
     if not text:
         return None
     
+    def embed(texts):
+        return [gateway.embed_query(t, EMBEDDING_MODEL) for t in texts]
+
     try:
-        response = client.embeddings.create(
-            input=text,
-            model="text-embedding-3-small"
-        )
-        return response.data[0].embedding
+        with span("query_embedding"):
+            return embed_with_cache(embedding_cache, EMBEDDING_MODEL, [text], embed)[0].tolist()
     except Exception as e:
         print(f"Error generating embedding: {e}")
         return None
 
-def index_service_reports():
-    """Index all service reports into the vector database"""
-    conn = connect_database()
-    if conn is None:
-        return "Error connecting to database."
-    
-    cursor = conn.cursor()
-    query = """
-    SELECT 
-        ServiceReport_id, 
-        Model, 
-        Serial, 
-        WorkRequired, 
-        ServicePerformed, 
-        VerificationTest,
-        Date
-    FROM ServiceReports
+def index_service_reports(append_only=False, progress=None):
+    """Incrementally sync service reports into the vector database (see indexer.py)"""
+    collection = service_reports_collection.instance()
+    if serving_snapshot is not None:
+        raise RuntimeError(f"Serving index snapshot {serving_snapshot.version}; build a new snapshot instead (see snapshots.py)")
+    indexer = IncrementalIndexer(
+        collection,
+        db_path=db_path,
+        state_path=INDEX_STATE_PATH,
+        embedding_function=openai_ef.instance(),
+        progress=progress,
+        chunked=CHUNKED_RETRIEVAL,
+        dedup=DEDUP_REPORTS
+    )
+    stats = indexer.run(append_only=append_only)
+    # Cached answers for models with new or changed reports are no longer trustworthy
+    for changed_model in stats.get("changed_models", []):
+        answer_cache.invalidate_model(changed_model)
+    if stats.get("deleted"):
+        answer_cache.clear()
+    return stats
+
+# Indexing runs in the background; until the vector index is usable, retrieval is lexical only
+INDEX_RETRY_SECONDS = 300
+_vector_index_populated = False
+_initial_build = False
+
+def run_indexing(progress):
+    """Background indexing target; a build into an empty store keeps retrieval lexical until it finishes"""
+    global _initial_build
+    _initial_build = service_reports_collection.count() == 0
+    try:
+        return index_service_reports(progress=progress)
+    finally:
+        _initial_build = False
+
+indexing_job = BackgroundJob("vector-indexing", run_indexing)
+
+def switch_snapshot(snapshot):
     """
-    cursor.execute(query)
-    reports = cursor.fetchall()
-    
-    # Check if collection is already populated
-    if service_reports_collection.count() >= len(reports):
-        print(f"Collection already has {service_reports_collection.count()} reports")
+    Snapshot watcher callback: open a newly activated snapshot and swap it in.  Requests already
+    running finish on the store they hold; cached answers came from the old index and are dropped.
+    """
+    global serving_snapshot, _vector_index_populated
+    if serving_snapshot is not None and serving_snapshot.version == snapshot.version:
         return
-    
-    # Clear existing data - FIX THE ERROR HERE
-    # Instead of service_reports_collection.delete(where={})
-    try:
-        # Option 1: Delete all items without filtering
-        service_reports_collection.delete(where=None)
-    except Exception as e:
+    collection = open_snapshot_store(snapshot)
+    serve_snapshot_tables(snapshot)
+    service_reports_collection.replace(collection)
+    serving_snapshot = snapshot
+    _vector_index_populated = False
+    answer_cache.clear()
+    print(f"Now serving index snapshot {snapshot.version}")
+
+snapshot_watcher = SnapshotWatcher(SNAPSHOT_ROOT, switch_snapshot, interval=float(os.getenv("SNAPSHOT_CHECK_SECONDS", "5")))
+
+def serving_from_snapshots():
+    return serving_snapshot is not None or bool(read_pointer(SNAPSHOT_ROOT).get("version"))
+
+def vector_index_ready():
+    """True once the vector store is open, holds reports and isn't in the middle of its first build"""
+    global _vector_index_populated
+    if _initial_build:
+        return False
+    if not _vector_index_populated and service_reports_collection.is_initialized:
         try:
-            # Option 2: If that fails, delete with a "match all" condition
-            service_reports_collection.delete(where={"$and": [{"service_report_id": {"$exists": True}}]})
-        except Exception as e2:
-            print(f"Warning: Could not clear collection: {e2}. Will add to existing data.")
-    
-    # Prepare batches for efficient insertion
-    ids = []
-    texts = []
-    metadatas = []
-    
-    print(f"Indexing {len(reports)} service reports...")
-    
-    for report in reports:
-        report_id = str(report[0])
-        model = report[1] or ""
-        serial = report[2] or ""
-        work_required = report[3] or ""
-        service_performed = report[4] or ""
-        verification = report[5] or ""
-        date = report[6] or ""
-        
-        # Create a combined text for embedding
-        combined_text = f"Model: {model}\nIssue: {work_required}\nSolution: {service_performed}\nVerification: {verification}"
-        
-        # Skip if text is too short
-        if len(combined_text) < 10:
-            continue
-        
-        ids.append(report_id)
-        texts.append(combined_text)
-        metadatas.append({
-            "model": model,
-            "serial": serial,
-            "date": date,
-            "service_report_id": report_id
-        })
-        
-        # Add in batches of 100
-        if len(ids) >= 100:
-            service_reports_collection.add(
-                ids=ids,
-                documents=texts,
-                metadatas=metadatas
-            )
-            ids = []
-            texts = []
-            metadatas = []
-            print(f"Added batch of 100 reports, collection now has {service_reports_collection.count()} reports")
-    
-    # Add any remaining reports
-    if ids:
-        service_reports_collection.add(
-            ids=ids,
-            documents=texts,
-            metadatas=metadatas
-        )
-    
-    conn.close()
-    print(f"Finished indexing. Collection now has {service_reports_collection.count()} reports")
+            _vector_index_populated = service_reports_collection.count() > 0
+        except Exception as e:
+            print(f"Error checking vector store: {e}")
+    return _vector_index_populated
 
-def get_machine_history(conn, model=None, serial=None):
-    cursor = conn.cursor()
-    
-    # Base query joining all relevant tables
-    query = """
-    SELECT DISTINCT
-        m.Serial,
-        m.Model,
-        m.Install_Date,
-        sr.ServiceReport_id,
-        sr.Date,
-        sr.WorkRequired,
-        sr.ServicePerformed,
-        sr.VerificationTest,
-        sr.Failure_Type,
-        sr.ServiceType
-    FROM Machines m
-    LEFT JOIN ServiceReports sr ON m.Serial = sr.Serial
-    WHERE 1=1
+def ensure_index():
+    """Start a background index build if the vector store is empty; never blocks on it"""
+    if vector_index_ready() or indexing_job.running:
+        return
+    if serving_from_snapshots():
+        # The watcher opens the active snapshot in the background
+        snapshot_watcher.start()
+        return
+    if indexing_job.state == "failed" and time.time() - (indexing_job.finished or 0) < INDEX_RETRY_SECONDS:
+        return
+    indexing_job.start()
+
+# Machine details and history come from the per-machine timelines once they have been built
+# (see machine_timeline.py), otherwise from the base tables
+HISTORY_REPORTS = int(os.getenv("HISTORY_REPORTS", "10"))
+
+MACHINE_QUERY = """
+    SELECT Serial, Model, Install_Date
+    FROM Machines
+    WHERE Serial = ?
     """
-    
-    params = []
-    if model:
-        query += " AND m.Model LIKE ?"
-        params.append(f"%{model}%")
-    if serial:
-        query += " AND m.Serial = ?"
-        params.append(serial)
-    
-    query += " ORDER BY sr.Date DESC LIMIT 10"  # Get most recent reports
-    
-    cursor.execute(query, params)
-    return cursor.fetchall()
 
-def get_related_parts(conn, service_report_id):
-    cursor = conn.cursor()
-    query = """
+LATEST_SERVICED_MACHINE_QUERY = """
+    SELECT m.Serial, m.Model, m.Install_Date
+    FROM ServiceReports sr
+    JOIN Machines m ON m.Serial = sr.Serial
+    WHERE {model_filter}
+    ORDER BY sr.Date DESC
+    LIMIT 1
+    """
+
+MACHINE_REPORTS_QUERY = """
+    SELECT ServiceReport_id, Date, WorkRequired, ServicePerformed, VerificationTest, Failure_Type, ServiceType
+    FROM ServiceReports
+    WHERE Serial = ?
+    ORDER BY Date DESC
+    LIMIT ?
+    """
+
+RELATED_PARTS_QUERY = """
     SELECT PartNumber, Description
     FROM ServiceReportParts
     WHERE ServiceReport_id = ?
     """
-    cursor.execute(query, (service_report_id,))
-    return cursor.fetchall()
 
-def get_common_issues(conn, model):
-    """Get most common issues and solutions for a specific model"""
-    cursor = conn.cursor()
-    query = """
+COMMON_ISSUES_QUERY = """
     SELECT WorkRequired, ServicePerformed, COUNT(*) as frequency
     FROM ServiceReports
-    WHERE Model LIKE ?
+    WHERE {model_filter}
     GROUP BY WorkRequired, ServicePerformed
     ORDER BY frequency DESC
     LIMIT 3
     """
-    cursor.execute(query, (f"%{model}%",))
-    return cursor.fetchall()
 
-def get_service_report_by_id(conn, report_id):
-    """Get a specific service report by ID"""
-    cursor = conn.cursor()
-    query = """
+SERVICE_REPORT_BY_ID_QUERY = """
     SELECT 
         ServiceReport_id,
         Date,
@@ -227,199 +317,585 @@ def get_service_report_by_id(conn, report_id):
     FROM ServiceReports
     WHERE ServiceReport_id = ?
     """
-    cursor.execute(query, (report_id,))
+
+def get_machine(conn, model=None, serial=None):
+    """(Serial, Model, Install_Date) of the serial's machine, or with only a model its most recently serviced machine"""
+    models = model_resolver.resolve(model) if model else None
+    with span("sql_machine"):
+        if timeline_exists(conn):
+            model_clause, model_params = model_filter_sql("Model", models, model) if model else (None, [])
+            return find_machine(conn, serial, model_clause, model_params)
+        if serial:
+            query, params = MACHINE_QUERY, [serial]
+            if model:
+                model_clause, model_params = model_filter_sql("Model", models, model)
+                query += f" AND {model_clause}"
+                params += model_params
+            return conn.execute(query, params).fetchone()
+        if model:
+            model_clause, model_params = model_filter_sql("sr.Model", models, model)
+            return conn.execute(LATEST_SERVICED_MACHINE_QUERY.format(model_filter=model_clause), model_params).fetchone()
+        return None
+
+def get_machine_history(conn, model=None, serial=None, limit=HISTORY_REPORTS, before=None):
+    """
+    (machine, reports): the machine get_machine() finds and its reports newest first, each
+    (ServiceReport_id, Date, WorkRequired, ServicePerformed, VerificationTest, Failure_Type,
+    ServiceType, parts, cursor).  before is the last cursor of the previous page; paging and
+    date-normalized ordering need the timelines (the fallback returns only the first page).
+    """
+    machine = get_machine(conn, model, serial)
+    if machine is None:
+        return None, []
+    with span("sql_machine_history"):
+        if timeline_exists(conn):
+            return machine, machine_timeline(conn, machine[0], limit, before)
+        if before:
+            return machine, []
+        rows = conn.execute(MACHINE_REPORTS_QUERY, (machine[0], limit)).fetchall()
+        parts_by_report = fetch_parts(conn, [r[0] for r in rows], limit_per_report=3)
+        return machine, [r + (parts_by_report.get(str(r[0]), []), None) for r in rows]
+
+def get_related_parts(conn, service_report_id):
+    cursor = conn.cursor()
+    cursor.execute(RELATED_PARTS_QUERY, (service_report_id,))
+    return cursor.fetchall()
+
+def get_common_issues(conn, model):
+    """
+    Get most common issues and solutions for a specific model, from the precomputed issue
+    clusters when available (see issue_summary.py), otherwise with a GROUP BY over the reports
+    """
+    models = model_resolver.resolve(model)
+    with span("sql_common_issues"):
+        if models and summary_exists(conn):
+            return top_issues(conn, models, limit=3)
+        cursor = conn.cursor()
+        model_clause, model_params = model_filter_sql("Model", models, model)
+        cursor.execute(COMMON_ISSUES_QUERY.format(model_filter=model_clause), model_params)
+        return cursor.fetchall()
+
+def get_service_report_by_id(conn, report_id):
+    """Get a specific service report by ID"""
+    cursor = conn.cursor()
+    cursor.execute(SERVICE_REPORT_BY_ID_QUERY, (report_id,))
     return cursor.fetchone()
 
+def add_machine_details(builder, machine_info):
+    builder.line("Machine Details:")
+    builder.line(f"Model: {machine_info[1]}")
+    builder.line(f"Serial: {machine_info[0]}")
+    builder.line(f"Installation Date: {machine_info[2]}")
+    builder.line()
+
+def add_common_issues(builder, common_issues):
+    if common_issues:
+        builder.line()
+        builder.line("Common Issues for this Model:")
+        for issue in common_issues:
+            builder.line(f"- Problem: {issue[0][:100]}")
+            builder.line(f"  Solution: {issue[1][:100]}")
+            if len(issue) > 3:  # Summary clusters also carry last-seen date and example reports
+                builder.line(f"  Seen {issue[2]} times, most recently {issue[3]} (e.g. reports {', '.join(issue[4][:3])})")
+
+REPORT_HITS_HEADER = "Semantically Relevant Service History:"
+
+def render_report(report_id, score, report_data, parts, chunks=None, identifiers=None, duplicates=None):
+    """
+    The report as a context section; with chunks (matched chunk ids) only those sections, with
+    identifiers (alarm codes / part numbers it was found by) a line naming them, with duplicates
+    (the other reports of its near-duplicate group) how often it recurred
+    """
+    section = ContextBuilder()
+    section.line()
+    section.line(f"Service Report {report_id} (Relevance Score: {score:.4f}):")
+    section.line(f"Model: {report_data[2]}")
+    section.line(f"Date: {report_data[1]}")
+    if identifiers:
+        section.line("Exact match on: " + ", ".join(describe_identifier(i) for i in identifiers))
+    if duplicates:
+        section.line(f"Recurring: {len(duplicates)} near-identical other report(s), e.g. {', '.join(duplicates[:3])}")
+    # Chunks that no longer match the report text (edited since indexing) fall back to the full report
+    matched = matched_sections(report_data[4:7], chunks) if chunks else None
+    if matched:
+        for label, text in matched:
+            section.line(f"{label}: {text}")
+    else:
+        if report_data[4]:  # WorkRequired
+            section.line(f"Issue: {report_data[4]}")
+        if report_data[5]:  # ServicePerformed
+            section.line(f"Solution: {report_data[5]}")
+        if report_data[6]:  # VerificationTest
+            section.line(f"Verification: {report_data[6]}")
+    if parts:
+        section.line("Parts Used: " + format_parts(parts))
+    return section.build()
+
+def report_candidates(conn, hits, known=None):
+    """
+    Render retrieved reports (HybridRetriever hits) as scored sections for the context packer.
+    known maps report id -> [report row, parts] for reports already fetched (e.g. earlier in the
+    session); only the others are queried, and they are added to it.
+    """
+    if not hits:
+        return []
+    known = {} if known is None else known
+    # Full report details and parts for all new hits in two queries
+    missing = [hit["report_id"] for hit in hits if str(hit["report_id"]) not in known]
+    if missing:
+        with span("sql_reports"):
+            reports = fetch_reports(conn, missing)
+            parts_by_report = fetch_parts(conn, missing, limit_per_report=3)
+        for report_id, report_data in reports.items():
+            known[report_id] = [report_data, parts_by_report.get(report_id, [])]
+    
+    candidates = []
+    for hit in hits:
+        report_id = str(hit["report_id"])
+        if report_id in known:
+            report_data, parts = known[report_id]
+            text = render_report(
+                report_id, hit["score"], report_data, parts, hit.get("chunks"), hit.get("identifiers"), hit.get("duplicates")
+            )
+            candidates.append({"id": report_id, "score": hit["score"], "text": text})
+    return candidates
+
+def session_candidates(session, conn, hits):
+    """
+    Candidates for a session turn: this turn's hits plus reports retrieved on earlier turns, whose
+    scores decay each turn they aren't retrieved again.  Only never-seen reports hit the database.
+    """
+    known = dict(session["reports"])
+    candidates = report_candidates(conn, hits, known)
+    scores = {c["id"]: c["score"] for c in candidates}
+    for report_id, score in session["scores"].items():
+        if report_id not in scores and report_id in known:
+            scores[report_id] = score * SESSION_SCORE_DECAY
+            report_data, parts = known[report_id]
+            candidates.append({"id": report_id, "score": scores[report_id], "text": render_report(report_id, scores[report_id], report_data, parts)})
+    session_store.remember_reports(session, known, scores)
+    return candidates
+
 def build_context(model=None, serial=None):
     conn = connect_database()
     if conn is None:
         return "Error connecting to database."
     
-    machine_history = get_machine_history(conn, model, serial)
-    if not machine_history:
-        conn.close()
+    machine_info, machine_history = get_machine_history(conn, model, serial)
+    if machine_info is None:
         return "No service history found for the specified machine."
     
-    context = "Machine Service History Analysis:\n\n"
+    context = ContextBuilder("Machine Service History Analysis:\n\n")
     
     # Add machine details
-    machine_info = machine_history[0]  # First row has the machine info
-    context += f"Machine Details:\n"
-    context += f"Model: {machine_info[1]}\n"
-    context += f"Serial: {machine_info[0]}\n"
-    context += f"Installation Date: {machine_info[2]}\n\n"
+    add_machine_details(context, machine_info)
     
-    # Add recent service history
-    context += "Recent Service History:\n"
+    # Add recent service history (reports come with their parts)
+    context.line("Recent Service History:")
     for record in machine_history:
-        if record[3]:  # If there's a service report
-            context += f"\nService Report {record[3]} ({record[4]}):\n"
-            if record[5]:  # WorkRequired
-                context += f"Issue: {record[5][:200]}\n"
-            if record[6]:  # ServicePerformed
-                context += f"Solution: {record[6][:200]}\n"
-            if record[7]:  # VerificationTest
-                context += f"Verification: {record[7][:200]}\n"
-            
-            # Get parts used
-            parts = get_related_parts(conn, record[3])
-            if parts:
-                context += "Parts Used: " + ", ".join([f"{p[0]} ({p[1]})" for p in parts[:3]]) + "\n"
+        context.line()
+        context.line(f"Service Report {record[0]} ({record[1]}):")
+        if record[2]:  # WorkRequired
+            context.line(f"Issue: {record[2][:200]}")
+        if record[3]:  # ServicePerformed
+            context.line(f"Solution: {record[3][:200]}")
+        if record[4]:  # VerificationTest
+            context.line(f"Verification: {record[4][:200]}")
+        if record[7]:
+            context.line("Parts Used: " + format_parts(record[7]))
     
     # Add common issues for this model
-    common_issues = get_common_issues(conn, model)
-    if common_issues:
-        context += "\nCommon Issues for this Model:\n"
-        for issue in common_issues:
-            context += f"- Problem: {issue[0][:100]}\n"
-            context += f"  Solution: {issue[1][:100]}\n"
+    add_common_issues(context, get_common_issues(conn, model))
     
-    conn.close()
-    return context
+    return context.build()
 
-def build_context_with_embeddings(model=None, serial=None, user_query=None):
-    """Build context using vector embeddings for semantic search"""
+def build_context_with_embeddings(model=None, serial=None, user_query=None, query_embedding=None, session=None):
+    """
+    Build context using vector embeddings for semantic search.
+    Returns (fixed context, retrieved report candidates); the packer decides which reports fit.
+    With a session, the machine details from its first turn and its earlier reports are reused.
+    """
     conn = connect_database()
     if conn is None:
-        return "Error connecting to database."
-    
-    # Get basic machine information
-    machine_details = ""
-    if model or serial:
-        machine_history = get_machine_history(conn, model, serial)
-        if machine_history:
-            machine_info = machine_history[0]  # First row has the machine info
-            machine_details = f"Machine Details:\n"
-            machine_details += f"Model: {machine_info[1]}\n"
-            machine_details += f"Serial: {machine_info[0]}\n"
-            machine_details += f"Installation Date: {machine_info[2]}\n\n"
-            
-            # Save model and serial for filtering
-            if not model and machine_info[1]:
-                model = machine_info[1]
-            if not serial and machine_info[0]:
-                serial = machine_info[0]
+        return "Error connecting to database.", []
     
     # Build vector search query
-    context = "Machine Service History Analysis:\n\n"
-    context += machine_details
+    context = ContextBuilder("Machine Service History Analysis:\n\n")
+    
+    if session is not None and session["machine_context"] is not None:
+        machine_context = session["machine_context"]
+        model, serial = session["filter_model"], session["filter_serial"]
+    else:
+        # Get basic machine information
+        machine_details = ContextBuilder()
+        if model or serial:
+            machine_info = get_machine(conn, model, serial)
+            if machine_info:
+                add_machine_details(machine_details, machine_info)
+                
+                # Save model and serial for filtering
+                if not model and machine_info[1]:
+                    model = machine_info[1]
+                if not serial and machine_info[0]:
+                    serial = machine_info[0]
+        machine_context = machine_details.build()
+        if session is not None:
+            session["machine_context"] = machine_context
+            session["filter_model"], session["filter_serial"] = model, serial
+    context.add(machine_context)
     
-    # Perform vector search if we have a query
+    # Perform hybrid (FTS5 + vector) search if we have a query
+    vector_ready = vector_index_ready()
+    candidates = []
     if user_query:
-        # Prepare filter
-        filter_dict = {}
-        if model:
-            filter_dict["model"] = {"$like": f"%{model}%"}
-        if serial:
-            filter_dict["serial"] = serial
-            
-        # Query vector database for semantically similar reports
-        results = service_reports_collection.query(
-            query_texts=[user_query],
-            n_results=5,
-            where=filter_dict if filter_dict else None
+        hits = hybrid_retriever.search(
+            conn, user_query, model=model, serial=serial, n_results=REPORT_CANDIDATES,
+            query_embedding=query_embedding, use_vector=vector_ready
         )
-        
-        if results and results['ids'] and results['ids'][0]:
-            context += "Semantically Relevant Service History:\n"
-            for i, report_id in enumerate(results['ids'][0]):
-                # Get full report details from SQL database
-                report_data = get_service_report_by_id(conn, report_id)
-                if report_data:
-                    context += f"\nService Report {report_id} (Relevance Score: {results['distances'][0][i]:.2f}):\n"
-                    context += f"Model: {report_data[2]}\n"
-                    context += f"Date: {report_data[1]}\n"
-                    if report_data[4]:  # WorkRequired
-                        context += f"Issue: {report_data[4]}\n"
-                    if report_data[5]:  # ServicePerformed
-                        context += f"Solution: {report_data[5]}\n"
-                    if report_data[6]:  # VerificationTest
-                        context += f"Verification: {report_data[6]}\n"
-                    
-                    # Get parts used
-                    parts = get_related_parts(conn, report_id)
-                    if parts:
-                        context += "Parts Used: " + ", ".join([f"{p[0]} ({p[1]})" for p in parts[:3]]) + "\n"
+        candidates = session_candidates(session, conn, hits) if session is not None else report_candidates(conn, hits)
     
-    # If we have a model but no semantic results yet, add common issues
-    if model and not user_query:
-        common_issues = get_common_issues(conn, model)
-        if common_issues:
-            context += "\nCommon Issues for this Model:\n"
-            for issue in common_issues:
-                context += f"- Problem: {issue[0][:100]}\n"
-                context += f"  Solution: {issue[1][:100]}\n"
+    # If we have a model but no semantic results yet, add common issues (also the SQL-only
+    # fallback while the vector index is still building)
+    if model and (not user_query or (not vector_ready and not candidates)):
+        add_common_issues(context, get_common_issues(conn, model))
     
-    conn.close()
-    return context
+    return context.build(), candidates
 
 def get_openai_response(messages):
     try:
-        # Estimate token count
-        total_chars = sum(len(m["content"]) for m in messages)
-        estimated_tokens = total_chars / 4
-        
-        if estimated_tokens > 15000:
-            # Truncate the system message content if too long
-            system_content = messages[0]["content"]
-            messages[0]["content"] = system_content[:int(len(system_content) * 0.5)]
-        
-        response = client.chat.completions.create(
+        with span("llm"):
+            response = gateway.chat(
+                model="gpt-4o-mini",
+                messages=messages,
+                max_tokens=500,
+                n=1,
+                temperature=0.7,
+            )
+        record_usage(getattr(response, "usage", None))
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+def stream_openai_response(messages):
+    """Yield the completion text as it arrives from the API"""
+    start = time.perf_counter()
+    first_token = True
+    with span("llm"):
+        stream = gateway.chat_stream(
             model="gpt-4o-mini",
             messages=messages,
             max_tokens=500,
             n=1,
             temperature=0.7,
+            stream_options={"include_usage": True},
         )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"Error: {str(e)}"
+        for chunk in stream:
+            # With include_usage the last chunk carries the token counts and no choices
+            record_usage(getattr(chunk, "usage", None))
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token:
+                    record_span("llm_first_token", time.perf_counter() - start)
+                    first_token = False
+                yield chunk.choices[0].delta.content
 
 @app.route("/")
 def index():
     return render_template("index.html")
 
-@app.route("/chat", methods=["POST"])
-def chat():
-    data = request.get_json()
-    model = data.get("model", "")
-    serial = data.get("serial", "")
+@app.route("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz")
+def readyz():
+    """
+    Readiness: the database answers and the vector index is loaded.  While the index is still
+    building the app serves lexical-only answers and reports itself degraded (503).  Probes also
+    start the index load, so under a WSGI server (where nothing runs start_background_indexing)
+    readiness doesn't wait for a first /chat that a readiness-gated pod would never receive.
+    """
+    ensure_index()
+    checks = {}
+    try:
+        connect_database().execute("SELECT 1 FROM ServiceReports LIMIT 1").fetchall()
+        checks["database"] = "ok"
+    except Exception as e:
+        checks["database"] = f"error: {e}"
+    ready_vectors = vector_index_ready()
+    checks["vector_index"] = "ok" if ready_vectors else ("building" if indexing_job.running else "not loaded")
+    ready = checks["database"] == "ok" and ready_vectors
+    body = {
+        "status": "ready" if ready else ("degraded" if checks["database"] == "ok" else "unavailable"),
+        "checks": checks,
+        "indexing": indexing_job.status(),
+        "snapshot": serving_snapshot.version if serving_snapshot is not None else None,
+    }
+    return jsonify(body), 200 if ready else 503
+
+def collect_metrics():
+    """Cache, pool and indexing figures for /metrics, read from their own stats at scrape time"""
+    answers = answer_cache.stats()
+    families = [
+        ("haas_answer_cache_lookups_total", "counter", "Answer cache lookups by result",
+         [({"result": "hit"}, answers["hits"]), ({"result": "miss"}, answers["misses"])]),
+        ("haas_answer_cache_hit_ratio", "gauge", "Answer cache hit ratio since start", [({}, answers["hit_rate"])]),
+        ("haas_answer_cache_entries", "gauge", "Cached answers", [({}, answers["entries"])]),
+    ]
+    if embedding_cache.is_initialized:
+        embeddings = embedding_cache.stats()
+        families += [
+            ("haas_embedding_cache_lookups_total", "counter", "Embedding cache lookups by result",
+             [({"result": "hit"}, embeddings["hits"]), ({"result": "miss"}, embeddings["misses"])]),
+            ("haas_embedding_cache_hit_ratio", "gauge", "Embedding cache hit ratio since start", [({}, embeddings["hit_rate"])]),
+        ]
+    pool = db_manager.stats()
+    families += [
+        ("haas_db_pool_checkouts_total", "counter", "Pooled connection checkouts", [({}, pool["checkouts"])]),
+        ("haas_db_pool_open_connections", "gauge", "Open pooled connections", [({}, pool["open_connections"])]),
+        ("haas_sessions_active", "gauge", "Chat sessions held in memory", [({}, session_store.stats()["active"])]),
+        ("haas_vector_index_ready", "gauge", "1 when vector retrieval is available", [({}, int(vector_index_ready()))]),
+    ]
+    indexing = indexing_job.status()
+    latest = indexing.get("result") or indexing.get("progress") or {}
+    families += [
+        ("haas_indexing_running", "gauge", "1 while a background index run is in progress", [({}, int(indexing_job.running))]),
+        ("haas_indexing_rows_per_second", "gauge", "Rows scanned per second by the latest index run", [({}, latest.get("rows_per_sec"))]),
+        ("haas_indexing_rows_scanned", "gauge", "Rows scanned by the latest index run", [({}, latest.get("scanned"))]),
+        ("haas_indexing_reports_embedded", "gauge", "Reports embedded by the latest index run", [({}, latest.get("embedded"))]),
+        ("haas_indexing_reports_failed", "gauge", "Reports that failed to index in the latest run", [({}, latest.get("failed"))]),
+        ("haas_index_snapshot_switches_total", "counter", "Index snapshots switched to without a restart", [({}, snapshot_watcher.switches)]),
+    ]
+    return families
+
+REGISTRY.add_collector(collect_metrics)
+
+@app.route("/machines/<serial>/history")
+def machine_history(serial):
+    """A machine's service history, newest first, a page at a time (?limit=N&before=<next from the previous page>)"""
+    conn = connect_database()
+    limit = max(1, min(request.args.get("limit", HISTORY_REPORTS, type=int), 100))
+    machine, reports = get_machine_history(conn, serial=serial, limit=limit, before=request.args.get("before"))
+    if machine is None:
+        return jsonify({"error": "Unknown machine"}), 404
+    return jsonify({
+        "machine": {"serial": machine[0], "model": machine[1], "install_date": machine[2]},
+        "reports": [{
+            "id": str(r[0]), "date": r[1], "issue": r[2], "solution": r[3], "verification": r[4],
+            "failure_type": r[5], "service_type": r[6],
+            "parts": [{"part_number": p[0], "description": p[1]} for p in r[7]],
+        } for r in reports],
+        "next": reports[-1][8] if len(reports) == limit else None,
+    })
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of request, stage, token, cache and indexing metrics"""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/stats")
+def stats():
+    """Connection pool and cache counters for monitoring"""
+    return jsonify({
+        "db_pool": db_manager.stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache.is_initialized else None,
+        "answer_cache": answer_cache.stats(),
+        "sessions": session_store.stats(),
+        "indexing": indexing_job.status(),
+        "snapshot": dict(snapshot_watcher.status(), serving=serving_snapshot.version if serving_snapshot is not None else None)
+    })
+
+SYSTEM_PROMPT = """You are a specialized Haas CNC service assistant with deep knowledge of CNC machinery maintenance and repair. 
+Your responses should:
+1. Analyze the service history to identify patterns and recurring issues
+2. Consider the machine's age and maintenance history when providing recommendations
+3. Reference specific parts and procedures from past successful repairs
+4. Provide step-by-step troubleshooting guidance
+5. Suggest preventive maintenance based on historical issues
+
+Use the following service history and related information to provide detailed, actionable recommendations:
+
+{0}"""
+
+def resolve_chat(data):
+    """
+    Work out the machine and conversation for a chat request, which is either
+    - {"session_id", "message"}: the history is kept server-side (a "message" without a
+      session_id starts a session, seeded with "conversation" when resuming a stored chat), or
+    - the original {"model"/"serial", "conversation"} with the full history in every request.
+    Returns a dict with model, serial, conversation, session and user_message, or with "response"
+    when the request can't be served.
+    """
+    if "message" not in data:
+        return {
+            "model": data.get("model", ""),
+            "serial": data.get("serial", ""),
+            "conversation": data.get("conversation", []),
+            "session": None,
+            "user_message": None,
+        }
+    
+    session_id = data.get("session_id")
+    session = session_store.get(session_id)
+    if session is None:
+        if session_id:
+            # The client resends with its local history to start a new session
+            return {"response": "Error: This chat session has expired.", "session_expired": True}
+        if not data.get("model") and not data.get("serial"):
+            return {"response": "Error: Please provide either a machine model or serial number."}
+        session = session_store.create(data.get("model"), data.get("serial"), data.get("conversation"))
+    user_message = {"role": "user", "content": data.get("message") or ""}
+    return {
+        "model": session["model"],
+        "serial": session["serial"],
+        "conversation": session["messages"] + [user_message],
+        "session": session,
+        "user_message": user_message,
+    }
+
+def finish_chat(prepared, answer):
+    """Record a served answer in the session history (if any)"""
+    if prepared.get("session") is not None:
+        session_store.append_turn(prepared["session"], prepared["user_message"], answer)
+
+def response_fields(prepared):
+    return {"session_id": prepared["session"]["session_id"]} if prepared.get("session") is not None else {}
+
+def prepare_chat(data):
+    """
+    Shared front half of /chat and /chat/stream: validation, answer cache lookup and retrieval.
+    Returns a dict with either "response" (answer ready, no LLM call needed) or "messages".
+    """
+    resolved = resolve_chat(data)
+    if "response" in resolved:
+        return resolved
+    model = resolved["model"]
+    serial = resolved["serial"]
     user_query = data.get("query", "")
-    conversation = data.get("conversation", [])
+    conversation = resolved["conversation"]
+    session = resolved["session"]
     
     if not model and not serial:
-        return jsonify({"response": "Error: Please provide either a machine model or serial number."})
+        return {"response": "Error: Please provide either a machine model or serial number."}
     
-    # Ensure the vector database is indexed
-    if service_reports_collection.count() == 0:
-        index_service_reports()
+    # The UI only sends the conversation; search on the latest user message
+    if not user_query:
+        user_messages = [m.get("content", "") for m in conversation if m.get("role") == "user"]
+        user_query = user_messages[-1] if user_messages else ""
+    
+    # Serve near-identical questions about the same machine from the answer cache
+    query_embedding = generate_embedding(user_query) if user_query else None
+    cached_answer = answer_cache.lookup(model, serial, conversation, query_embedding)
+    if cached_answer is not None:
+        return dict(resolved, response=cached_answer, cached=True)
+    
+    # Make sure the vector database is (being) indexed; until it is, retrieval runs lexical only
+    ensure_index()
     
     # Build context from service reports using embeddings
-    context = build_context_with_embeddings(model, serial, user_query)
+    context, candidates = build_context_with_embeddings(model, serial, user_query, query_embedding, session)
     if context.startswith("Error") or context.startswith("No service"):
-        return jsonify({"response": context})
+        return {"response": context}
     
-    # Create a comprehensive system prompt
-    system_prompt = """You are a specialized Haas CNC service assistant with deep knowledge of CNC machinery maintenance and repair. 
-Your responses should:
-1. Analyze the service history to identify patterns and recurring issues
-2. Consider the machine's age and maintenance history when providing recommendations
-3. Reference specific parts and procedures from past successful repairs
-4. Provide step-by-step troubleshooting guidance
-5. Suggest preventive maintenance based on historical issues
+    with span("context_assembly"):
+        packed = context_packer.pack(SYSTEM_PROMPT, context, candidates, conversation, candidate_header=REPORT_HITS_HEADER)
+    return dict(
+        resolved,
+        messages=packed["messages"],
+        report_ids=packed["included_ids"],
+        cache_key=(model, serial, conversation, query_embedding),
+    )
 
-Use the following service history and related information to provide detailed, actionable recommendations:
+@app.route("/chat", methods=["POST"])
+def chat():
+    data = request.get_json()
+    with request_trace("/chat", model=data.get("model")) as trace:
+        prepared = prepare_chat(data)
+        if "response" in prepared:
+            trace.outcome = "cached" if prepared.get("cached") else "rejected"
+            if prepared.get("cached"):
+                finish_chat(prepared, prepared["response"])
+            return jsonify({
+                "response": prepared["response"],
+                "cached": prepared.get("cached", False),
+                "session_expired": prepared.get("session_expired", False),
+                **response_fields(prepared)
+            })
+        
+        response_text = get_openai_response(prepared["messages"])
+        if not response_text.startswith("Error"):
+            answer_cache.store(*prepared["cache_key"], response_text)
+            finish_chat(prepared, response_text)
+        else:
+            trace.outcome = "error"
+        return jsonify({"response": response_text, "report_ids": prepared["report_ids"], **response_fields(prepared)})
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
 
-{0}""".format(context)
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """
+    Server-Sent Events variant of /chat: a "meta" event with the cited report ids first, then
+    "token" events as the completion streams in, then "done" (or "error").
+    """
+    data = request.get_json()
     
-    messages = [{"role": "system", "content": system_prompt}]
-    messages.extend(conversation)
+    def generate():
+        with request_trace("/chat/stream", model=data.get("model")) as trace:
+            try:
+                prepared = prepare_chat(data)
+            except Exception as e:
+                trace.outcome = "error"
+                yield sse_event("error", {"message": f"Error: {str(e)}"})
+                return
+            if prepared.get("session_expired"):
+                yield sse_event("error", {"message": prepared["response"], "session_expired": True})
+                return
+            if "response" in prepared:
+                trace.outcome = "cached" if prepared.get("cached") else "rejected"
+                if prepared.get("cached"):
+                    finish_chat(prepared, prepared["response"])
+                yield sse_event("meta", {"report_ids": [], "cached": prepared.get("cached", False), **response_fields(prepared)})
+                yield sse_event("token", {"text": prepared["response"]})
+                yield sse_event("done", {})
+                return
+        
+            yield sse_event("meta", {"report_ids": prepared["report_ids"], "cached": False, **response_fields(prepared)})
+            pieces = []
+            try:
+                for text in stream_openai_response(prepared["messages"]):
+                    pieces.append(text)
+                    yield sse_event("token", {"text": text})
+            except Exception as e:
+                trace.outcome = "error"
+                yield sse_event("error", {"message": f"Error: {str(e)}"})
+                return
+            answer = "".join(pieces).strip()
+            if answer:
+                answer_cache.store(*prepared["cache_key"], answer)
+                finish_chat(prepared, answer)
+            yield sse_event("done", {})
     
-    response_text = get_openai_response(messages)
-    return jsonify({"response": response_text})
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def start_background_indexing():
+    """
+    Bring the vector database up to date in the background (only new or changed reports are
+    embedded), or when serving snapshots open the active one; either way watch for activations
+    """
+    snapshot_watcher.start()
+    if serving_from_snapshots():
+        return
+    if os.getenv("INDEX_ON_STARTUP", "1") != "0":
+        indexing_job.start()
 
 if __name__ == "__main__":
-    # Ensure vector database is indexed on startup
-    if service_reports_collection.count() == 0:
-        index_service_reports()
+    # With the debug reloader this module also runs in the watcher process; index in the server only
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_indexing()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,348 @@
+"""
+Async serving mode for the chatbot.
+
+/chat and /chat/stream are handled natively here: the independent retrieval stages (machine
+details, query embedding followed by hybrid search, common issues) run concurrently, each under its
+own timeout, and the completion uses the gateway's async OpenAI client, so a worker can hold many chats that
+are waiting on the LLM without tying up a thread per request.  A stage that fails or times out is
+left out of the context instead of failing the request.  Every other route is served by the Flask
+app through asgiref's WSGI adapter.
+
+    cd chatbot_ui && uvicorn asgi:application --workers 2
+
+Chat sessions are shared between the workers through SESSION_DB_PATH (see session_store.py); with
+SESSION_DB_PATH="" they are per process, so run a single worker or route sessions stickily.
+
+Blocking SQLite and vector-store work runs on the event loop's thread pool; a stage that times out
+is abandoned, but its thread finishes in the background.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import (
+    SYSTEM_PROMPT, EMBEDDING_MODEL, app, answer_cache, embedding_cache, hybrid_retriever,
+    connect_database, get_machine, get_common_issues, add_machine_details, add_common_issues,
+    report_candidates, session_candidates, ensure_index, vector_index_ready, start_background_indexing,
+    sse_event, context_packer, resolve_chat, finish_chat, response_fields, REPORT_HITS_HEADER, REPORT_CANDIDATES,
+    gateway,
+)
+from metrics import REGISTRY, record_span, record_usage, request_trace, span
+from report_store import ContextBuilder
+
+# Seconds each stage may take before the request goes on without it
+STAGE_TIMEOUTS = {
+    "machine": float(os.getenv("STAGE_TIMEOUT_MACHINE", "2")),
+    "embedding": float(os.getenv("STAGE_TIMEOUT_EMBEDDING", "3")),
+    "retrieval": float(os.getenv("STAGE_TIMEOUT_RETRIEVAL", "5")),
+    "issues": float(os.getenv("STAGE_TIMEOUT_ISSUES", "2")),
+    "completion": float(os.getenv("STAGE_TIMEOUT_COMPLETION", "60")),
+}
+
+STAGE_TIMEOUTS_TOTAL = REGISTRY.counter(
+    "haas_chat_stage_timeouts_total", "Async retrieval stages abandoned after their timeout", ["stage"]
+)
+
+flask_application = WsgiToAsgi(app)
+
+
+async def run_stage(name, coro):
+    """Await coro under the stage's timeout; None (and a log line) if it fails or runs over"""
+    try:
+        return await asyncio.wait_for(coro, STAGE_TIMEOUTS[name])
+    except asyncio.TimeoutError:
+        print(f"Stage '{name}' timed out after {STAGE_TIMEOUTS[name]}s; continuing without it")
+        STAGE_TIMEOUTS_TOTAL.inc(stage=name)
+    except Exception as e:
+        print(f"Stage '{name}' failed: {e}")
+    return None
+
+
+async def generate_embedding_async(text):
+    """Query embedding through the shared cache, calling the API only on a miss"""
+    if not text:
+        return None
+    with span("query_embedding"):
+        # The cache is SQLite-backed (and opened on first use), so it is only touched from worker threads
+        cached = await asyncio.to_thread(lambda: embedding_cache.get(EMBEDDING_MODEL, text))
+        if cached is not None:
+            return cached.tolist()
+        # Micro-batched with the other requests' query embeddings (see openai_gateway.py)
+        vector = await gateway.aembed_query(text, EMBEDDING_MODEL)
+        await asyncio.to_thread(lambda: embedding_cache.put(EMBEDDING_MODEL, text, vector))
+        return vector
+
+
+def machine_stage(model, serial):
+    return get_machine(connect_database(), model, serial)
+
+
+def issues_stage(model):
+    return get_common_issues(connect_database(), model)
+
+
+def retrieval_stage(model, serial, user_query, query_embedding, session=None):
+    """Hybrid search plus report details; lexical only if the query embedding or vector index is missing"""
+    conn = connect_database()
+    # Checking the index may count the vector store, so it happens here on the worker thread
+    use_vector = query_embedding is not None and vector_index_ready()
+    hits = hybrid_retriever.search(
+        conn, user_query, model=model, serial=serial, n_results=REPORT_CANDIDATES,
+        query_embedding=query_embedding, use_vector=use_vector
+    )
+    return session_candidates(session, conn, hits) if session is not None else report_candidates(conn, hits)
+
+
+async def prepare_chat_async(data):
+    """
+    Async counterpart of app.prepare_chat with the retrieval stages run concurrently.
+    Everything that may block (session and cache lookups, SQLite, starting the index load, prompt
+    packing) runs in worker threads so the event loop keeps serving other requests and streams.
+    """
+    resolved = await asyncio.to_thread(resolve_chat, data)
+    if "response" in resolved:
+        return resolved
+    model = resolved["model"]
+    serial = resolved["serial"]
+    user_query = data.get("query", "")
+    conversation = resolved["conversation"]
+    session = resolved["session"]
+
+    if not model and not serial:
+        return {"response": "Error: Please provide either a machine model or serial number."}
+
+    if not user_query:
+        user_messages = [m.get("content", "") for m in conversation if m.get("role") == "user"]
+        user_query = user_messages[-1] if user_messages else ""
+
+    # Machine details and common issues don't depend on the query, so start them right away;
+    # a session already holds its machine details from the first turn
+    machine_task = None
+    if session is None or session["machine_context"] is None:
+        machine_task = asyncio.create_task(run_stage("machine", asyncio.to_thread(machine_stage, model, serial)))
+    issues_task = None
+    if model:
+        issues_task = asyncio.create_task(run_stage("issues", asyncio.to_thread(issues_stage, model)))
+
+    query_embedding = None
+    if user_query:
+        query_embedding = await run_stage("embedding", generate_embedding_async(user_query))
+
+    cached_answer = await asyncio.to_thread(answer_cache.lookup, model, serial, conversation, query_embedding)
+    if cached_answer is not None:
+        for task in (machine_task, issues_task):
+            if task is not None:
+                task.cancel()
+        return dict(resolved, response=cached_answer, cached=True)
+
+    await asyncio.to_thread(ensure_index)
+
+    candidates = None
+    if user_query:
+        candidates = await run_stage(
+            "retrieval", asyncio.to_thread(retrieval_stage, model, serial, user_query, query_embedding, session)
+        )
+    common_issues = await issues_task if issues_task is not None else None
+
+    context = ContextBuilder("Machine Service History Analysis:\n\n")
+    if machine_task is None:
+        context.add(session["machine_context"])
+    else:
+        machine_info = await machine_task
+        machine_details = ContextBuilder()
+        if machine_info:
+            add_machine_details(machine_details, machine_info)
+        context.add(machine_details.build())
+        # Only remember details that actually arrived, so a timed-out lookup is retried next turn
+        if session is not None and machine_info:
+            session["machine_context"] = machine_details.build()
+            session["filter_model"], session["filter_serial"] = model, serial
+    # Common issues stand in when there is no query or the search came back empty
+    if not candidates:
+        add_common_issues(context, common_issues)
+
+    with span("context_assembly"):
+        packed = await asyncio.to_thread(lambda: context_packer.pack(
+            SYSTEM_PROMPT, context.build(), candidates or [], conversation, candidate_header=REPORT_HITS_HEADER
+        ))
+    return dict(
+        resolved,
+        messages=packed["messages"],
+        report_ids=packed["included_ids"],
+        cache_key=(model, serial, conversation, query_embedding),
+    )
+
+
+async def get_openai_response_async(messages):
+    try:
+        with span("llm"):
+            response = await asyncio.wait_for(
+                gateway.achat(
+                    model="gpt-4o-mini",
+                    messages=messages,
+                    max_tokens=500,
+                    n=1,
+                    temperature=0.7,
+                ),
+                STAGE_TIMEOUTS["completion"]
+            )
+        record_usage(getattr(response, "usage", None))
+        return response.choices[0].message.content.strip()
+    except asyncio.TimeoutError:
+        return "Error: the assistant took too long to respond, please try again."
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+async def stream_openai_response_async(messages):
+    """Yield the completion text as it arrives from the API"""
+    start = time.perf_counter()
+    first_token = True
+    with span("llm"):
+        stream = await gateway.achat_stream(
+            model="gpt-4o-mini",
+            messages=messages,
+            max_tokens=500,
+            n=1,
+            temperature=0.7,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            record_usage(getattr(chunk, "usage", None))
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token:
+                    record_span("llm_first_token", time.perf_counter() - start)
+                    first_token = False
+                yield chunk.choices[0].delta.content
+
+
+async def chat(data):
+    with request_trace("/chat", model=data.get("model"), mode="async") as trace:
+        prepared = await prepare_chat_async(data)
+        if "response" in prepared:
+            trace.outcome = "cached" if prepared.get("cached") else "rejected"
+            if prepared.get("cached"):
+                await asyncio.to_thread(finish_chat, prepared, prepared["response"])
+            return {
+                "response": prepared["response"],
+                "cached": prepared.get("cached", False),
+                "session_expired": prepared.get("session_expired", False),
+                **response_fields(prepared)
+            }
+
+        response_text = await get_openai_response_async(prepared["messages"])
+        if not response_text.startswith("Error"):
+            await asyncio.to_thread(answer_cache.store, *prepared["cache_key"], response_text)
+            await asyncio.to_thread(finish_chat, prepared, response_text)
+        else:
+            trace.outcome = "error"
+        return {"response": response_text, "report_ids": prepared["report_ids"], **response_fields(prepared)}
+
+
+async def chat_stream(data):
+    """Same events as the Flask /chat/stream: meta, token..., then done or error"""
+    with request_trace("/chat/stream", model=data.get("model"), mode="async") as trace:
+        try:
+            prepared = await prepare_chat_async(data)
+        except Exception as e:
+            trace.outcome = "error"
+            yield sse_event("error", {"message": f"Error: {str(e)}"})
+            return
+        if prepared.get("session_expired"):
+            yield sse_event("error", {"message": prepared["response"], "session_expired": True})
+            return
+        if "response" in prepared:
+            trace.outcome = "cached" if prepared.get("cached") else "rejected"
+            if prepared.get("cached"):
+                await asyncio.to_thread(finish_chat, prepared, prepared["response"])
+            yield sse_event("meta", {"report_ids": [], "cached": prepared.get("cached", False), **response_fields(prepared)})
+            yield sse_event("token", {"text": prepared["response"]})
+            yield sse_event("done", {})
+            return
+
+        yield sse_event("meta", {"report_ids": prepared["report_ids"], "cached": False, **response_fields(prepared)})
+        pieces = []
+        try:
+            async with asyncio.timeout(STAGE_TIMEOUTS["completion"]):
+                async for text in stream_openai_response_async(prepared["messages"]):
+                    pieces.append(text)
+                    yield sse_event("token", {"text": text})
+        except TimeoutError:
+            trace.outcome = "timeout"
+            yield sse_event("error", {"message": "Error: the assistant took too long to respond, please try again."})
+            return
+        except Exception as e:
+            trace.outcome = "error"
+            yield sse_event("error", {"message": f"Error: {str(e)}"})
+            return
+        answer = "".join(pieces).strip()
+        if answer:
+            await asyncio.to_thread(answer_cache.store, *prepared["cache_key"], answer)
+            await asyncio.to_thread(finish_chat, prepared, answer)
+        yield sse_event("done", {})
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, payload, status=200):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            start_background_indexing()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in ("/chat", "/chat/stream"):
+        try:
+            data = json.loads(await read_body(receive) or b"{}")
+        except ValueError:
+            await send_json(send, {"response": "Error: request body must be JSON."}, status=400)
+            return
+
+        if scope["path"] == "/chat":
+            await send_json(send, await chat(data))
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        async for event in chat_stream(data):
+            await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    await flask_application(scope, receive, send)
@@ -0,0 +1,76 @@
+"""
+Single-flight background jobs with progress reporting.
+
+Used for vector indexing so that neither startup nor the first /chat against an empty collection
+waits for a full reindex: the job runs on a daemon thread, a second start() while it is running
+is a no-op, and status() exposes progress for /readyz and /stats.
+"""
+
+import threading
+import time
+import traceback
+
+
+class BackgroundJob:
+    def __init__(self, name, target):
+        """target(progress) does the work; progress(dict) may be called with interim stats"""
+        self.name = name
+        self.target = target
+        self._lock = threading.Lock()
+        self._thread = None
+        self.state = "idle"  # idle, running, finished, failed
+        self.started = None
+        self.finished = None
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.runs = 0
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    def start(self):
+        """Start the job unless it is already running; returns True if a new run was started"""
+        with self._lock:
+            if self.running:
+                return False
+            self.state = "running"
+            self.started = time.time()
+            self.finished = None
+            self.progress = {}
+            self.error = None
+            self.runs += 1
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            return True
+
+    def _report(self, progress):
+        self.progress = dict(progress)
+
+    def _run(self):
+        try:
+            self.result = self.target(self._report)
+            self.state = "finished"
+        except Exception as e:
+            traceback.print_exc()
+            self.error = str(e)
+            self.state = "failed"
+        finally:
+            self.finished = time.time()
+
+    def wait(self, timeout=None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def status(self):
+        status = {"state": self.state, "runs": self.runs, "progress": self.progress}
+        if self.started:
+            status["started"] = self.started
+            status["elapsed_seconds"] = round((self.finished or time.time()) - self.started, 1)
+        if self.error:
+            status["error"] = self.error
+        if self.state == "finished" and isinstance(self.result, dict):
+            status["result"] = {k: v for k, v in self.result.items() if k != "changed_models"}
+        return status
@@ -0,0 +1,124 @@
+"""
+Section-level chunks of service reports for multi-vector retrieval.
+
+One embedding of "model + issue + solution + verification" dilutes long reports: a query about
+the fix has to match a vector that is mostly about the symptom.  With chunking each report is
+indexed as its Issue, Solution and Verification sections, and sections longer than
+CHUNK_WORDS are split further into overlapping word windows.  Every chunk carries its parent's
+service_report_id, so filters still work per report, and its id encodes where it came from:
+
+    "<report id>:<section>:<window>"    e.g. "10442:solution:0"
+
+Search hits on chunks are collapsed back to reports (best chunk, or the sum over a report's
+chunks), and since the chunk text can be rebuilt from the report row and the id, the context
+only shows the sections that matched.
+"""
+
+CHUNK_WORDS = 120
+CHUNK_OVERLAP = 30
+
+# (section key, label used in chunk text and context)
+SECTIONS = (("issue", "Issue"), ("solution", "Solution"), ("verification", "Verification"))
+SECTION_LABELS = dict(SECTIONS)
+
+# Recorded in the index state so changing the window size re-embeds everything
+CHUNK_SPEC = f"sections/{CHUNK_WORDS}/{CHUNK_OVERLAP}"
+
+
+def chunk_id(report_id, section, window):
+    return f"{report_id}:{section}:{window}"
+
+
+def parse_chunk_id(value):
+    """(report id, section, window) from a chunk id"""
+    report_id, section, window = str(value).rsplit(":", 2)
+    return report_id, section, int(window)
+
+
+def windows(text, max_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Overlapping word windows of text; a single window when it is short enough"""
+    words = (text or "").split()
+    if len(words) <= max_words:
+        return [" ".join(words)] if words else []
+    step = max(max_words - overlap, 1)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + max_words]))
+        if start + max_words >= len(words):
+            break
+    return chunks
+
+
+def section_chunks(work_required, service_performed, verification):
+    """[(section, window, text)] for a report's non-empty sections"""
+    chunks = []
+    for (section, _), text in zip(SECTIONS, (work_required, service_performed, verification)):
+        for window, chunk in enumerate(windows(text)):
+            chunks.append((section, window, chunk))
+    return chunks
+
+
+def build_report_chunks(report_id, text_fields, metadata):
+    """
+    (id, text, metadata) per chunk for the vector store.  text_fields is (work_required,
+    service_performed, verification); metadata is the report's, extended with section/window.
+    """
+    model = metadata.get("model", "")
+    entries = []
+    for section, window, text in section_chunks(*text_fields):
+        entries.append((
+            chunk_id(report_id, section, window),
+            f"Model: {model}\n{SECTION_LABELS[section]}: {text}",
+            dict(metadata, section=section, window=window),
+        ))
+    return entries
+
+
+def distance_similarity(distance):
+    """Positive, decreasing in distance; works for both Chroma's L2 and the mmap store's cosine distance"""
+    return 1.0 / (1.0 + max(distance, 0.0))
+
+
+def collapse_chunk_hits(ids, distances, scoring="max"):
+    """
+    Group chunk hits by parent report: [(report id, best distance, [chunk ids best first])], best
+    report first.  scoring "max" ranks reports by their best chunk, "sum" by the summed
+    similarity of all their matching chunks (favouring reports that match in several places).
+    """
+    grouped = {}
+    for vector_id, distance in zip(ids, distances):
+        report_id = parse_chunk_id(vector_id)[0]
+        entry = grouped.setdefault(report_id, {"distance": distance, "score": 0.0, "chunks": []})
+        entry["chunks"].append(vector_id)
+        entry["distance"] = min(entry["distance"], distance)
+        similarity = distance_similarity(distance)
+        entry["score"] = entry["score"] + similarity if scoring == "sum" else max(entry["score"], similarity)
+    ranked = sorted(grouped.items(), key=lambda item: item[1]["score"], reverse=True)
+    return [(report_id, entry["distance"], entry["chunks"]) for report_id, entry in ranked]
+
+
+def matched_sections(text_fields, chunk_ids):
+    """
+    [(label, text)] for the matched chunks of a report, in section order, rebuilt from its
+    (work_required, service_performed, verification).  A window of a longer section is marked
+    with "..." where it was cut.
+    """
+    wanted = {}
+    for value in chunk_ids:
+        _, section, window = parse_chunk_id(value)
+        wanted.setdefault(section, set()).add(window)
+    sections = []
+    for (section, label), text in zip(SECTIONS, text_fields):
+        if section not in wanted:
+            continue
+        parts = windows(text)
+        chosen = [i for i in sorted(wanted[section]) if i < len(parts)]
+        if not chosen:
+            continue
+        if len(parts) == 1:
+            sections.append((label, parts[0]))
+            continue
+        # Adjacent windows overlap, so show each one on its own rather than stitching them
+        for i in chosen:
+            sections.append((label, ("... " if i > 0 else "") + parts[i] + (" ..." if i < len(parts) - 1 else "")))
+    return sections
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Token-budgeted prompt assembly for /chat.
+
+Prompt size used to be estimated as total_chars / 4, and when that passed 15000 the system prompt
+was cut in half, which could drop the most relevant report mid-sentence while keeping weaker ones.
+ContextPacker instead measures every piece with a tokenizer and fills a fixed prompt budget:
+
+- The system prompt, the fixed context (machine details, common issues) and the latest user
+  message are always kept.
+- Recent turns are kept verbatim up to a share of the budget. Older turns are condensed into a
+  short summary note, and the oldest are dropped once even that no longer fits.
+- Retrieved reports fill what's left, chosen greedily by relevance per token and shown in
+  relevance order.
+
+The tokenizer is tiktoken when it is installed (exact counts), otherwise a linear estimator over
+word / number / punctuation counts.  The estimator's coefficients can be fitted offline against
+tiktoken on the real service reports:
+
+    python context_packer.py --calibrate --db ../masterData.sqlite3
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+
+import numpy as np
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'masterData.sqlite3')
+DEFAULT_CALIBRATION_PATH = os.path.join(os.path.dirname(__file__), 'vectordb', 'tokenizer_calibration.json')
+
+# Typical BPE behaviour on English text: most words are one token, numbers split every ~3 digits,
+# punctuation is usually its own token
+DEFAULT_COEFFICIENTS = {"words": 1.3, "digits": 0.34, "punctuation": 0.9, "intercept": 0.0}
+
+_WORD_RE = re.compile(r"[A-Za-z]+")
+_DIGIT_RE = re.compile(r"\d")
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+class TiktokenTokenizer:
+    """Exact counts with the model's BPE encoding"""
+
+    exact = True
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+
+    def count(self, text):
+        return len(self.encoding.encode(text or "", disallowed_special=()))
+
+    def truncate(self, text, max_tokens):
+        tokens = self.encoding.encode(text or "", disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max(max_tokens, 0)])
+
+
+class EstimatingTokenizer:
+    """Linear estimate from word, digit and punctuation counts; no dependencies"""
+
+    exact = False
+
+    def __init__(self, coefficients=None):
+        self.coefficients = dict(DEFAULT_COEFFICIENTS, **(coefficients or {}))
+
+    @staticmethod
+    def features(text):
+        return (len(_WORD_RE.findall(text)), len(_DIGIT_RE.findall(text)), len(_PUNCT_RE.findall(text)))
+
+    def count(self, text):
+        if not text:
+            return 0
+        words, digits, punctuation = self.features(text)
+        c = self.coefficients
+        estimate = c["intercept"] + c["words"] * words + c["digits"] * digits + c["punctuation"] * punctuation
+        return max(1, math.ceil(estimate))
+
+    def truncate(self, text, max_tokens):
+        if self.count(text) <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return ""
+        # Binary search on a word boundary
+        words = text.split(" ")
+        low, high = 0, len(words)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.count(" ".join(words[:mid])) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return " ".join(words[:low])
+
+
+def load_calibration(path=DEFAULT_CALIBRATION_PATH):
+    if not path:
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f).get("coefficients")
+    except (OSError, ValueError):
+        return None
+
+
+def get_tokenizer(model="gpt-4o-mini", calibration_path=DEFAULT_CALIBRATION_PATH):
+    """tiktoken for model when available, otherwise the (calibrated, if fitted) estimator"""
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        return TiktokenTokenizer(encoding)
+    except Exception as e:
+        # Not installed, or the encoding files can't be fetched
+        print(f"Using estimated token counts ({e.__class__.__name__})")
+        return EstimatingTokenizer(load_calibration(calibration_path))
+
+
+def calibrate(texts, exact_tokenizer):
+    """Least-squares fit of the estimator's coefficients to exact counts; returns (coefficients, mean abs % error)"""
+    rows = [EstimatingTokenizer.features(t) + (1,) for t in texts if t]
+    targets = [exact_tokenizer.count(t) for t in texts if t]
+    solution, *_ = np.linalg.lstsq(np.asarray(rows, dtype=np.float64), np.asarray(targets, dtype=np.float64), rcond=None)
+    coefficients = dict(zip(["words", "digits", "punctuation", "intercept"], (float(v) for v in solution)))
+    estimator = EstimatingTokenizer(coefficients)
+    errors = [abs(estimator.count(t) - target) / max(target, 1) for t, target in zip([t for t in texts if t], targets)]
+    return coefficients, sum(errors) / len(errors)
+
+
+class ContextPacker:
+    """
+    Assemble chat messages within max_prompt_tokens.
+
+    candidates are dicts with "id", "score" (higher is better) and "text" (the rendered section).
+    """
+
+    def __init__(self, tokenizer, max_prompt_tokens=6000, recent_turns=6, max_history_share=0.35,
+                 turn_summary_tokens=40, message_overhead=4):
+        self.tokenizer = tokenizer
+        self.max_prompt_tokens = max_prompt_tokens
+        self.recent_turns = recent_turns
+        self.max_history_share = max_history_share
+        self.turn_summary_tokens = turn_summary_tokens
+        self.message_overhead = message_overhead
+
+    def _message_tokens(self, content):
+        return self.tokenizer.count(content) + self.message_overhead
+
+    def _summarize_turn(self, message):
+        """First sentence of the turn, clipped to turn_summary_tokens"""
+        content = " ".join((message.get("content") or "").split())
+        first_sentence = re.split(r"(?<=[.!?])\s", content, maxsplit=1)[0]
+        clipped = self.tokenizer.truncate(first_sentence, self.turn_summary_tokens)
+        if clipped != content:
+            clipped = clipped.rstrip() + " ..."
+        return f"- {message.get('role')}: {clipped}"
+
+    def _fit_history(self, history, budget):
+        """(turns kept verbatim, summary message or None, tokens used, turns summarized)"""
+        kept, used = [], 0
+        index = len(history)
+        while index > 0 and len(kept) < self.recent_turns:
+            cost = self._message_tokens(history[index - 1].get("content") or "")
+            if used + cost > budget:
+                break
+            kept.insert(0, history[index - 1])
+            used += cost
+            index -= 1
+
+        older = history[:index]
+        header = "Summary of earlier turns in this conversation:"
+        summary_lines = []
+        summary_cost = self._message_tokens(header)
+        for message in reversed(older):
+            line = self._summarize_turn(message)
+            cost = self.tokenizer.count(line) + 1
+            if used + summary_cost + cost > budget:
+                break
+            summary_lines.insert(0, line)
+            summary_cost += cost
+        if not summary_lines:
+            return kept, None, used, 0
+        summary = {"role": "system", "content": header + "\n" + "\n".join(summary_lines)}
+        return kept, summary, used + summary_cost, len(summary_lines)
+
+    def _select_candidates(self, candidates, budget):
+        """Greedy by score per token, returned in score order"""
+        costs = [self.tokenizer.count(c["text"]) + 1 for c in candidates]
+        order = sorted(range(len(candidates)), key=lambda i: candidates[i]["score"] / max(costs[i], 1), reverse=True)
+        chosen, used = [], 0
+        for i in order:
+            if used + costs[i] <= budget:
+                chosen.append(i)
+                used += costs[i]
+        chosen.sort(key=lambda i: candidates[i]["score"], reverse=True)
+        return [candidates[i] for i in chosen], used
+
+    def pack(self, system_template, fixed_context, candidates, conversation, candidate_header=""):
+        """
+        Returns {"messages", "included_ids", "dropped_ids", "prompt_tokens", "summarized_turns",
+        "dropped_turns"}.  system_template has one {0} slot for the context.
+        """
+        budget = self.max_prompt_tokens
+        latest = list(conversation[-1:])
+        history = list(conversation[:-1])
+
+        base = self._message_tokens(system_template.format(fixed_context))
+        if latest:
+            # A pasted log can't be allowed to take the whole prompt
+            latest_content = latest[0].get("content") or ""
+            max_latest = max(budget // 2, 1)
+            if self.tokenizer.count(latest_content) > max_latest:
+                latest = [dict(latest[0], content=self.tokenizer.truncate(latest_content, max_latest))]
+            base += self._message_tokens(latest[0].get("content") or "")
+        if base > budget:
+            # Fixed context alone is over budget: keep its head
+            overflow = base - budget
+            fixed_context = self.tokenizer.truncate(fixed_context, max(self.tokenizer.count(fixed_context) - overflow, 0))
+            base = budget
+
+        history_budget = min(int(budget * self.max_history_share), budget - base)
+        kept, summary, history_used, summarized = self._fit_history(history, history_budget)
+
+        remaining = budget - base - history_used
+        header_cost = self.tokenizer.count(candidate_header) + 1 if candidate_header else 0
+        chosen, candidates_used = self._select_candidates(candidates, remaining - header_cost) if candidates else ([], 0)
+
+        context = fixed_context
+        if chosen:
+            context += (candidate_header + "\n" if candidate_header else "") + "".join(c["text"] for c in chosen)
+        messages = [{"role": "system", "content": system_template.format(context)}]
+        if summary:
+            messages.append(summary)
+        messages.extend(kept)
+        messages.extend(latest)
+
+        chosen_ids = {c["id"] for c in chosen}
+        return {
+            "messages": messages,
+            "included_ids": [c["id"] for c in chosen],
+            "dropped_ids": [c["id"] for c in candidates if c["id"] not in chosen_ids],
+            "prompt_tokens": base + history_used + (candidates_used + header_cost if chosen else 0),
+            "summarized_turns": summarized,
+            "dropped_turns": len(history) - len(kept) - summarized,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the token estimator to exact tiktoken counts on service reports")
+    parser.add_argument("--calibrate", action="store_true", help="Fit and save estimator coefficients")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to masterData.sqlite3")
+    parser.add_argument("--output", default=DEFAULT_CALIBRATION_PATH, help="Where to write the coefficients")
+    parser.add_argument("--sample", type=int, default=5000, help="Number of reports to sample")
+    parser.add_argument("--model", default="gpt-4o-mini", help="Chat model whose tokenizer to match")
+    args = parser.parse_args()
+    if not args.calibrate:
+        parser.print_help()
+        return
+
+    exact = get_tokenizer(args.model, calibration_path=None)
+    if not exact.exact:
+        print("tiktoken is required for calibration (pip install tiktoken)")
+        return
+    conn = sqlite3.connect(args.db)
+    try:
+        rows = conn.execute("""
+            SELECT IFNULL(WorkRequired, '') || ' ' || IFNULL(ServicePerformed, '') || ' ' || IFNULL(VerificationTest, '')
+            FROM ServiceReports ORDER BY RANDOM() LIMIT ?
+        """, (args.sample,)).fetchall()
+    finally:
+        conn.close()
+    coefficients, error = calibrate([r[0].strip() for r in rows], exact)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"model": args.model, "samples": len(rows), "mean_abs_error": error, "coefficients": coefficients}, f, indent=2)
+    print(f"Calibrated on {len(rows)} reports, mean absolute error {error:.1%}; wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Per-thread, read-only SQLite connection manager for masterData.sqlite3.
+
+Opening a connection per request is cheap on paper but, under concurrent load, the open/close
+churn plus SQLite's default (write-oriented, small cache) settings dominate the small lookups the
+chat path makes.  ConnectionManager hands each worker thread one long-lived read-only connection
+tuned for reads (mmap, larger page cache, query_only) and keeps Python's per-connection prepared
+statement cache warm for the fixed queries.
+
+The pool never writes to the database.  With an overlay (an active index snapshot's aux.sqlite3,
+see snapshots.py) each connection opens the overlay as main and attaches masterData.sqlite3, so
+the side tables the snapshot carries are read from it while the report tables come from the
+database; set_overlay() switches every thread on its next checkout.
+
+Readers run alongside the indexer's writes once the database is in WAL mode, which is a one-time
+switch made by a writable connection:
+
+    python db_pool.py --db ../masterData.sqlite3
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'masterData.sqlite3')
+
+
+def enable_wal(db_path=DEFAULT_DB_PATH):
+    """Switch the database to WAL (persistent); returns the journal mode"""
+    conn = sqlite3.connect(db_path)
+    try:
+        mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        print(f"Journal mode of {db_path}: {mode}")
+        return mode
+    finally:
+        conn.close()
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connection whose close() is a no-op so legacy call sites can't close a shared handle"""
+
+    def close(self):
+        pass
+
+    def really_close(self):
+        super().close()
+
+
+class ConnectionManager:
+    def __init__(self, db_path, mmap_size=256 * 1024 * 1024, cache_size_kib=64 * 1024, statement_cache_size=128,
+                 overlay_path=None):
+        self.db_path = os.path.abspath(db_path)
+        self.overlay_path = os.path.abspath(overlay_path) if overlay_path else None
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.statement_cache_size = statement_cache_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._stats = {"opened": 0, "closed": 0, "checkouts": 0, "reused": 0, "errors": 0}
+        self._generation = 0  # bumped by set_overlay
+        self.journal_mode = None
+
+    def set_overlay(self, overlay_path):
+        """Read tables found in overlay_path ahead of db_path's (None: db_path only)"""
+        overlay_path = os.path.abspath(overlay_path) if overlay_path else None
+        with self._lock:
+            if overlay_path != self.overlay_path:
+                self.overlay_path = overlay_path
+                self._generation += 1
+
+    def _open(self, overlay_path):
+        conn = sqlite3.connect(
+            f"file:{overlay_path or self.db_path}?mode=ro",
+            uri=True,
+            factory=PooledConnection,
+            cached_statements=self.statement_cache_size,
+            check_same_thread=True
+        )
+        if overlay_path:
+            # Unqualified names resolve in main first, then in attached databases
+            conn.execute("ATTACH DATABASE ? AS source", (f"file:{self.db_path}?mode=ro",))
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size={-int(self.cache_size_kib)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA query_only=1")
+        if self.journal_mode is None:
+            # Reading the mode doesn't change it; without WAL, indexing blocks readers while it commits
+            schema = "source" if overlay_path else "main"
+            self.journal_mode = conn.execute(f"PRAGMA {schema}.journal_mode").fetchone()[0]
+            if self.journal_mode != "wal":
+                print(f"Note: {self.db_path} is in {self.journal_mode} journal mode; run db_pool.py once to enable WAL")
+        return conn
+
+    def _prune(self):
+        """Close connections owned by threads that have exited (caller holds the lock)"""
+        alive = {t.ident for t in threading.enumerate()}
+        for ident in [i for i in self._connections if i not in alive]:
+            conn, _ = self._connections.pop(ident)
+            try:
+                conn.really_close()
+            except sqlite3.Error:
+                # Connections can only be closed from their own thread on some builds; let GC do it
+                pass
+            self._stats["closed"] += 1
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        with self._lock:
+            self._stats["checkouts"] += 1
+            if conn is not None and self._local.generation == self._generation:
+                self._stats["reused"] += 1
+                return conn
+            generation, overlay_path = self._generation, self.overlay_path
+        # A connection opened before the overlay changed is dropped, not closed: the request that
+        # checked it out may still be using it (it closes once unreferenced)
+        try:
+            conn = self._open(overlay_path)
+        except sqlite3.Error:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        self._local.conn = conn
+        self._local.generation = generation
+        with self._lock:
+            self._prune()
+            self._connections[threading.get_ident()] = (conn, time.time())
+            self._stats["opened"] += 1
+        return conn
+
+    def close_thread_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            self._connections.pop(threading.get_ident(), None)
+            self._stats["closed"] += 1
+        conn.really_close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open_connections"] = len(self._connections)
+            stats["journal_mode"] = self.journal_mode
+            stats["overlay"] = self.overlay_path
+            stats["reuse_rate"] = round(stats["reused"] / stats["checkouts"], 4) if stats["checkouts"] else 0.0
+            return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Put masterData.sqlite3 in WAL mode so readers don't wait on indexing")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to masterData.sqlite3")
+    args = parser.parse_args()
+    enable_wal(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Persistent, content-addressed embedding cache.
+
+Embeddings are keyed by (model name, sha256 of the text) and stored as packed float32 blobs in a
+small SQLite file, with an in-memory LRU in front for hot query strings.  The same cache is used
+by the indexer (through CachedOpenAIEmbeddingFunction, which Chroma calls for documents and
+queries) and by app.generate_embedding, so unchanged reports and repeated questions never hit the
+embeddings API twice.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from chromadb.utils import embedding_functions
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'vectordb', 'embedding_cache.sqlite3')
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed embedding store with an LRU memory front; safe to share between threads"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, memory_items=2048):
+        self.path = path
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            model TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            vector BLOB NOT NULL,
+            PRIMARY KEY (model, text_hash)
+        ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model, texts):
+        """Return a list aligned with texts holding cached vectors (np.float32) or None for misses"""
+        results = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = (model, text_key(text))
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                else:
+                    missing.setdefault(key[1], []).append(i)
+
+            hashes = list(missing)
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model] + chunk
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember((model, text_hash), vector)
+                    for i in missing[text_hash]:
+                        results[i] = vector
+
+            found = sum(1 for r in results if r is not None)
+            self.hits += found
+            self.misses += len(texts) - found
+        return results
+
+    def get(self, model, text):
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model, texts, vectors):
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                text_hash = text_key(text)
+                self._remember((model, text_hash), vector)
+                rows.append((model, text_hash, int(vector.shape[0]), vector.tobytes()))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self.conn.commit()
+
+    def put(self, model, text, vector):
+        self.put_many(model, [text], [vector])
+
+    def stats(self):
+        with self._lock:
+            stored = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "memory_items": len(self._memory),
+                "stored_items": stored,
+            }
+
+    def close(self):
+        self.conn.close()
+
+
+def embed_with_cache(cache, model, texts, embed_fn):
+    """Resolve texts through the cache, calling embed_fn(list_of_texts) only for the misses"""
+    results = cache.get_many(model, texts)
+    missing = [i for i, vector in enumerate(results) if vector is None]
+    if missing:
+        # Identical texts in one call are only embedded once
+        unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+        vectors = embed_fn(unique_texts)
+        cache.put_many(model, unique_texts, vectors)
+        by_text = {text: np.asarray(vector, dtype=np.float32) for text, vector in zip(unique_texts, vectors)}
+        for i in missing:
+            results[i] = by_text[texts[i]]
+    return results
+
+
+class CachedOpenAIEmbeddingFunction(embedding_functions.OpenAIEmbeddingFunction):
+    """
+    Drop-in replacement for Chroma's OpenAIEmbeddingFunction that consults an EmbeddingCache first.
+    With a gateway (openai_gateway.OpenAIGateway) cache misses go through its rate limits and
+    retries instead of Chroma's own client.
+    """
+
+    def __init__(self, cache, api_key=None, model_name="text-embedding-3-small", gateway=None, **kwargs):
+        super().__init__(api_key=api_key, model_name=model_name, **kwargs)
+        self.cache = cache
+        self.cache_model_name = model_name
+        self.gateway = gateway
+
+    def __call__(self, input):
+        if self.gateway is not None:
+            embed_fn = lambda texts: self.gateway.embed(texts, self.cache_model_name)
+        else:
+            embed_fn = lambda texts: super(CachedOpenAIEmbeddingFunction, self).__call__(texts)
+        return embed_with_cache(self.cache, self.cache_model_name, list(input), embed_fn)
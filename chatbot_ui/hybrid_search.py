@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Hybrid lexical + vector retrieval over service reports.
+
+- An FTS5 table (ServiceReportsFTS) in masterData.sqlite3 indexes WorkRequired, ServicePerformed and
+  VerificationTest, so exact alarm codes and part numbers match even when embeddings blur them.
+- Model/serial filtering happens in SQL first (through the model catalog), producing the candidate
+  id set; the lexical search runs inside that set and the vector search is restricted to it.
+- The two ranked lists are merged with reciprocal-rank fusion.
+- Alarm codes and part numbers in the query are looked up in the identifier index
+  (identifier_index.py) first; reports that mention them go ahead of the fused hits.
+- With near-duplicate groups (near_duplicates.py) hits collapse to one report per group, and the
+  final n results are picked from a larger pool by maximal marginal relevance, so near-identical
+  reports don't crowd out different fixes.
+- Over a chunked collection (chunking.py), vector hits on sections are collapsed to their reports
+  first, and each hit lists the chunks that matched.
+
+Build (or rebuild) the FTS index once; the indexer keeps it in sync afterwards:
+
+    python hybrid_search.py --db ../masterData.sqlite3
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from chunking import collapse_chunk_hits
+from identifier_index import extract_identifiers, lookup as identifier_lookup
+from issue_summary import issue_tokens, jaccard
+from metrics import span
+from model_catalog import model_filter_sql
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'masterData.sqlite3')
+FTS_TABLE = "ServiceReportsFTS"
+
+# Without a model catalog, the Model values a user input LIKE-matches are looked up with a table
+# scan; results are kept this long (per input) so the scan isn't paid on every request
+MODEL_MATCH_CACHE_SIZE = 256
+MODEL_MATCH_TTL_SECONDS = 600
+
+FTS_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    report_id UNINDEXED,
+    model UNINDEXED,
+    serial UNINDEXED,
+    WorkRequired,
+    ServicePerformed,
+    VerificationTest,
+    tokenize = "unicode61 tokenchars '-'"
+)
+"""
+
+# Words that carry no signal for service-report search
+STOPWORDS = {
+    "a", "an", "and", "are", "at", "be", "but", "by", "can", "do", "does", "for", "from", "has",
+    "have", "how", "i", "in", "is", "it", "its", "my", "not", "of", "on", "or", "our", "the",
+    "this", "to", "was", "what", "when", "why", "with", "won't", "wont",
+}
+
+
+def fts_exists(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).fetchone()
+    return row is not None
+
+
+def upsert_fts(conn, rows):
+    """
+    rows: iterable of (source_rowid, report_id, model, serial, work_required, service_performed,
+    verification).  The FTS rowid mirrors ServiceReports.rowid so replacing a report is a keyed write.
+    """
+    rows = [tuple("" if v is None else v for v in row) for row in rows]
+    if not rows:
+        return
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {FTS_TABLE} "
+        "(rowid, report_id, model, serial, WorkRequired, ServicePerformed, VerificationTest) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(r[0], str(r[1])) + r[2:] for r in rows]
+    )
+    conn.commit()
+
+
+def delete_fts(conn, report_ids):
+    report_ids = [str(r) for r in report_ids]
+    for i in range(0, len(report_ids), 500):
+        chunk = report_ids[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(f"DELETE FROM {FTS_TABLE} WHERE report_id IN ({placeholders})", chunk)
+    conn.commit()
+
+
+def bootstrap_fts(db_path=DEFAULT_DB_PATH):
+    """(Re)build the FTS index from ServiceReports"""
+    conn = sqlite3.connect(db_path)
+    try:
+        start = time.time()
+        conn.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        conn.execute(FTS_SCHEMA)
+        conn.execute(f"""
+            INSERT INTO {FTS_TABLE} (rowid, report_id, model, serial, WorkRequired, ServicePerformed, VerificationTest)
+            SELECT rowid, CAST(ServiceReport_id AS TEXT), IFNULL(Model, ''), IFNULL(Serial, ''),
+                   IFNULL(WorkRequired, ''), IFNULL(ServicePerformed, ''), IFNULL(VerificationTest, '')
+            FROM ServiceReports
+        """)
+        conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        conn.commit()
+        count = conn.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}").fetchone()[0]
+        print(f"FTS index ready: {count} reports in {time.time() - start:.2f}s")
+        return count
+    finally:
+        conn.close()
+
+
+def build_match_query(text, max_terms=16):
+    """
+    Turn free text into a safe FTS5 query: each significant term quoted (so '-' and other
+    punctuation can't be parsed as operators) and OR-ed together, letting bm25 do the ranking.
+    """
+    terms = []
+    for token in re.findall(r"[A-Za-z0-9][A-Za-z0-9\-]*", text or ""):
+        token = token.strip("-").lower()
+        if not token or token in STOPWORDS or (len(token) < 2 and not token.isdigit()):
+            continue
+        if token not in terms:
+            terms.append(token)
+    if not terms:
+        return None
+    return " OR ".join(f'"{t}"' for t in terms[:max_terms])
+
+
+def report_tokens(conn, report_ids):
+    """{report id: issue/solution token set} for similarity between reports"""
+    tokens = {}
+    report_ids = [str(r) for r in report_ids]
+    for i in range(0, len(report_ids), 500):
+        chunk = report_ids[i:i + 500]
+        for report_id, work_required, service_performed in conn.execute(
+            "SELECT ServiceReport_id, WorkRequired, ServicePerformed FROM ServiceReports "
+            f"WHERE ServiceReport_id IN ({','.join('?' * len(chunk))})", chunk
+        ):
+            tokens[str(report_id)] = issue_tokens(work_required, service_performed)
+    return tokens
+
+
+def mmr_select(ranked, similarity, k, mmr_lambda=0.5, pinned=0):
+    """
+    Maximal marginal relevance: pick k of ranked [(id, score)] one at a time, each maximizing
+    mmr_lambda * relevance - (1 - mmr_lambda) * (max similarity to those already picked), with
+    relevance the score min-max scaled over the pool.  The first pinned entries are kept as they are.
+    """
+    selected = list(ranked[:pinned])
+    pool = list(ranked[pinned:])
+    if not pool:
+        return selected[:k]
+    high = max(score for _, score in pool)
+    low = min(score for _, score in pool)
+    spread = (high - low) or 1.0
+    while pool and len(selected) < k:
+        best, best_value = 0, None
+        for i, (report_id, score) in enumerate(pool):
+            redundancy = max((similarity(report_id, other) for other, _ in selected), default=0.0)
+            value = mmr_lambda * (score - low) / spread - (1 - mmr_lambda) * redundancy
+            if best_value is None or value > best_value:
+                best, best_value = i, value
+        selected.append(pool.pop(best))
+    return selected
+
+
+def reciprocal_rank_fusion(ranked_lists, k=60, weights=None):
+    """
+    Merge several ranked id lists: score(id) = sum(weight / (k + rank)).  Returns [(id, score)] best first.
+    """
+    scores = {}
+    for i, ranked in enumerate(ranked_lists):
+        weight = weights[i] if weights else 1.0
+        for rank, item in enumerate(ranked, start=1):
+            scores[item] = scores.get(item, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+
+class HybridRetriever:
+    """
+    SQL pre-filter -> (FTS5 bm25, vector search restricted to the candidates) -> RRF.
+
+    collection is the Chroma collection (anything with a compatible .query()); resolve_models maps
+    user model input to exact Model values (ModelResolver.resolve).  With chunked=True the
+    collection holds section chunks: chunk_fanout * vector_k chunks are fetched and collapsed to
+    reports with chunk_scoring "max" (best chunk) or "sum" (all matching chunks).  Up to exact_k
+    reports found through identifiers in the query are ranked first (0 turns this off).
+
+    duplicate_groups (near_duplicates.DuplicateGroups) collapses hits to one per near-duplicate
+    group; the collection then only holds representatives, so candidate filters are mapped to
+    them.  With mmr_lambda < 1 the results are chosen by MMR from mmr_pool * n_results hits.
+    """
+
+    def __init__(self, collection, resolve_models=None, lexical_k=20, vector_k=20, rrf_k=60,
+                 max_candidate_ids=2000, chunked=False, chunk_scoring="max", chunk_fanout=3, exact_k=5,
+                 duplicate_groups=None, mmr_lambda=0.5, mmr_pool=3):
+        self.collection = collection
+        self.resolve_models = resolve_models
+        self.lexical_k = lexical_k
+        self.vector_k = vector_k
+        self.rrf_k = rrf_k
+        self.max_candidate_ids = max_candidate_ids
+        self.chunked = chunked
+        self.chunk_scoring = chunk_scoring
+        self.chunk_fanout = chunk_fanout
+        self.exact_k = exact_k
+        self.duplicate_groups = duplicate_groups
+        self.mmr_lambda = mmr_lambda
+        self.mmr_pool = mmr_pool
+        self._model_matches = OrderedDict()  # model input -> (looked up at, [Model values])
+        self._model_matches_lock = threading.Lock()
+
+    def _filter_sql(self, model, serial, model_column="Model", serial_column="Serial"):
+        clauses = []
+        params = []
+        models = None
+        if model:
+            models = self.resolve_models(model) if self.resolve_models else None
+            clause, clause_params = model_filter_sql(model_column, models, model)
+            clauses.append(clause)
+            params.extend(clause_params)
+        if serial:
+            clauses.append(f"{serial_column} = ?")
+            params.append(serial)
+        return " AND ".join(clauses), params, models
+
+    def _candidate_rows(self, conn, model=None, serial=None):
+        """(ServiceReport_id, Model) rows passing the filter, or None when unfiltered or too many"""
+        where_sql, params, _ = self._filter_sql(model, serial)
+        if not where_sql:
+            return None
+        with span("sql_candidates"):
+            rows = conn.execute(
+                f"SELECT ServiceReport_id, Model FROM ServiceReports WHERE {where_sql} LIMIT ?",
+                params + [self.max_candidate_ids + 1]
+            ).fetchall()
+        if len(rows) > self.max_candidate_ids:
+            return None
+        return rows
+
+    def candidate_ids(self, conn, model=None, serial=None):
+        """Report ids passing the model/serial filter, or None when unfiltered or too many to pass along"""
+        rows = self._candidate_rows(conn, model, serial)
+        return [str(r[0]) for r in rows] if rows is not None else None
+
+    def matching_models(self, conn, model):
+        """Model values containing model, without a catalog; one table scan per input and TTL"""
+        key = model.strip().upper()
+        now = time.time()
+        with self._model_matches_lock:
+            cached = self._model_matches.get(key)
+            if cached is not None and now - cached[0] < MODEL_MATCH_TTL_SECONDS:
+                self._model_matches.move_to_end(key)
+                return cached[1]
+        models = [r[0] for r in conn.execute(
+            "SELECT DISTINCT Model FROM ServiceReports WHERE Model LIKE ?", (f"%{model}%",)
+        )]
+        with self._model_matches_lock:
+            self._model_matches[key] = (now, models)
+            self._model_matches.move_to_end(key)
+            while len(self._model_matches) > MODEL_MATCH_CACHE_SIZE:
+                self._model_matches.popitem(last=False)
+        return models
+
+    def lexical_search(self, conn, query, model=None, serial=None, limit=None):
+        """[(report_id, bm25)] best first; empty if the FTS index hasn't been built"""
+        match = build_match_query(query)
+        if not match or not fts_exists(conn):
+            return []
+        where_sql, params, _ = self._filter_sql(model, serial, model_column="model", serial_column="serial")
+        sql = f"SELECT report_id, bm25({FTS_TABLE}) AS score FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?"
+        if where_sql:
+            sql += f" AND {where_sql}"
+        sql += " ORDER BY score LIMIT ?"
+        try:
+            with span("lexical_search"):
+                return conn.execute(sql, [match] + params + [limit or self.lexical_k]).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"Lexical search failed: {e}")
+            return []
+
+    def _vector_where(self, candidates, models, serial):
+        if candidates is not None:
+            return {"service_report_id": {"$in": candidates}}
+        clauses = []
+        if models:
+            clauses.append({"model": {"$in": list(models)}})
+        if serial:
+            clauses.append({"serial": serial})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def vector_search(self, query, candidates=None, models=None, serial=None, limit=None, query_embedding=None):
+        """[(report_id, distance)] best first"""
+        return [(report_id, distance) for report_id, distance, _ in self.vector_report_search(
+            query, candidates, models, serial, limit, query_embedding
+        )]
+
+    def vector_report_search(self, query, candidates=None, models=None, serial=None, limit=None, query_embedding=None):
+        """[(report_id, distance, matched chunk ids or None)] best first"""
+        if candidates is not None and not candidates:
+            return []
+        limit = limit or self.vector_k
+        # Only group representatives have vectors: search those, and report the candidate itself
+        substitutes = {}
+        if candidates is not None and self.duplicate_groups is not None:
+            representatives = self.duplicate_groups.representatives(candidates)
+            for report_id in candidates:
+                representative = representatives.get(report_id, report_id)
+                if representative == report_id or representative not in substitutes:
+                    substitutes[representative] = report_id
+            candidates = list(substitutes)
+        kwargs = {"query_embeddings": [query_embedding]} if query_embedding is not None else {"query_texts": [query]}
+        with span("vector_search"):
+            results = self.collection.query(
+                n_results=limit * self.chunk_fanout if self.chunked else limit,
+                where=self._vector_where(candidates, models, serial),
+                include=["distances"],
+                **kwargs
+            )
+        if not results or not results["ids"] or not results["ids"][0]:
+            return []
+        if self.chunked:
+            hits = collapse_chunk_hits(results["ids"][0], results["distances"][0], self.chunk_scoring)[:limit]
+        else:
+            hits = [(report_id, distance, None) for report_id, distance in zip(results["ids"][0], results["distances"][0])]
+        return [(substitutes.get(str(report_id), report_id), distance, chunks) for report_id, distance, chunks in hits]
+
+    def exact_search(self, conn, query, models=None, model=None, serial=None):
+        """[(report_id, [identifiers])] for alarm codes / part numbers in the query, best first"""
+        if not self.exact_k:
+            return []
+        identifiers = extract_identifiers(query)
+        if not identifiers:
+            return []
+        try:
+            return identifier_lookup(conn, identifiers, models=models, model=model, serial=serial, limit=self.exact_k)
+        except sqlite3.OperationalError as e:
+            print(f"Identifier lookup failed: {e}")
+            return []
+
+    def search(self, conn, query, model=None, serial=None, n_results=5, query_embedding=None, use_vector=True):
+        """
+        Returns up to n_results dicts {report_id, score, lexical_rank, vector_rank, distance,
+        chunks, identifiers, duplicates}, best first; chunks lists the matching chunk ids (chunked
+        collection, vector hits only) and is None otherwise, identifiers the alarm codes / part
+        numbers an exact hit matched, duplicates the other reports in its near-duplicate group.
+
+        Pass query_embedding when the caller already has one to skip re-embedding; use_vector=False
+        ranks on the lexical side alone (e.g. when embedding the query timed out).
+        """
+        _, _, models = self._filter_sql(model, serial)
+        rows = self._candidate_rows(conn, model, serial) if (model or serial) else None
+        candidates = [str(r[0]) for r in rows] if rows is not None else None
+        if model and not models:
+            # No catalog (or unknown input): the candidate rows already carry the matching Model
+            # values; only a filter too broad to list them falls back to the (cached) LIKE scan
+            models = sorted({r[1] for r in rows if r[1]}) if rows is not None else self.matching_models(conn, model)
+
+        exact = self.exact_search(conn, query, models, model, serial)
+        lexical = self.lexical_search(conn, query, model, serial)
+        vector = []
+        if use_vector:
+            try:
+                vector = self.vector_report_search(query, candidates, models, serial, query_embedding=query_embedding)
+            except Exception as e:
+                # A vector-store failure still leaves the lexical results usable
+                print(f"Vector search failed: {e}")
+
+        lexical_ids = [str(r[0]) for r in lexical]
+        vector_ids = [str(r[0]) for r in vector]
+        fused = reciprocal_rank_fusion([vector_ids, lexical_ids], k=self.rrf_k)
+
+        lexical_rank = {rid: i + 1 for i, rid in enumerate(lexical_ids)}
+        vector_rank = {rid: i + 1 for i, rid in enumerate(vector_ids)}
+        distances = {str(rid): d for rid, d, _ in vector}
+        chunks = {str(rid): c for rid, _, c in vector}
+
+        # Exact hits score above anything RRF can give (at most one 1 / (k + 1) per list)
+        exact_ids = {report_id: identifiers for report_id, identifiers in exact}
+        exact_base = 2.0 / (self.rrf_k + 1)
+        ranked = [(report_id, exact_base + 1.0 / (self.rrf_k + rank)) for rank, (report_id, _) in enumerate(exact, start=1)]
+        ranked += [(report_id, score) for report_id, score in fused if report_id not in exact_ids]
+
+        group_of, members = {}, {}
+        if self.duplicate_groups is not None and ranked:
+            with span("dedup"):
+                group_of = self.duplicate_groups.representatives([report_id for report_id, _ in ranked])
+                collapsed, seen_groups = [], set()
+                for report_id, score in ranked:
+                    group = group_of.get(report_id, report_id)
+                    if group not in seen_groups:
+                        seen_groups.add(group)
+                        collapsed.append((report_id, score))
+                ranked = collapsed
+                members = self.duplicate_groups.members([group_of[r] for r, _ in ranked if r in group_of])
+
+        if self.mmr_lambda < 1 and len(ranked) > n_results:
+            pool = ranked[:n_results * self.mmr_pool]
+            with span("mmr"):
+                tokens = report_tokens(conn, [report_id for report_id, _ in pool])
+
+                def similarity(a, b):
+                    if not tokens.get(a) or not tokens.get(b):
+                        return 0.0
+                    return jaccard(tokens[a], tokens[b])
+
+                pinned = sum(1 for report_id, _ in pool if report_id in exact_ids)
+                ranked = mmr_select(pool, similarity, n_results, self.mmr_lambda, pinned=pinned)
+
+        hits = []
+        for report_id, score in ranked[:n_results]:
+            group = group_of.get(report_id)
+            duplicates = [r for r in [group] + members.get(group, []) if r and r != report_id]
+            hits.append({
+                "report_id": report_id,
+                "score": score,
+                "lexical_rank": lexical_rank.get(report_id),
+                "vector_rank": vector_rank.get(report_id),
+                "distance": distances.get(report_id),
+                "chunks": chunks.get(report_id),
+                "identifiers": exact_ids.get(report_id),
+                "duplicates": duplicates or None,
+            })
+        return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the FTS5 lexical index used by hybrid retrieval")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to masterData.sqlite3")
+    args = parser.parse_args()
+    bootstrap_fts(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Inverted index of alarm codes and part numbers for exact-match retrieval.
+
+Technicians' questions are full of identifiers ("alarm 108 after the encoder swap", "is 32-0123
+the right encoder?") that embeddings tend to blur into "some spindle alarm".  This module keeps a
+ReportIdentifiers side table in masterData.sqlite3 mapping each identifier to the reports that
+mention it, plus per-model report counts in IdentifierCounts:
+
+- alarm codes are taken from report text ("alarm 108", "Alarm 102", "alarms 160/174",
+  "135 alarm"), stored as "alarm:108"
+- part numbers from ServiceReportParts.PartNumber and Haas-style numbers in the text
+  ("32-0123", "93-1000A"), stored as "part:32-0123"
+
+At query time extract_identifiers() finds the same identifiers in the user's message and
+lookup() returns the matching reports (most identifiers matched, then rarest, then newest) with
+a few indexed lookups, so HybridRetriever can put them ahead of the vector hits without waiting
+for an embedding.
+
+Build (or rebuild) the index once; the indexer keeps it in sync afterwards:
+
+    python identifier_index.py --db ../masterData.sqlite3
+    python identifier_index.py --db ../masterData.sqlite3 --lookup "alarm 108 on VF-4" --model VF-4
+"""
+
+import argparse
+import math
+import os
+import re
+import sqlite3
+import time
+
+from metrics import span
+from model_catalog import model_filter_sql
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'masterData.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ReportIdentifiers (
+    identifier TEXT NOT NULL,
+    report_id TEXT NOT NULL,
+    Model TEXT,
+    Serial TEXT,
+    Date TEXT,
+    PRIMARY KEY (identifier, report_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_reportidentifiers_model_date ON ReportIdentifiers(identifier, Model, Date);
+CREATE INDEX IF NOT EXISTS idx_reportidentifiers_report ON ReportIdentifiers(report_id);
+CREATE TABLE IF NOT EXISTS IdentifierCounts (
+    identifier TEXT NOT NULL,
+    Model TEXT NOT NULL,
+    report_count INTEGER NOT NULL,
+    PRIMARY KEY (identifier, Model)
+) WITHOUT ROWID;
+"""
+
+_NUMBER = r"(?:\d{1,2}\.\d{1,4}|\d{2,4})"
+# "alarm 108", "Alarm #102", "alarms 160/174", "alarm 135 and 151"
+_ALARM_RE = re.compile(
+    rf"\b(?:alarms?|alm)\s*(?:no\.?|number|#)?\s*({_NUMBER}(?:\s*(?:,|/|&|and|or)\s*#?{_NUMBER})*)\b", re.IGNORECASE
+)
+# "135 alarm"
+_ALARM_AFTER_RE = re.compile(rf"\b({_NUMBER})\s+alarm\b", re.IGNORECASE)
+# Haas part numbers: two digits, dash, four digits, optional revision letters ("32-0123", "93-1000A")
+_PART_RE = re.compile(r"\b(\d{2}-\d{4}[A-Z]{0,2})\b", re.IGNORECASE)
+
+# Ids per "IN (...)" statement, under SQLite's bound-parameter limit
+MAX_PARAMS = 500
+
+
+def alarm_identifier(code):
+    """'0108' -> 'alarm:108'; NGC-style dotted codes ('9.1012') are kept as written"""
+    return "alarm:" + (code if "." in code else str(int(code)))
+
+
+def part_identifier(part_number):
+    return "part:" + str(part_number).strip().upper()
+
+
+def extract_identifiers(text):
+    """Alarm and part identifiers in text, in order of first appearance"""
+    found = []
+    text = text or ""
+    for match in _ALARM_RE.finditer(text):
+        found.extend(alarm_identifier(code) for code in re.findall(_NUMBER, match.group(1)))
+    found.extend(alarm_identifier(m.group(1)) for m in _ALARM_AFTER_RE.finditer(text))
+    found.extend(part_identifier(m.group(1)) for m in _PART_RE.finditer(text))
+    return list(dict.fromkeys(found))
+
+
+def describe_identifier(identifier):
+    """'alarm:108' -> 'alarm 108', 'part:32-0123' -> 'part 32-0123'"""
+    return identifier.replace(":", " ", 1)
+
+
+def identifiers_exist(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ReportIdentifiers'").fetchone()
+    return row is not None
+
+
+def _report_rows(conn, report_ids=None):
+    """(report_id, model, serial, date, text) for the given reports (all of them with None)"""
+    sql = """
+        SELECT CAST(ServiceReport_id AS TEXT), Model, Serial, Date,
+               IFNULL(WorkRequired, '') || ' ' || IFNULL(ServicePerformed, '') || ' ' || IFNULL(VerificationTest, '')
+        FROM ServiceReports
+    """
+    if report_ids is None:
+        yield from conn.execute(sql)
+        return
+    for i in range(0, len(report_ids), MAX_PARAMS):
+        chunk = report_ids[i:i + MAX_PARAMS]
+        yield from conn.execute(sql + f" WHERE ServiceReport_id IN ({','.join('?' * len(chunk))})", chunk)
+
+
+def _index_reports(conn, report_ids=None):
+    """Insert identifiers for the given reports (all with None); returns the identifiers written"""
+    rows = []
+    for report_id, model, serial, date, text in _report_rows(conn, report_ids):
+        for identifier in extract_identifiers(text):
+            rows.append((identifier, report_id, model, serial, date))
+    conn.executemany("INSERT OR IGNORE INTO ReportIdentifiers VALUES (?, ?, ?, ?, ?)", rows)
+
+    # Parts used, joined to their report for the model/serial/date columns
+    parts_sql = """
+        SELECT 'part:' || UPPER(TRIM(p.PartNumber)), CAST(sr.ServiceReport_id AS TEXT), sr.Model, sr.Serial, sr.Date
+        FROM ServiceReportParts p JOIN ServiceReports sr ON sr.ServiceReport_id = p.ServiceReport_id
+        WHERE p.PartNumber IS NOT NULL AND TRIM(p.PartNumber) != ''
+    """
+    identifiers = {r[0] for r in rows}
+    chunks = [None] if report_ids is None else [report_ids[i:i + MAX_PARAMS] for i in range(0, len(report_ids), MAX_PARAMS)]
+    for chunk in chunks:
+        sql, params = parts_sql, []
+        if chunk is not None:
+            sql += f" AND p.ServiceReport_id IN ({','.join('?' * len(chunk))})"
+            params = chunk
+        part_rows = conn.execute(sql, params).fetchall()
+        conn.executemany("INSERT OR IGNORE INTO ReportIdentifiers VALUES (?, ?, ?, ?, ?)", part_rows)
+        identifiers.update(r[0] for r in part_rows)
+    return identifiers
+
+
+def _refresh_counts(conn, identifiers):
+    identifiers = list(identifiers)
+    for i in range(0, len(identifiers), MAX_PARAMS):
+        chunk = identifiers[i:i + MAX_PARAMS]
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(f"DELETE FROM IdentifierCounts WHERE identifier IN ({placeholders})", chunk)
+        conn.execute(f"""
+            INSERT INTO IdentifierCounts (identifier, Model, report_count)
+            SELECT identifier, IFNULL(Model, ''), COUNT(*) FROM ReportIdentifiers
+            WHERE identifier IN ({placeholders})
+            GROUP BY identifier, IFNULL(Model, '')
+        """, chunk)
+
+
+def _identifiers_of(conn, report_ids):
+    found = set()
+    for i in range(0, len(report_ids), MAX_PARAMS):
+        chunk = report_ids[i:i + MAX_PARAMS]
+        found.update(r[0] for r in conn.execute(
+            f"SELECT identifier FROM ReportIdentifiers WHERE report_id IN ({','.join('?' * len(chunk))})", chunk
+        ))
+    return found
+
+
+def _delete_reports(conn, report_ids):
+    for i in range(0, len(report_ids), MAX_PARAMS):
+        chunk = report_ids[i:i + MAX_PARAMS]
+        conn.execute(f"DELETE FROM ReportIdentifiers WHERE report_id IN ({','.join('?' * len(chunk))})", chunk)
+
+
+def upsert_identifiers(conn, report_ids):
+    """Re-extract the identifiers of new or changed reports and update their counts"""
+    report_ids = [str(r) for r in report_ids]
+    if not report_ids:
+        return
+    previous = _identifiers_of(conn, report_ids)
+    _delete_reports(conn, report_ids)
+    current = _index_reports(conn, report_ids)
+    _refresh_counts(conn, previous | current)
+    conn.commit()
+
+
+def delete_identifiers(conn, report_ids):
+    report_ids = [str(r) for r in report_ids]
+    if not report_ids:
+        return
+    previous = _identifiers_of(conn, report_ids)
+    _delete_reports(conn, report_ids)
+    _refresh_counts(conn, previous)
+    conn.commit()
+
+
+def bootstrap_identifiers(db_path=DEFAULT_DB_PATH):
+    """(Re)build the identifier index from ServiceReports and ServiceReportParts"""
+    conn = sqlite3.connect(db_path)
+    try:
+        start = time.time()
+        conn.execute("DROP TABLE IF EXISTS ReportIdentifiers")
+        conn.execute("DROP TABLE IF EXISTS IdentifierCounts")
+        conn.executescript(SCHEMA)
+        _index_reports(conn)
+        conn.execute("""
+            INSERT INTO IdentifierCounts (identifier, Model, report_count)
+            SELECT identifier, IFNULL(Model, ''), COUNT(*) FROM ReportIdentifiers GROUP BY identifier, IFNULL(Model, '')
+        """)
+        conn.commit()
+        entries, distinct = conn.execute("SELECT COUNT(*), COUNT(DISTINCT identifier) FROM ReportIdentifiers").fetchone()
+        print(f"Identifier index ready: {distinct} identifiers in {entries} report entries in {time.time() - start:.2f}s")
+        return entries
+    finally:
+        conn.close()
+
+
+def identifier_counts(conn, identifiers, models=None):
+    """{identifier: reports mentioning it} over the given exact Model values (all models with None)"""
+    if not identifiers:
+        return {}
+    sql = f"SELECT identifier, SUM(report_count) FROM IdentifierCounts WHERE identifier IN ({','.join('?' * len(identifiers))})"
+    params = list(identifiers)
+    if models:
+        sql += f" AND Model IN ({','.join('?' * len(models))})"
+        params.extend(models)
+    return dict(conn.execute(sql + " GROUP BY identifier", params).fetchall())
+
+
+def lookup(conn, identifiers, models=None, model=None, serial=None, limit=5, per_identifier=50):
+    """
+    Reports mentioning any of the identifiers, within the model/serial filter:
+    [(report_id, [matched identifiers])], reports matching more identifiers first, then those
+    matching rarer ones (by per-model count), then newest.  models are exact Model values from the
+    catalog; model is the raw input, used for a LIKE filter when the catalog doesn't know it.
+    """
+    if not identifiers or not identifiers_exist(conn):
+        return []
+    with span("identifier_lookup"):
+        clauses, params = [], []
+        if model or models:
+            clause, clause_params = model_filter_sql("Model", models, model)
+            clauses.append(clause)
+            params.extend(clause_params)
+        if serial:
+            clauses.append("Serial = ?")
+            params.append(serial)
+        where_sql = "".join(f" AND {c}" for c in clauses)
+
+        counts = identifier_counts(conn, identifiers, models)
+        matched = {}
+        for identifier in identifiers:
+            rows = conn.execute(
+                f"SELECT report_id, Date FROM ReportIdentifiers WHERE identifier = ?{where_sql} ORDER BY Date DESC LIMIT ?",
+                [identifier] + params + [per_identifier]
+            ).fetchall()
+            for report_id, date in rows:
+                entry = matched.setdefault(report_id, {"identifiers": [], "weight": 0.0, "date": date or ""})
+                entry["identifiers"].append(identifier)
+                # Rarer identifiers say more about a report (idf-style weight)
+                entry["weight"] += 1.0 / math.log(2 + counts.get(identifier, 0))
+    ranked = sorted(
+        matched.items(),
+        key=lambda item: (len(item[1]["identifiers"]), item[1]["weight"], item[1]["date"]),
+        reverse=True
+    )
+    return [(report_id, entry["identifiers"]) for report_id, entry in ranked[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the alarm-code / part-number index used for exact-match retrieval")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to masterData.sqlite3")
+    parser.add_argument("--lookup", metavar="TEXT", help="Show the reports an exact lookup returns for TEXT instead")
+    parser.add_argument("--model", default=None, help="Exact Model value to filter the lookup by")
+    args = parser.parse_args()
+    if not args.lookup:
+        bootstrap_identifiers(args.db)
+        return
+    conn = sqlite3.connect(args.db)
+    try:
+        identifiers = extract_identifiers(args.lookup)
+        models = [args.model] if args.model else None
+        print(f"Identifiers: {', '.join(identifiers) or 'none'}")
+        for identifier, count in sorted(identifier_counts(conn, identifiers, models).items()):
+            print(f"  {identifier}: {count} reports")
+        for report_id, matched in lookup(conn, identifiers, models=models, limit=10):
+            print(f"{report_id}: {', '.join(matched)}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
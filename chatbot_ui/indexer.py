@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+"""
+Incremental, change-tracked indexer for service reports.
+
+Instead of wiping the vector collection and re-embedding every report, this
+keeps a small state database next to the vector store with one row per
+indexed report (content hash + source rowid) and a watermark.  Each run only
+upserts reports that are new or whose text changed, and deletes vectors for
+reports that were removed from masterData.sqlite3.
+
+Can be run from the Flask app (see app.index_service_reports) or as a cron job:
+
+    python indexer.py                # reconcile: new, changed and removed reports
+    python indexer.py --append-only  # only rows past the rowid watermark (fast)
+    python indexer.py --workers 8 --api-base http://localhost:8001/v1  # against a stub server
+    python indexer.py --chunked      # section-level chunks into their own collection (see chunking.py)
+    python indexer.py --dedup        # one vector per group of near-duplicate reports (see near_duplicates.py)
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from chunking import CHUNK_SPEC, build_report_chunks
+from hybrid_search import delete_fts, fts_exists, upsert_fts
+from identifier_index import delete_identifiers, identifiers_exist, upsert_identifiers
+from issue_summary import refresh_summary, summary_exists
+from machine_timeline import delete_timeline, refresh_machines, timeline_exists, upsert_timeline
+from model_catalog import catalog_exists, model_family, refresh_catalog
+from near_duplicates import DEDUP_SPEC, SCHEMA as DUPLICATES_SCHEMA, DuplicateIndex, simhash
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'masterData.sqlite3')
+CHROMA_PERSIST_DIR = os.path.join(os.path.dirname(__file__), 'vectordb')
+DEFAULT_STATE_PATH = os.path.join(CHROMA_PERSIST_DIR, 'index_state.sqlite3')
+EMBEDDING_MODEL = "text-embedding-3-small"
+COLLECTION_NAME = "service_reports"
+CHUNK_COLLECTION_NAME = "service_report_chunks"
+
+REPORT_QUERY = """
+SELECT
+    rowid,
+    ServiceReport_id,
+    Model,
+    Serial,
+    WorkRequired,
+    ServicePerformed,
+    VerificationTest,
+    Date
+FROM ServiceReports
+"""
+
+
+def make_embedding_function(persist_dir=CHROMA_PERSIST_DIR, api_base=None):
+    """Cached OpenAI embedding function; api_base points it at another server (e.g. a local stub)"""
+    from embedding_cache import EmbeddingCache, CachedOpenAIEmbeddingFunction
+
+    kwargs = {"api_base": api_base} if api_base else {}
+    return CachedOpenAIEmbeddingFunction(
+        EmbeddingCache(os.path.join(persist_dir, 'embedding_cache.sqlite3')),
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model_name=EMBEDDING_MODEL,
+        **kwargs
+    )
+
+
+def open_collection(persist_dir=CHROMA_PERSIST_DIR, embedding_function=None, name=COLLECTION_NAME):
+    """Open (or create) the Chroma collection that holds service report (or chunk) vectors"""
+    import chromadb
+
+    if embedding_function is None:
+        embedding_function = make_embedding_function(persist_dir)
+    chroma_client = chromadb.PersistentClient(path=persist_dir)
+    return chroma_client.get_or_create_collection(
+        name=name,
+        embedding_function=embedding_function
+    )
+
+
+def build_report_document(row):
+    """Turn a ServiceReports row (without rowid) into (id, text, metadata) for the vector store"""
+    report_id = str(row[0])
+    model = row[1] or ""
+    serial = row[2] or ""
+    work_required = row[3] or ""
+    service_performed = row[4] or ""
+    verification = row[5] or ""
+    date = row[6] or ""
+
+    combined_text = f"Model: {model}\nIssue: {work_required}\nSolution: {service_performed}\nVerification: {verification}"
+    metadata = {
+        "model": model,
+        "serial": serial,
+        "date": date,
+        "service_report_id": report_id
+    }
+    return report_id, combined_text, metadata
+
+
+def content_hash(text, metadata):
+    """Stable hash of everything we store for a report, so edits to any field trigger a re-embed"""
+    digest = hashlib.sha256()
+    digest.update(text.encode("utf-8"))
+    for key in sorted(metadata):
+        digest.update(f"\x00{key}={metadata[key]}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class IndexState:
+    """Per-report content hashes and the rowid/date watermark, kept in a sidecar SQLite file"""
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+        CREATE TABLE IF NOT EXISTS indexed_reports (
+            report_id TEXT PRIMARY KEY,
+            source_rowid INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            indexed_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS watermark (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        """)
+        self.conn.executescript(DUPLICATES_SCHEMA)
+        self.conn.commit()
+
+    def hashes(self):
+        cursor = self.conn.execute("SELECT report_id, content_hash FROM indexed_reports")
+        return dict(cursor.fetchall())
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM indexed_reports").fetchone()[0]
+
+    def mark_indexed(self, entries):
+        """entries: iterable of (report_id, source_rowid, content_hash)"""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO indexed_reports (report_id, source_rowid, content_hash, indexed_at) VALUES (?, ?, ?, ?)",
+            [(report_id, rowid, digest, now) for report_id, rowid, digest in entries]
+        )
+        self.conn.commit()
+
+    def forget(self, report_ids):
+        self.conn.executemany("DELETE FROM indexed_reports WHERE report_id = ?", [(r,) for r in report_ids])
+        self.conn.commit()
+
+    def get_watermark(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM watermark WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_watermark(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO watermark (key, value) VALUES (?, ?)", (key, str(value)))
+        self.conn.commit()
+
+    def reset(self):
+        self.conn.execute("DELETE FROM indexed_reports")
+        self.conn.execute("DELETE FROM watermark")
+        self.conn.execute("DELETE FROM duplicates")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def read_model_update_times(state_path=DEFAULT_STATE_PATH):
+    """
+    {model family: unix time} of the last indexing run that changed reports for that family
+    ("*" for changes whose model is unknown, such as deletions).  Used to invalidate caches.
+    """
+    if not os.path.exists(state_path):
+        return {}
+    conn = sqlite3.connect(f"file:{os.path.abspath(state_path)}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT key, value FROM watermark WHERE key LIKE 'model_updated:%'").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        conn.close()
+    return {key.split(":", 1)[1]: float(value) for key, value in rows}
+
+
+def estimate_tokens(text):
+    """Rough token count used to size embedding batches (OpenAI tokenizers average ~4 chars/token)"""
+    return len(text) // 4 + 1
+
+
+class IncrementalIndexer:
+    """
+    Sync the vector collection with ServiceReports, touching only what changed.
+
+    Rows are streamed from SQLite with fetchmany, grouped into batches bounded by an estimated
+    token budget, and embedded by a bounded pool of worker threads.  At most max_in_flight batches
+    are outstanding at once; the reader blocks until one completes (backpressure).  Upserts and
+    state updates happen on the calling thread as batches finish, and the rowid checkpoint only
+    advances past batches that are fully stored, so an interrupted run resumes where it stopped.
+
+    With chunked=True each report is stored as its section chunks (chunking.py) instead of one
+    vector; a changed report's old chunks are deleted before the new ones are written.
+
+    With dedup=True near-duplicate reports are grouped (near_duplicates.py) and only each group's
+    representative is embedded and stored; members are recorded in the state without a vector.
+
+    With side_db_path the lexical, identifier, timeline, catalog and issue tables are kept in that
+    database instead (e.g. a snapshot's aux.sqlite3, see snapshots.py), and db_path is only read.
+    """
+
+    def __init__(self, collection, db_path=DEFAULT_DB_PATH, state_path=DEFAULT_STATE_PATH, batch_size=100,
+                 embedding_function=None, max_batch_tokens=100000, max_workers=4, max_in_flight=None,
+                 fetch_size=1000, progress=None, chunked=False, dedup=False, side_db_path=None):
+        self.collection = collection
+        self.db_path = db_path
+        self.state_path = state_path
+        self.batch_size = batch_size
+        self.embedding_function = embedding_function
+        self.max_batch_tokens = max_batch_tokens
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight or max_workers * 2
+        self.fetch_size = fetch_size
+        # Optional callable taking a stats dict, called as batches complete (e.g. for /readyz)
+        self.progress = progress
+        self.chunked = chunked
+        self.dedup = dedup
+        self.side_db_path = side_db_path
+
+    def _connect(self):
+        if not self.side_db_path:
+            return sqlite3.connect(self.db_path)
+        # The side tables are found in main; ServiceReports, ServiceReportParts and Machines resolve
+        # to the read-only source, so nothing can write to it
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.side_db_path)}", uri=True)
+        conn.execute("ATTACH DATABASE ? AS source", (f"file:{os.path.abspath(self.db_path)}?mode=ro",))
+        return conn
+
+    def _iter_rows(self, conn, min_rowid=None):
+        query = REPORT_QUERY
+        params = ()
+        if min_rowid is not None:
+            query += " WHERE rowid > ?"
+            params = (min_rowid,)
+        query += " ORDER BY rowid"
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(self.fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+    @staticmethod
+    def _entries(batch):
+        """(id, text, metadata) for every vector the batch stores: one per report, or its chunks"""
+        entries = []
+        for b in batch:
+            entries.extend(b["chunks"] if "chunks" in b else [(b["id"], b["text"], b["metadata"])])
+        return entries
+
+    def _embed(self, batch):
+        if self.embedding_function is None:
+            return None
+        return self.embedding_function([text for _, text, _ in self._entries(batch)])
+
+    def _delete_vectors(self, report_ids):
+        if self.chunked:
+            # Chunk ids aren't known without the old text; remove by parent report instead
+            self.collection.delete(where={"service_report_id": {"$in": list(report_ids)}})
+        else:
+            self.collection.delete(ids=list(report_ids))
+
+    @staticmethod
+    def _update_side_tables(batch, side_conns):
+        """Keep the lexical, identifier and timeline tables in step with the reports in batch"""
+        fts_conn, identifier_conn, timeline_conn = side_conns
+        if fts_conn is not None:
+            upsert_fts(fts_conn, [(b["rowid"],) + tuple(b["row"][:6]) for b in batch])
+        if identifier_conn is not None:
+            upsert_identifiers(identifier_conn, [b["id"] for b in batch])
+        if timeline_conn is not None:
+            upsert_timeline(timeline_conn, [b["id"] for b in batch])
+
+    def _store(self, state, batch, embeddings, side_conns=(None, None, None)):
+        kwargs = {}
+        if embeddings is not None:
+            kwargs["embeddings"] = embeddings
+        replaced = [b["id"] for b in batch if b.get("replaces")]
+        if self.chunked and replaced:
+            self._delete_vectors(replaced)
+        entries = self._entries(batch)
+        self.collection.upsert(
+            ids=[e[0] for e in entries],
+            documents=[e[1] for e in entries],
+            metadatas=[e[2] for e in entries],
+            **kwargs
+        )
+        self._update_side_tables(batch, side_conns)
+        state.mark_indexed((b["id"], b["rowid"], b["hash"]) for b in batch)
+
+    def run(self, append_only=False):
+        """
+        Bring the collection up to date and return a stats dict.
+
+        append_only skips the full hash comparison and deletion pass and only looks at rows past
+        the stored rowid watermark, which is the cheap path for an append-only report table.
+        """
+        start = time.time()
+        stats = {"scanned": 0, "added": 0, "updated": 0, "unchanged": 0, "skipped": 0, "deleted": 0,
+                 "embedded": 0, "failed": 0, "batches": 0}
+        if self.chunked:
+            stats["chunks"] = 0
+        if self.dedup:
+            stats["duplicates"] = 0
+        changed_models = set()
+
+        conn = self._connect()
+        state = IndexState(self.state_path)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            # A state file without vectors (e.g. the vectordb folder was wiped) can't be trusted
+            if self.collection.count() == 0 and state.count() > 0:
+                print("Vector collection is empty, resetting index state")
+                state.reset()
+
+            known = state.hashes()
+            duplicates = DuplicateIndex(state.conn) if self.dedup else None
+            # Keep the lexical index (hybrid_search.py) in step once it has been built
+            fts_conn = conn if fts_exists(conn) else None
+            # ... and the alarm-code / part-number index (identifier_index.py)
+            identifier_conn = conn if identifiers_exist(conn) else None
+            # ... and the per-machine timelines (machine_timeline.py)
+            timeline_conn = conn if timeline_exists(conn) else None
+            side_conns = (fts_conn, identifier_conn, timeline_conn)
+            min_rowid = None
+            if append_only:
+                watermark = state.get_watermark("max_rowid")
+                min_rowid = int(watermark) if watermark is not None else None
+
+            if self.progress is not None:
+                total_sql = "SELECT COUNT(*) FROM ServiceReports" + (" WHERE rowid > ?" if min_rowid is not None else "")
+                stats["total"] = conn.execute(total_sql, (min_rowid,) if min_rowid is not None else ()).fetchone()[0]
+                self.progress(dict(stats))
+
+            seen = set()
+            max_rowid = int(state.get_watermark("max_rowid", 0) or 0)
+            max_date = state.get_watermark("max_date", "") or ""
+            handled_rowid = max_rowid  # every row up to here is queued, stored or needed no work
+            failed_rowid = None
+            pending = {}
+            batch = []
+            batch_tokens = 0
+
+            def checkpoint():
+                # Everything before the oldest unfinished (or failed) batch, and before the batch still
+                # being filled, is safely stored; the row being read isn't queued yet
+                barriers = [b[0]["rowid"] for b in pending.values()]
+                if batch:
+                    barriers.append(batch[0]["rowid"])
+                if failed_rowid is not None:
+                    barriers.append(failed_rowid)
+                done_rowid = min([handled_rowid] + [b - 1 for b in barriers])
+                state.set_watermark("max_rowid", max(done_rowid, 0))
+
+            def collect(block):
+                nonlocal failed_rowid
+                if not pending:
+                    return
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED if block else ALL_COMPLETED)
+                for future in done:
+                    finished = pending.pop(future)
+                    try:
+                        self._store(state, finished, future.result(), side_conns)
+                        stats["embedded"] += len(finished)
+                        if self.chunked:
+                            stats["chunks"] += sum(len(b["chunks"]) for b in finished)
+                    except Exception as e:
+                        print(f"Error indexing batch starting at rowid {finished[0]['rowid']}: {e}")
+                        stats["failed"] += len(finished)
+                        first = finished[0]["rowid"]
+                        failed_rowid = first if failed_rowid is None else min(failed_rowid, first)
+                checkpoint()
+                elapsed = max(time.time() - start, 1e-6)
+                print(f"Indexed {stats['embedded']} new or changed reports ({stats['scanned'] / elapsed:.0f} rows/sec scanned)")
+                if self.progress is not None:
+                    self.progress(dict(stats, rows_per_sec=round(stats["scanned"] / elapsed, 1)))
+
+            def submit(items):
+                stats["batches"] += 1
+                pending[executor.submit(self._embed, items)] = items
+                # Backpressure: don't read further ahead than max_in_flight batches
+                while len(pending) >= self.max_in_flight:
+                    collect(block=True)
+
+            hash_extra = {}
+            if self.chunked:
+                hash_extra["chunking"] = CHUNK_SPEC
+            if self.dedup:
+                hash_extra["dedup"] = DEDUP_SPEC
+            orphans = []
+
+            def consider(row, report_id, text, metadata, orphaned=False):
+                """Queue a report for embedding if it changed; orphaned ones lost their group and are regrouped"""
+                nonlocal batch, batch_tokens
+                rowid = row[0]
+                digest = content_hash(text, dict(metadata, **hash_extra))
+                previous = known.get(report_id)
+                if not orphaned:
+                    if previous == digest:
+                        stats["unchanged"] += 1
+                        return
+                    stats["updated" if previous else "added"] += 1
+                changed_models.add(metadata["model"])
+                item = {"id": report_id, "rowid": rowid, "row": row[1:], "text": text, "metadata": metadata, "hash": digest}
+
+                if duplicates is not None:
+                    # A report indexed before deduplication was turned on still has its own vector
+                    had_vector = previous is not None and not orphaned and duplicates.representative_of(report_id) in (None, report_id)
+                    if not orphaned:
+                        orphans.extend(duplicates.remove(report_id))
+                    fingerprint = simhash(row[4], row[5])
+                    if duplicates.assign(report_id, metadata["model"], fingerprint) != report_id:
+                        stats["duplicates"] += 1
+                        if had_vector:
+                            self._delete_vectors([report_id])
+                        # No vector, but its text is still searchable and part of its machine's history
+                        self._update_side_tables([item], side_conns)
+                        state.mark_indexed([(report_id, rowid, digest)])
+                        return
+
+                if self.chunked:
+                    item["chunks"] = build_report_chunks(report_id, row[4:7], metadata)
+                    item["replaces"] = previous is not None
+                    tokens = sum(estimate_tokens(c[1]) for c in item["chunks"])
+                else:
+                    tokens = estimate_tokens(text)
+                if batch and (batch_tokens + tokens > self.max_batch_tokens or len(batch) >= self.batch_size):
+                    submit(batch)
+                    batch = []
+                    batch_tokens = 0
+                batch.append(item)
+                batch_tokens += tokens
+
+            for row in self._iter_rows(conn, min_rowid):
+                stats["scanned"] += 1
+                rowid = row[0]
+                report_id, text, metadata = build_report_document(row[1:])
+                seen.add(report_id)
+                max_rowid = max(max_rowid, rowid)
+                if metadata["date"] and metadata["date"] > max_date:
+                    max_date = metadata["date"]
+
+                # Skip if text is too short
+                if len(text) < 10:
+                    stats["skipped"] += 1
+                else:
+                    consider(row, report_id, text, metadata)
+                handled_rowid = rowid
+
+            if batch:
+                submit(batch)
+                batch, batch_tokens = [], 0
+            collect(block=False)
+
+            if not append_only and not stats["failed"]:
+                removed = [report_id for report_id in known if report_id not in seen]
+                for i in range(0, len(removed), self.batch_size):
+                    chunk = removed[i:i + self.batch_size]
+                    self._delete_vectors(chunk)
+                    if fts_conn is not None:
+                        delete_fts(fts_conn, chunk)
+                    if identifier_conn is not None:
+                        delete_identifiers(identifier_conn, chunk)
+                    if timeline_conn is not None:
+                        delete_timeline(timeline_conn, chunk)
+                    if duplicates is not None:
+                        for report_id in chunk:
+                            orphans.extend(duplicates.remove(report_id))
+                    state.forget(chunk)
+                stats["deleted"] = len(removed)
+
+            # Members of changed or deleted representatives are regrouped; the first becomes the new
+            # representative and is embedded
+            orphans = [o for o in dict.fromkeys(orphans) if duplicates is not None and duplicates.representative_of(o) is None]
+            if orphans:
+                print(f"Regrouping {len(orphans)} reports whose representative changed")
+                for i in range(0, len(orphans), 500):
+                    chunk = orphans[i:i + 500]
+                    rows = conn.execute(
+                        REPORT_QUERY + f" WHERE ServiceReport_id IN ({','.join('?' * len(chunk))}) ORDER BY rowid", chunk
+                    ).fetchall()
+                    for row in rows:
+                        report_id, text, metadata = build_report_document(row[1:])
+                        consider(row, report_id, text, metadata, orphaned=True)
+                if batch:
+                    submit(batch)
+                collect(block=False)
+                state.conn.commit()
+                stats["regrouped"] = len(orphans)
+
+            # Let caches keyed by model (e.g. the /chat answer cache) know what changed
+            now = time.time()
+            for family in {model_family(m) for m in changed_models}:
+                state.set_watermark(f"model_updated:{family}", now)
+            if stats["deleted"]:
+                state.set_watermark("model_updated:*", now)
+            stats["changed_models"] = sorted(changed_models)
+
+            # Keep the model catalog in step with newly seen models once it has been bootstrapped
+            if catalog_exists(conn):
+                stats["new_models"] = refresh_catalog(conn)
+            # Likewise fold new reports into the common-issue clusters
+            if summary_exists(conn):
+                refresh_summary(conn)
+            # ... and give machines added without reports a timeline entry
+            if timeline_conn is not None:
+                refresh_machines(conn)
+
+            if duplicates is not None:
+                state.conn.commit()
+                stats["groups"] = duplicates.group_count()
+
+            if not stats["failed"]:
+                state.set_watermark("max_rowid", max_rowid)
+            state.set_watermark("max_date", max_date)
+            state.set_watermark("last_run", time.time())
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            state.close()
+            conn.close()
+
+        stats["seconds"] = round(time.time() - start, 2)
+        stats["rows_per_sec"] = round(stats["scanned"] / max(time.time() - start, 1e-6), 1)
+        print(
+            f"Finished indexing: {stats['added']} added, {stats['updated']} updated, "
+            f"{stats['deleted']} deleted, {stats['unchanged']} unchanged, {stats['failed']} failed "
+            f"in {stats['seconds']}s ({stats['rows_per_sec']} rows/sec)"
+        )
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally index service reports into the vector database")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to masterData.sqlite3")
+    parser.add_argument("--persist-dir", default=CHROMA_PERSIST_DIR, help="Chroma persistence directory")
+    parser.add_argument("--state", default=None, help="Path to the index state database (defaults to <persist-dir>/index_state.sqlite3)")
+    parser.add_argument("--append-only", action="store_true", help="Only index rows past the rowid watermark")
+    parser.add_argument("--batch-size", type=int, default=100, help="Maximum reports per embedding request")
+    parser.add_argument("--max-batch-tokens", type=int, default=100000, help="Estimated token budget per embedding request")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent embedding requests")
+    parser.add_argument("--backend", default=os.getenv("VECTOR_BACKEND", "chroma"), choices=["chroma", "mmap"],
+                        help="Vector store to index into")
+    parser.add_argument("--api-base", default=os.getenv("OPENAI_BASE_URL"), help="Embeddings API base URL (e.g. a local stub server)")
+    parser.add_argument("--chunked", action="store_true", default=os.getenv("CHUNKED_RETRIEVAL") == "1",
+                        help="Index section-level chunks (what the app uses with CHUNKED_RETRIEVAL=1)")
+    parser.add_argument("--dedup", action="store_true", default=os.getenv("DEDUP_REPORTS") == "1",
+                        help="Store one vector per group of near-duplicate reports (what the app uses with DEDUP_REPORTS=1)")
+    args = parser.parse_args()
+
+    state_path = args.state or os.path.join(args.persist_dir, 'index_state_chunks.sqlite3' if args.chunked else 'index_state.sqlite3')
+    embedding_function = make_embedding_function(args.persist_dir, api_base=args.api_base)
+    if args.backend == "mmap":
+        from vector_store import MmapVectorStore
+        store_dir = os.path.join(args.persist_dir, 'mmap_chunk_store' if args.chunked else 'mmap_store')
+        collection = MmapVectorStore(store_dir, embedding_function=embedding_function)
+    else:
+        collection = open_collection(args.persist_dir, embedding_function,
+                                     name=CHUNK_COLLECTION_NAME if args.chunked else COLLECTION_NAME)
+    indexer = IncrementalIndexer(
+        collection, args.db, state_path,
+        batch_size=args.batch_size,
+        embedding_function=embedding_function,
+        max_batch_tokens=args.max_batch_tokens,
+        max_workers=args.workers,
+        chunked=args.chunked,
+        dedup=args.dedup
+    )
+    indexer.run(append_only=args.append_only)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Materialized per-model-family common-issue summary.
+
+get_common_issues() used to GROUP BY the full WorkRequired/ServicePerformed text for every request:
+a full scan plus a large sort, and exact-text grouping treated "Spindle won't orient visit 2" and
+"Spindle won't orient visit 3" as different issues.  This module keeps an IssueClusters side table
+in masterData.sqlite3 instead: reports are grouped into clusters of near-duplicate issue/solution
+text, each with a count, last-seen date and a few representative report ids, indexed by
+(Family, report_count) so reading the top issues is a single index lookup.  Clusters are per model
+family (VF-4 and VF-4SS share theirs, see model_catalog.model_family).
+
+A report is compared with the tokens most of a cluster's reports share, by a Jaccard weighted with
+squared inverse document frequency: boilerplate that recurs across unrelated reports ("machine in
+production", "second visit", "diagnosed", "replaced") counts for little and the words naming the
+symptom and the fix decide.
+Part numbers are left out: which parts a fix used varies from visit to visit, and they are in
+ServiceReportParts anyway.  Document frequencies are kept in IssueTokenCounts and grow with the
+reports folded in.
+
+New reports are folded in incrementally past a rowid watermark (the indexer does this after each
+run once the table exists); --rebuild reclusters everything, e.g. after reports were edited or
+deleted.
+
+    python issue_summary.py --db ../masterData.sqlite3 [--rebuild]
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+import time
+
+from model_catalog import model_family
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'masterData.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS IssueClusters (
+    cluster_id INTEGER PRIMARY KEY,
+    Family TEXT NOT NULL,
+    token_counts TEXT NOT NULL,
+    issue TEXT,
+    solution TEXT,
+    report_count INTEGER NOT NULL,
+    last_seen TEXT,
+    representative_ids TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_issueclusters_family_count ON IssueClusters(Family, report_count DESC);
+CREATE TABLE IF NOT EXISTS IssueTokenCounts (token TEXT PRIMARY KEY, reports INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS IssueSummaryState (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# Weighted Jaccard a report needs with a cluster's shared tokens to join it.  Calibrated on the
+# synthetic benchmark data (benchmarks/synthetic_db.py), where it collapses the reports to within
+# about 10% of the seeded symptom/fix combinations per family with ~5% of them misplaced
+SIMILARITY_THRESHOLD = 0.5
+MAX_REPRESENTATIVES = 5
+# Candidate clusters are those sharing one of the report's rarest tokens
+CANDIDATE_TOKENS = 4
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it", "of", "on",
+    "or", "the", "to", "was", "were", "with", "visit", "customer", "machine",
+}
+
+
+def issue_tokens(work_required, service_performed):
+    """
+    Normalized token set for clustering.  Short numbers (visit counts, quantities) are dropped
+    while longer ones are kept, since alarm codes and part numbers tell issues apart.
+    """
+    tokens = set()
+    for token in re.findall(r"[a-z0-9][a-z0-9\-]*", f"{work_required or ''} {service_performed or ''}".lower()):
+        if token in _STOPWORDS:
+            continue
+        if token.isdigit() and len(token) < 3:
+            continue
+        if len(token) < 2:
+            continue
+        tokens.add(token)
+    return tokens
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+_PART_NUMBER_RE = re.compile(r"^\d{2,}-\d{3,}[a-z]?$")
+
+
+def cluster_tokens(work_required, service_performed):
+    """issue_tokens() without part numbers (32-0123, 93-1000A)"""
+    return {t for t in issue_tokens(work_required, service_performed) if not _PART_NUMBER_RE.match(t)}
+
+
+class TokenWeights:
+    """Inverse document frequency of clustering tokens over the reports folded in so far"""
+
+    def __init__(self, counts=None, reports=0):
+        self.counts = dict(counts or {})
+        self.reports = reports
+
+    def add(self, tokens):
+        self.reports += 1
+        for token in tokens:
+            self.counts[token] = self.counts.get(token, 0) + 1
+
+    def weight(self, token):
+        return math.log((self.reports + 1) / (self.counts.get(token, 0) + 1)) ** 2 + 0.05
+
+    def similarity(self, a, b):
+        union = sum(self.weight(t) for t in a | b)
+        return sum(self.weight(t) for t in a & b) / union if union else 1.0
+
+
+def summary_exists(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'IssueClusters'").fetchone()
+    return row is not None
+
+
+class _ModelClusters:
+    """In-memory clusters for one model family with a token -> cluster inverted index for candidate lookup"""
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.clusters = {}
+        self.by_token = {}
+
+    def add(self, cluster):
+        self.clusters[cluster["cluster_id"]] = cluster
+        for token in cluster["token_counts"]:
+            self.by_token.setdefault(token, set()).add(cluster["cluster_id"])
+
+    @staticmethod
+    def tokens(cluster):
+        """The tokens most of the cluster's reports share, so one report's notes don't define it"""
+        return {t for t, n in cluster["token_counts"].items() if n * 2 > cluster["report_count"]}
+
+    def join(self, cluster, tokens):
+        for token in tokens:
+            if token not in cluster["token_counts"]:
+                self.by_token.setdefault(token, set()).add(cluster["cluster_id"])
+            cluster["token_counts"][token] = cluster["token_counts"].get(token, 0) + 1
+        cluster["report_count"] += 1
+
+    def best_match(self, tokens):
+        candidates = set()
+        for token in sorted(tokens, key=lambda t: (-self.weights.weight(t), t))[:CANDIDATE_TOKENS]:
+            candidates.update(self.by_token.get(token, ()))
+        best, best_score = None, 0.0
+        for cluster_id in sorted(candidates):
+            score = self.weights.similarity(tokens, self.tokens(self.clusters[cluster_id]))
+            if score > best_score:
+                best, best_score = self.clusters[cluster_id], score
+        if best is not None and best_score >= SIMILARITY_THRESHOLD:
+            return best
+        return None
+
+
+def _load_clusters(conn, families, weights):
+    loaded = {}
+    for family in families:
+        family_clusters = _ModelClusters(weights)
+        for row in conn.execute(
+            "SELECT cluster_id, token_counts, issue, solution, report_count, last_seen, representative_ids "
+            "FROM IssueClusters WHERE Family = ?", (family,)
+        ):
+            family_clusters.add({
+                "cluster_id": row[0], "token_counts": json.loads(row[1]), "issue": row[2], "solution": row[3],
+                "report_count": row[4], "last_seen": row[5] or "", "representative_ids": json.loads(row[6]),
+                "family": family, "dirty": False,
+            })
+        loaded[family] = family_clusters
+    return loaded
+
+
+def _ensure_schema(conn):
+    """Create the tables; ones from before per-family weighted clustering are dropped (and rebuilt)"""
+    columns = {r[1] for r in conn.execute("PRAGMA table_info(IssueClusters)")}
+    if columns and "Family" not in columns:
+        conn.execute("DROP TABLE IssueClusters")
+        conn.execute("DROP TABLE IF EXISTS IssueSummaryState")
+    conn.executescript(SCHEMA)
+
+
+def _load_weights(conn):
+    row = conn.execute("SELECT value FROM IssueSummaryState WHERE key = 'reports'").fetchone()
+    return TokenWeights(conn.execute("SELECT token, reports FROM IssueTokenCounts"), int(row[0]) if row else 0)
+
+
+def refresh_summary(conn, rebuild=False, fetch_size=5000):
+    """Fold reports past the watermark (or all reports with rebuild) into the clusters"""
+    start = time.time()
+    _ensure_schema(conn)
+    if rebuild:
+        conn.execute("DELETE FROM IssueClusters")
+        conn.execute("DELETE FROM IssueTokenCounts")
+        conn.execute("DELETE FROM IssueSummaryState")
+    row = conn.execute("SELECT value FROM IssueSummaryState WHERE key = 'max_rowid'").fetchone()
+    watermark = int(row[0]) if row else 0
+    new_reports_sql = """
+        SELECT rowid, ServiceReport_id, Model, WorkRequired, ServicePerformed, Date
+        FROM ServiceReports
+        WHERE rowid > ? AND Model IS NOT NULL
+        ORDER BY rowid
+    """
+
+    # First pass: document frequencies including the new reports, so the first of them is
+    # clustered with the same weights as the last
+    weights = _load_weights(conn)
+    before = dict(weights.counts)
+    cursor = conn.execute(new_reports_sql, (watermark,))
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        for row in rows:
+            if row[3] or row[4]:
+                weights.add(cluster_tokens(row[3], row[4]))
+    conn.executemany(
+        "INSERT OR REPLACE INTO IssueTokenCounts (token, reports) VALUES (?, ?)",
+        [(t, n) for t, n in weights.counts.items() if before.get(t) != n]
+    )
+    conn.execute("INSERT OR REPLACE INTO IssueSummaryState (key, value) VALUES ('reports', ?)", (str(weights.reports),))
+
+    cursor = conn.execute(new_reports_sql, (watermark,))
+    clusters_by_family = {}
+    next_id = (conn.execute("SELECT MAX(cluster_id) FROM IssueClusters").fetchone()[0] or 0) + 1
+    processed = 0
+    max_rowid = watermark
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        new_families = {model_family(r[2]) for r in rows} - set(clusters_by_family)
+        clusters_by_family.update(_load_clusters(conn, new_families, weights))
+        for rowid, report_id, model, work_required, service_performed, date in rows:
+            max_rowid = max(max_rowid, rowid)
+            if not (work_required or service_performed):
+                continue
+            tokens = cluster_tokens(work_required, service_performed)
+            if not tokens:
+                continue
+            processed += 1
+            family = model_family(model)
+            family_clusters = clusters_by_family[family]
+            cluster = family_clusters.best_match(tokens)
+            if cluster is None:
+                cluster = {
+                    "cluster_id": next_id, "token_counts": {}, "issue": work_required or "",
+                    "solution": service_performed or "", "report_count": 0, "last_seen": "",
+                    "representative_ids": [], "family": family,
+                }
+                next_id += 1
+                family_clusters.add(cluster)
+            family_clusters.join(cluster, tokens)
+            cluster["dirty"] = True
+            date = date or ""
+            if date >= cluster["last_seen"]:
+                cluster["last_seen"] = date
+                # Keep the most recent reports as representatives, newest first
+                cluster["representative_ids"] = ([str(report_id)] + cluster["representative_ids"])[:MAX_REPRESENTATIVES]
+            elif len(cluster["representative_ids"]) < MAX_REPRESENTATIVES:
+                cluster["representative_ids"].append(str(report_id))
+
+    dirty = [c for family_clusters in clusters_by_family.values() for c in family_clusters.clusters.values() if c.get("dirty")]
+    conn.executemany(
+        "INSERT OR REPLACE INTO IssueClusters "
+        "(cluster_id, Family, token_counts, issue, solution, report_count, last_seen, representative_ids) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(c["cluster_id"], c["family"], json.dumps(c["token_counts"], sort_keys=True), c["issue"], c["solution"],
+          c["report_count"], c["last_seen"], json.dumps(c["representative_ids"])) for c in dirty]
+    )
+    conn.execute("INSERT OR REPLACE INTO IssueSummaryState (key, value) VALUES ('max_rowid', ?)", (str(max_rowid),))
+    conn.commit()
+    print(f"Issue summary refreshed: {processed} reports into {len(dirty)} clusters in {time.time() - start:.2f}s")
+    return processed
+
+
+def top_issues(conn, models, limit=3):
+    """
+    Most frequent issue clusters of the families of the given exact Model values:
+    [(issue, solution, report_count, last_seen, representative_ids)]
+    """
+    families = sorted({model_family(m) for m in models or ()})
+    if not families:
+        return []
+    placeholders = ",".join("?" * len(families))
+    rows = conn.execute(f"""
+        SELECT issue, solution, report_count, last_seen, representative_ids
+        FROM IssueClusters
+        WHERE Family IN ({placeholders})
+        ORDER BY report_count DESC
+        LIMIT ?
+    """, families + [limit]).fetchall()
+    return [(r[0], r[1], r[2], r[3], json.loads(r[4])) for r in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the per-model common issue summary")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to masterData.sqlite3")
+    parser.add_argument("--rebuild", action="store_true", help="Recluster every report from scratch")
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db)
+    try:
+        refresh_summary(conn, rebuild=args.rebuild)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
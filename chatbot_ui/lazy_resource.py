@@ -0,0 +1,61 @@
+"""
+Lazily built, thread-safe shared resources.
+
+Creating the OpenAI client, the embedding function and the vector store at import time made
+startup (and every `import app`, e.g. from the ASGI entry point or a script) pay for all of them,
+including opening Chroma's persistent client.  LazyResource builds its object on first use,
+exactly once even when several request threads get there together, and otherwise stands in for
+it: attribute access and calls are forwarded, so call sites don't change.
+"""
+
+import threading
+import time
+
+
+class LazyResource:
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._instance = None
+        self._initialized = False
+        self.init_error = None
+        self.init_seconds = None
+
+    def instance(self):
+        if self._initialized:
+            return self._instance
+        with self._lock:
+            if not self._initialized:
+                start = time.time()
+                try:
+                    self._instance = self._factory()
+                except Exception as e:
+                    # Leave it uninitialized so the next use retries
+                    self.init_error = str(e)
+                    raise
+                self.init_seconds = round(time.time() - start, 3)
+                self.init_error = None
+                self._initialized = True
+                print(f"Initialized {self._name} in {self.init_seconds:.2f}s")
+        return self._instance
+
+    def replace(self, instance):
+        """Swap in another object (e.g. a newly activated index snapshot); returns the old one.
+        Callers that already hold the old object keep using it."""
+        with self._lock:
+            old = self._instance
+            self._instance = instance
+            self.init_error = None
+            self._initialized = True
+        return old
+
+    @property
+    def is_initialized(self):
+        return self._initialized
+
+    def __getattr__(self, attr):
+        return getattr(self.instance(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self.instance()(*args, **kwargs)
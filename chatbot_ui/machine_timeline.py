@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Per-machine service timelines for the history part of the context.
+
+get_machine_history() used to run SELECT DISTINCT over Machines LEFT JOIN ServiceReports ORDER BY
+Date DESC LIMIT 10 for every request: with only a model filter that joined and sorted every
+report of every machine of the model to keep ten rows, Date was sorted as text (so "12/01/2019"
+sorted before "2/01/2020"), and the ten rows could come from other machines than the one whose
+details were shown.  This module keeps two side tables in masterData.sqlite3 instead:
+
+- MachineTimeline: one row per report, keyed (Serial, SortDate, ServiceReport_id) WITHOUT ROWID
+  with a normalized YYYY-MM-DD SortDate, the text the context shows and the first parts used, so
+  a machine's latest N reports (or the page before a cursor) are one index range read
+- MachineSummary: one row per machine with its install date, last service date and report
+  count, indexed by (Model, LastServiceDate) to find a model's most recently serviced machine
+
+The indexer keeps both in sync once they exist (upsert_timeline / delete_timeline per report,
+refresh_machines for new machines).  Build them once:
+
+    python machine_timeline.py --db ../masterData.sqlite3
+    python machine_timeline.py --db ../masterData.sqlite3 --serial 1000007 --limit 5
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+
+from report_store import MAX_PARAMS, fetch_parts
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'masterData.sqlite3')
+
+# The history context shows this much of each text field; the full report is one lookup away by id
+TEXT_CHARS = 200
+PARTS_PER_REPORT = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS MachineTimeline (
+    Serial TEXT NOT NULL,
+    SortDate TEXT NOT NULL,
+    ServiceReport_id TEXT NOT NULL,
+    Model TEXT,
+    Date TEXT,
+    WorkRequired TEXT,
+    ServicePerformed TEXT,
+    VerificationTest TEXT,
+    Failure_Type TEXT,
+    ServiceType TEXT,
+    parts TEXT NOT NULL,
+    PRIMARY KEY (Serial, SortDate, ServiceReport_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_machinetimeline_report ON MachineTimeline(ServiceReport_id);
+CREATE TABLE IF NOT EXISTS MachineSummary (
+    Serial TEXT PRIMARY KEY,
+    Model TEXT,
+    Install_Date TEXT,
+    InstallSortDate TEXT NOT NULL,
+    LastServiceDate TEXT NOT NULL,
+    report_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_machinesummary_model_last ON MachineSummary(Model, LastServiceDate);
+"""
+
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+_DATE_FORMATS = ("%m/%d/%Y", "%m/%d/%y", "%Y/%m/%d", "%m-%d-%Y", "%d-%b-%Y", "%b %d, %Y", "%B %d, %Y", "%Y%m%d")
+
+
+def normalize_date(value):
+    """'2017-06-07 14:30', '6/7/2017', 'Jun 7, 2017' -> '2017-06-07'; '' (sorts oldest) if it isn't a date"""
+    text = str(value or "").strip()
+    if _ISO_DATE_RE.match(text):
+        return text[:10]
+    for candidate in dict.fromkeys((text, text.split(" ")[0], text.split("T")[0])):
+        for date_format in _DATE_FORMATS:
+            try:
+                return datetime.strptime(candidate, date_format).date().isoformat()
+            except ValueError:
+                continue
+    return ""
+
+
+def timeline_exists(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'MachineTimeline'").fetchone()
+    return row is not None
+
+
+_REPORT_SQL = """
+    SELECT CAST(ServiceReport_id AS TEXT), Serial, Model, Date,
+           substr(WorkRequired, 1, ?), substr(ServicePerformed, 1, ?), substr(VerificationTest, 1, ?),
+           Failure_Type, ServiceType
+    FROM ServiceReports
+    WHERE Serial IS NOT NULL
+"""
+
+
+def _insert_reports(conn, rows):
+    """Timeline rows for ServiceReports rows selected with _REPORT_SQL; returns their serials"""
+    parts = fetch_parts(conn, [r[0] for r in rows], limit_per_report=PARTS_PER_REPORT)
+    conn.executemany(
+        "INSERT OR REPLACE INTO MachineTimeline (Serial, SortDate, ServiceReport_id, Model, Date, WorkRequired, "
+        "ServicePerformed, VerificationTest, Failure_Type, ServiceType, parts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(r[1], normalize_date(r[3]), r[0], r[2], r[3]) + tuple(r[4:]) + (json.dumps(parts.get(r[0], [])),) for r in rows]
+    )
+    return {r[1] for r in rows}
+
+
+def _serials_of(conn, report_ids):
+    serials = set()
+    for i in range(0, len(report_ids), MAX_PARAMS):
+        chunk = report_ids[i:i + MAX_PARAMS]
+        serials.update(r[0] for r in conn.execute(
+            f"SELECT Serial FROM MachineTimeline WHERE ServiceReport_id IN ({','.join('?' * len(chunk))})", chunk
+        ))
+    return serials
+
+
+def _delete_reports(conn, report_ids):
+    for i in range(0, len(report_ids), MAX_PARAMS):
+        chunk = report_ids[i:i + MAX_PARAMS]
+        conn.execute(f"DELETE FROM MachineTimeline WHERE ServiceReport_id IN ({','.join('?' * len(chunk))})", chunk)
+
+
+_SUMMARY_SQL = """
+    SELECT m.Serial, m.Model, m.Install_Date,
+           IFNULL((SELECT MAX(t.SortDate) FROM MachineTimeline t WHERE t.Serial = m.Serial), ''),
+           (SELECT COUNT(*) FROM MachineTimeline t WHERE t.Serial = m.Serial)
+    FROM Machines m
+"""
+
+
+def _write_summaries(conn, rows):
+    conn.executemany(
+        "INSERT OR REPLACE INTO MachineSummary (Serial, Model, Install_Date, InstallSortDate, LastServiceDate, report_count) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(serial, model, installed, normalize_date(installed), last, count) for serial, model, installed, last, count in rows]
+    )
+
+
+def _refresh_summaries(conn, serials):
+    """Recompute MachineSummary for the given machines (each is an index range over its timeline)"""
+    serials = [s for s in serials if s is not None]
+    for i in range(0, len(serials), MAX_PARAMS):
+        chunk = serials[i:i + MAX_PARAMS]
+        _write_summaries(conn, conn.execute(_SUMMARY_SQL + f" WHERE m.Serial IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+
+
+def upsert_timeline(conn, report_ids):
+    """Re-read new or changed reports into their machines' timelines (a report may have moved machine)"""
+    report_ids = [str(r) for r in report_ids]
+    if not report_ids:
+        return
+    serials = _serials_of(conn, report_ids)
+    _delete_reports(conn, report_ids)
+    for i in range(0, len(report_ids), MAX_PARAMS):
+        chunk = report_ids[i:i + MAX_PARAMS]
+        rows = conn.execute(
+            _REPORT_SQL + f" AND ServiceReport_id IN ({','.join('?' * len(chunk))})",
+            [TEXT_CHARS] * 3 + chunk
+        ).fetchall()
+        serials |= _insert_reports(conn, rows)
+    _refresh_summaries(conn, serials)
+    conn.commit()
+
+
+def delete_timeline(conn, report_ids):
+    report_ids = [str(r) for r in report_ids]
+    if not report_ids:
+        return
+    serials = _serials_of(conn, report_ids)
+    _delete_reports(conn, report_ids)
+    _refresh_summaries(conn, serials)
+    conn.commit()
+
+
+def refresh_machines(conn):
+    """Add machines that have no summary yet; returns how many"""
+    new = [r[0] for r in conn.execute(
+        "SELECT Serial FROM Machines WHERE Serial NOT IN (SELECT Serial FROM MachineSummary)"
+    )]
+    _refresh_summaries(conn, new)
+    conn.commit()
+    return len(new)
+
+
+def bootstrap_timeline(db_path=DEFAULT_DB_PATH, fetch_size=5000):
+    """(Re)build the timelines and machine summaries from ServiceReports, ServiceReportParts and Machines"""
+    conn = sqlite3.connect(db_path)
+    try:
+        start = time.time()
+        conn.execute("DROP TABLE IF EXISTS MachineTimeline")
+        conn.execute("DROP TABLE IF EXISTS MachineSummary")
+        conn.executescript(SCHEMA)
+        cursor = conn.cursor()
+        cursor.execute(_REPORT_SQL, [TEXT_CHARS] * 3)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            _insert_reports(conn, rows)
+        _write_summaries(conn, conn.execute(_SUMMARY_SQL).fetchall())
+        conn.commit()
+        reports, machines = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM MachineTimeline), (SELECT COUNT(*) FROM MachineSummary)"
+        ).fetchone()
+        print(f"Machine timelines ready: {reports} reports for {machines} machines in {time.time() - start:.2f}s")
+        return reports
+    finally:
+        conn.close()
+
+
+def find_machine(conn, serial=None, model_clause=None, model_params=()):
+    """
+    (Serial, Model, Install_Date) of the machine with the given serial, or with only a model
+    filter (a model_filter_sql fragment on Model) the model's most recently serviced machine
+    """
+    sql = "SELECT Serial, Model, Install_Date FROM MachineSummary WHERE 1=1"
+    params = []
+    if serial:
+        sql += " AND Serial = ?"
+        params.append(serial)
+    if model_clause:
+        sql += f" AND {model_clause}"
+        params.extend(model_params)
+    return conn.execute(sql + " ORDER BY LastServiceDate DESC LIMIT 1", params).fetchone()
+
+
+def machine_timeline(conn, serial, limit=10, before=None):
+    """
+    A machine's reports, newest first: [(ServiceReport_id, Date, WorkRequired, ServicePerformed,
+    VerificationTest, Failure_Type, ServiceType, [(PartNumber, Description)], cursor)].  Pass the
+    last row's cursor as before to get the next (older) page.
+    """
+    sql = ("SELECT ServiceReport_id, Date, WorkRequired, ServicePerformed, VerificationTest, Failure_Type, "
+           "ServiceType, parts, SortDate FROM MachineTimeline WHERE Serial = ?")
+    params = [serial]
+    if before:
+        sort_date, _, report_id = before.partition("|")
+        sql += " AND (SortDate, ServiceReport_id) < (?, ?)"
+        params += [sort_date, report_id]
+    rows = conn.execute(sql + " ORDER BY SortDate DESC, ServiceReport_id DESC LIMIT ?", params + [limit]).fetchall()
+    return [r[:7] + ([tuple(p) for p in json.loads(r[7])], f"{r[8]}|{r[0]}") for r in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the per-machine service timelines used for machine history")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to masterData.sqlite3")
+    parser.add_argument("--serial", help="Show a machine's timeline instead")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--before", help="Cursor from a previous page")
+    args = parser.parse_args()
+    if not args.serial:
+        bootstrap_timeline(args.db)
+        return
+    conn = sqlite3.connect(args.db)
+    try:
+        print(find_machine(conn, serial=args.serial))
+        for row in machine_timeline(conn, args.serial, limit=args.limit, before=args.before):
+            print(f"{row[0]} {row[1]}: {(row[2] or '')[:80]}  [cursor {row[8]}]")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
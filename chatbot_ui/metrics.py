@@ -0,0 +1,274 @@
+"""
+Request instrumentation: per-stage timing spans, LLM token counts and a slow-request log, exported
+in the Prometheus text format by the app's /metrics route.
+
+    with request_trace("/chat", model=model):
+        with span("query_embedding"):
+            ...
+        record_usage(response.usage)
+
+Every span is observed in the haas_chat_stage_seconds histogram and, when a request trace is
+active, appended to it.  The trace lives in a context variable, so spans recorded on worker
+threads started with asyncio.to_thread (which copies the context) land in the right request.
+Requests slower than SLOW_REQUEST_SECONDS are logged as one JSON line with their spans and token
+counts (to stdout and, if SLOW_REQUEST_LOG is set, appended to that file).
+
+Counters are per process; with several workers scrape each one or aggregate in Prometheus.
+Values computed elsewhere (cache hit rates, indexing throughput) are exported by collectors
+registered with REGISTRY.add_collector and evaluated at scrape time.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "5"))
+SLOW_REQUEST_LOG = os.getenv("SLOW_REQUEST_LOG") or None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        """{label values: value}"""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        """{label values: (count, sum)}, e.g. to diff before and after a benchmark run"""
+        with self._lock:
+            return {key: (series[-1], series[-2]) for key, series in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = list(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(float(bound)))])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(round(series[-2], 6))}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """
+        collect() returns [(name, type, help, [(labels dict, value), ...]), ...] evaluated at
+        scrape time, for values that already live elsewhere (cache stats, indexing progress)
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, metric_type, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "haas_chat_stage_seconds", "Time spent in each stage of answering a chat request", ["stage"]
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "haas_chat_request_seconds", "End-to-end chat request latency", ["endpoint", "outcome"]
+)
+LLM_TOKENS = REGISTRY.histogram(
+    "haas_llm_tokens", "Tokens per chat completion as reported by the API", ["kind"], buckets=TOKEN_BUCKETS
+)
+LLM_TOKENS_TOTAL = REGISTRY.counter("haas_llm_tokens_total", "Total tokens used by chat completions", ["kind"])
+SLOW_REQUESTS = REGISTRY.counter("haas_chat_slow_requests_total", "Chat requests slower than the slow-request threshold", ["endpoint"])
+
+_current_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+class RequestTrace:
+    def __init__(self, endpoint, **attrs):
+        self.endpoint = endpoint
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.spans = []
+        self.tokens = {}
+        self.outcome = "ok"
+        self._lock = threading.Lock()
+
+    def add_span(self, stage, seconds):
+        with self._lock:
+            self.spans.append((stage, round(seconds, 4)))
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.start
+        REQUEST_SECONDS.observe(elapsed, endpoint=self.endpoint, outcome=self.outcome)
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            SLOW_REQUESTS.inc(endpoint=self.endpoint)
+            log_slow_request(self, elapsed)
+        return elapsed
+
+
+def log_slow_request(trace, elapsed):
+    record = {
+        "event": "slow_request",
+        "time": round(trace.started_at, 3),
+        "endpoint": trace.endpoint,
+        "outcome": trace.outcome,
+        "seconds": round(elapsed, 4),
+        "spans": [{"stage": stage, "seconds": seconds} for stage, seconds in trace.spans],
+        "tokens": trace.tokens,
+    }
+    record.update(trace.attrs)
+    line = json.dumps(record, default=str)
+    print(line)
+    if SLOW_REQUEST_LOG:
+        try:
+            with open(SLOW_REQUEST_LOG, "a") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"Could not write slow request log: {e}")
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def request_trace(endpoint, **attrs):
+    trace = RequestTrace(endpoint, **attrs)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except BaseException:
+        trace.outcome = "error"
+        raise
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # Reset from a different context (e.g. a generator closed elsewhere); the trace is done anyway
+            pass
+        trace.finish()
+
+
+def record_span(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(stage, seconds)
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+
+def record_usage(usage):
+    """Prompt/completion token counts from an API response's usage block (if present)"""
+    if usage is None:
+        return
+    trace = _current_trace.get()
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if value is None:
+            continue
+        name = kind.replace("_tokens", "")
+        LLM_TOKENS.observe(value, kind=name)
+        LLM_TOKENS_TOTAL.inc(value, kind=name)
+        if trace is not None:
+            trace.tokens[name] = trace.tokens.get(name, 0) + value
+
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Normalized machine model catalog and supporting indexes for masterData.sqlite3.
+
+`Model LIKE '%VF-4%'` can't use a B-tree index, so every lookup scanned Machines/ServiceReports
+(and it also matched VF-40).  The bootstrap below adds, without touching existing rows:
+
+- ModelCatalog: one row per raw Model string with its canonical form ("VF-4SS" -> "VF4SS") and
+  model family ("VF4"), indexed on both.
+- Indexes on ServiceReports(Model, Date), ServiceReports(Serial, Date),
+  ServiceReportParts(ServiceReport_id) and Machines(Model, Serial).
+
+ModelResolver turns user input ("vf4", "VF-4", "VF-4SS") into the exact raw Model strings so
+queries can use `Model IN (...)`.  Run once against an existing database, and again whenever new
+models show up (the indexer refreshes the catalog automatically once it exists):
+
+    python model_catalog.py --db ../masterData.sqlite3
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'masterData.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ModelCatalog (
+    Model TEXT PRIMARY KEY,
+    CanonicalModel TEXT NOT NULL,
+    ModelFamily TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_modelcatalog_canonical ON ModelCatalog(CanonicalModel, Model);
+CREATE INDEX IF NOT EXISTS idx_modelcatalog_family ON ModelCatalog(ModelFamily, Model);
+CREATE INDEX IF NOT EXISTS idx_servicereports_model_date ON ServiceReports(Model, Date);
+CREATE INDEX IF NOT EXISTS idx_servicereports_serial_date ON ServiceReports(Serial, Date);
+CREATE INDEX IF NOT EXISTS idx_servicereportparts_report ON ServiceReportParts(ServiceReport_id);
+CREATE INDEX IF NOT EXISTS idx_machines_model_serial ON Machines(Model, Serial);
+"""
+
+_FAMILY_RE = re.compile(r"^([A-Z]+)(\d+)")
+
+
+def canonical_model(model):
+    """'VF-4SS' / 'vf 4ss' / 'VF4SS' -> 'VF4SS'"""
+    return re.sub(r"[^A-Z0-9]", "", (model or "").upper())
+
+
+def model_family(model):
+    """Letters plus the first number of the canonical form: 'VF-4SS' -> 'VF4', 'UMC-750' -> 'UMC750'"""
+    canonical = canonical_model(model)
+    match = _FAMILY_RE.match(canonical)
+    return match.group(0) if match else canonical
+
+
+def catalog_exists(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ModelCatalog'").fetchone()
+    return row is not None
+
+
+def refresh_catalog(conn):
+    """Add any Model strings not yet in the catalog; returns the number of new entries"""
+    rows = conn.execute("""
+        SELECT Model FROM ServiceReports WHERE Model IS NOT NULL
+        UNION
+        SELECT Model FROM Machines WHERE Model IS NOT NULL
+    """).fetchall()
+    known = {r[0] for r in conn.execute("SELECT Model FROM ModelCatalog")}
+    new_rows = [(m, canonical_model(m), model_family(m)) for (m,) in rows if m not in known]
+    conn.executemany(
+        "INSERT OR IGNORE INTO ModelCatalog (Model, CanonicalModel, ModelFamily) VALUES (?, ?, ?)",
+        new_rows
+    )
+    conn.commit()
+    return len(new_rows)
+
+
+def bootstrap(db_path=DEFAULT_DB_PATH):
+    """Create the catalog table and indexes (idempotent) and populate the catalog"""
+    conn = sqlite3.connect(db_path)
+    try:
+        start = time.time()
+        conn.executescript(SCHEMA)
+        added = refresh_catalog(conn)
+        conn.execute("ANALYZE")
+        conn.commit()
+        print(f"Model catalog ready: {added} new models, built in {time.time() - start:.2f}s")
+        return added
+    finally:
+        conn.close()
+
+
+class ModelResolver:
+    """
+    Resolve free-form model input to the raw Model strings stored in the database.
+
+    The catalog is small, so it is held in memory and reloaded every reload_seconds.  resolve()
+    returns None when the catalog hasn't been bootstrapped, so callers can fall back to LIKE.
+    """
+
+    def __init__(self, connect, reload_seconds=300):
+        self.connect = connect
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._loaded_at = 0
+        self._by_canonical = None
+        self._by_family = None
+
+    def _load(self):
+        conn = self.connect()
+        if not catalog_exists(conn):
+            return None, None
+        by_canonical = {}
+        by_family = {}
+        for model, canonical, family in conn.execute("SELECT Model, CanonicalModel, ModelFamily FROM ModelCatalog"):
+            by_canonical.setdefault(canonical, []).append(model)
+            by_family.setdefault(family, []).append(model)
+        return by_canonical, by_family
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if time.time() - self._loaded_at > self.reload_seconds:
+                self._by_canonical, self._by_family = self._load()
+                self._loaded_at = time.time()
+            return self._by_canonical, self._by_family
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0
+
+    def resolve(self, model):
+        """
+        'VF-4' or 'vf4' -> every VF-4 variant (VF-4, VF-4SS, ...); 'VF-4SS' -> just VF-4SS.
+        Returns a sorted list (possibly empty) of raw Model strings, or None without a catalog.
+        """
+        by_canonical, by_family = self._ensure_loaded()
+        if by_canonical is None:
+            return None
+        canonical = canonical_model(model)
+        if not canonical:
+            return []
+        matches = set(by_family.get(canonical, []))
+        matches.update(by_canonical.get(canonical, []))
+        return sorted(matches)
+
+
+def model_filter_sql(column, models, model):
+    """
+    SQL fragment and params restricting column to the resolved models, falling back to the old
+    substring match when the catalog isn't available or doesn't recognise the input.
+    """
+    if not models:
+        return f"{column} LIKE ?", [f"%{model}%"]
+    placeholders = ",".join("?" * len(models))
+    return f"{column} IN ({placeholders})", list(models)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the model catalog and lookup indexes in masterData.sqlite3")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to masterData.sqlite3")
+    args = parser.parse_args()
+    bootstrap(args.db)
+
+
+if __name__ == "__main__":
+    main()
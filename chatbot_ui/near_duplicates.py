@@ -0,0 +1,220 @@
+"""
+Index-time near-duplicate grouping of service reports.
+
+Reports are often copy-pasted from one visit to the next, so the top vector hits used to be
+several copies of the same text: redundant prompt tokens that crowded out different fixes.  With
+deduplication on, the indexer fingerprints WorkRequired + ServicePerformed of every new or
+changed report with a 64-bit SimHash and looks for an existing report of the same model within
+MAX_DISTANCE bits.  A match joins that report's group and gets no vector of its own; otherwise
+the report becomes a representative and is embedded as usual.  Only representatives are stored
+in the vector collection.
+
+Groups live in the index state file next to the vector store (table duplicates: report id ->
+representative id), since they describe what the collection holds.  When a representative is
+changed or deleted its members are regrouped, and the first of them becomes the new
+representative.  At query time DuplicateGroups maps any report (e.g. a lexical hit on a member)
+to its group so hits collapse to one report per group, shown with how often it recurred.
+
+Candidate lookup uses the usual banding trick: the fingerprint is split into BANDS blocks, and
+two fingerprints within MAX_DISTANCE < BANDS bits of each other share at least one block.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from issue_summary import issue_tokens
+
+FINGERPRINT_BITS = 64
+MAX_DISTANCE = 3
+BANDS = 4
+# Short texts have too few features for their fingerprints to mean much; they are never grouped
+MIN_FEATURES = 6
+# Recorded in the index state hash so changing the settings regroups everything
+DEDUP_SPEC = f"simhash/{FINGERPRINT_BITS}/{MAX_DISTANCE}/{MIN_FEATURES}"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS duplicates (
+    report_id TEXT PRIMARY KEY,
+    representative_id TEXT NOT NULL,
+    model TEXT,
+    fingerprint INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_duplicates_representative ON duplicates(representative_id);
+"""
+
+_BAND_BITS = FINGERPRINT_BITS // BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+
+def _feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def simhash(work_required, service_performed):
+    """64-bit SimHash of the report's issue/solution tokens, or None if there are too few of them"""
+    features = sorted(issue_tokens(work_required, service_performed))
+    if len(features) < MIN_FEATURES:
+        return None
+    hashes = np.array([_feature_hash(f) for f in features], dtype="<u8")
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    majority = bits.sum(axis=0) * 2 > len(features)
+    return int.from_bytes(np.packbits(majority, bitorder="little").tobytes(), "little")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _to_sql(fingerprint):
+    """SQLite integers are signed 64-bit"""
+    if fingerprint is None:
+        return None
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def _from_sql(value):
+    if value is None:
+        return None
+    return value + (1 << 64) if value < 0 else value
+
+
+def _bands(fingerprint):
+    return [(i, (fingerprint >> (i * _BAND_BITS)) & _BAND_MASK) for i in range(BANDS)]
+
+
+class DuplicateIndex:
+    """
+    The indexer's view of the groups: loaded into memory from the state connection, updated
+    in place and written through (committed with the indexer's own state writes).
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.executescript(SCHEMA)
+        self.entries = {}  # report id -> (model, fingerprint, representative id)
+        self.members = {}  # representative id -> set of member ids (not including itself)
+        self.bands = {}  # (model, band, value) -> set of representative ids
+        for report_id, representative_id, model, fingerprint in conn.execute(
+            "SELECT report_id, representative_id, model, fingerprint FROM duplicates"
+        ):
+            self._add(report_id, model, _from_sql(fingerprint), representative_id)
+
+    def _add(self, report_id, model, fingerprint, representative_id):
+        self.entries[report_id] = (model, fingerprint, representative_id)
+        if representative_id == report_id:
+            self.members.setdefault(report_id, set())
+            if fingerprint is not None:
+                for band in _bands(fingerprint):
+                    self.bands.setdefault((model,) + band, set()).add(report_id)
+        else:
+            self.members.setdefault(representative_id, set()).add(report_id)
+
+    def representative_of(self, report_id):
+        entry = self.entries.get(report_id)
+        return entry[2] if entry else None
+
+    def find(self, model, fingerprint):
+        """The closest representative of the same model within MAX_DISTANCE bits, or None"""
+        if fingerprint is None:
+            return None
+        best, best_distance = None, MAX_DISTANCE + 1
+        for band in _bands(fingerprint):
+            for candidate in self.bands.get((model,) + band, ()):
+                distance = hamming(fingerprint, self.entries[candidate][1])
+                if distance < best_distance or (best is not None and distance == best_distance and candidate < best):
+                    best, best_distance = candidate, distance
+        return best
+
+    def assign(self, report_id, model, fingerprint):
+        """Put a (new or re-read) report into a group; returns its representative id"""
+        representative_id = self.find(model, fingerprint) or report_id
+        self._add(report_id, model, fingerprint, representative_id)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO duplicates (report_id, representative_id, model, fingerprint) VALUES (?, ?, ?, ?)",
+            (report_id, representative_id, model, _to_sql(fingerprint))
+        )
+        return representative_id
+
+    def remove(self, report_id):
+        """Drop a report; returns the members left without a representative (to be reassigned)"""
+        entry = self.entries.pop(report_id, None)
+        if entry is None:
+            return []
+        model, fingerprint, representative_id = entry
+        self.conn.execute("DELETE FROM duplicates WHERE report_id = ?", (report_id,))
+        if representative_id != report_id:
+            self.members.get(representative_id, set()).discard(report_id)
+            return []
+        if fingerprint is not None:
+            for band in _bands(fingerprint):
+                self.bands.get((model,) + band, set()).discard(report_id)
+        orphans = sorted(self.members.pop(report_id, ()))
+        for orphan in orphans:
+            self.entries.pop(orphan, None)
+        if orphans:
+            self.conn.executemany("DELETE FROM duplicates WHERE report_id = ?", [(o,) for o in orphans])
+        return orphans
+
+    def group_count(self):
+        return len(self.members)
+
+
+class DuplicateGroups:
+    """
+    Read-only query-time access to the groups in an index state file, through one connection per
+    thread.  Reports not in the table (deduplication off, or not indexed yet) are their own group.
+    state_path may be a function returning the path, which is re-read on every query (the app's
+    changes when it switches index snapshots, see snapshots.py).
+    """
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self._local = threading.local()
+
+    def _connection(self):
+        path = self.state_path() if callable(self.state_path) else self.state_path
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.path != path:
+            conn.close()
+            conn = self._local.conn = None
+        if conn is None:
+            if not os.path.exists(path):
+                return None
+            conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn, self._local.path = conn, path
+        return conn
+
+    def _query(self, sql, values):
+        conn = self._connection()
+        values = [str(v) for v in values]
+        if conn is None or not values:
+            return []
+        rows = []
+        try:
+            for i in range(0, len(values), 500):
+                chunk = values[i:i + 500]
+                rows.extend(conn.execute(sql.format(placeholders=",".join("?" * len(chunk))), chunk).fetchall())
+        except sqlite3.OperationalError:
+            return []  # No duplicates table: the index was built without deduplication
+        return rows
+
+    def representatives(self, report_ids):
+        """{report id: representative id} for the given reports that are grouped"""
+        return dict(self._query(
+            "SELECT report_id, representative_id FROM duplicates WHERE report_id IN ({placeholders})", report_ids
+        ))
+
+    def members(self, representative_ids):
+        """{representative id: [other report ids in its group]}"""
+        grouped = {}
+        for report_id, representative_id in self._query(
+            "SELECT report_id, representative_id FROM duplicates "
+            "WHERE representative_id IN ({placeholders}) AND report_id != representative_id ORDER BY report_id",
+            representative_ids
+        ):
+            grouped.setdefault(representative_id, []).append(report_id)
+        return grouped
@@ -0,0 +1,439 @@
+"""
+Rate-limit-aware gateway for OpenAI API calls, shared by the web app (sync and async) and
+HaasServiceAssistant.py.
+
+Calling the client directly turned every 429 into an "Error: ..." answer.  The gateway instead:
+
+- throttles each lane (chat, embeddings) with token buckets for requests and tokens per minute,
+  set from the account's limits; a 429 pauses the whole lane for its Retry-After,
+- retries rate limits, timeouts, connection errors and 5xx with full-jitter exponential backoff
+  (the client's own retries are turned off so the two don't multiply),
+- coalesces identical in-flight requests, so concurrent duplicates cost one API call,
+- micro-batches single query embeddings: requests arriving within a few milliseconds of each other
+  (e.g. from concurrent /chat requests) share one embeddings call.  A query that arrives while no
+  other query is being embedded is sent right away, so batching only costs latency under load.
+
+    gateway = OpenAIGateway.from_env()
+    response = gateway.chat(model="gpt-4o-mini", messages=messages, max_tokens=500)
+    vector = gateway.embed_query("spindle alarm 108", "text-embedding-3-small")
+
+Limits come from OPENAI_CHAT_RPM / OPENAI_CHAT_TPM / OPENAI_EMBEDDING_RPM / OPENAI_EMBEDDING_TPM
+(0 or unset: unlimited).  Streams are throttled and retried until the first chunk, but never
+coalesced.
+"""
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import openai
+
+from metrics import REGISTRY
+
+RETRIES_TOTAL = REGISTRY.counter("haas_openai_retries_total", "OpenAI calls retried by the gateway", ["lane", "reason"])
+THROTTLE_SECONDS = REGISTRY.counter(
+    "haas_openai_throttle_seconds_total", "Time callers waited on the gateway's rate limits", ["lane"]
+)
+COALESCED_TOTAL = REGISTRY.counter("haas_openai_coalesced_total", "Requests served by an identical in-flight call", ["lane"])
+EMBEDDING_BATCH_SIZE = REGISTRY.histogram(
+    "haas_openai_embedding_batch_size", "Query embeddings sent per micro-batched API call", [],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def estimate_tokens(text):
+    return len(text or "") // 4 + 1
+
+
+class TokenBucket:
+    """
+    per_minute units refilled continuously, holding at most burst (default: one minute's worth).
+    reserve() takes units immediately, going into debt if needed, and returns how long the
+    caller must wait for them, so waiting callers are served in arrival order.
+    """
+
+    def __init__(self, per_minute, burst=None):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0 if per_minute else 0.0
+        self.capacity = burst or per_minute or 0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount=1):
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # A single request bigger than the bucket can still go through, once it's full
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount):
+        """Give back (positive) or take (negative) units once the real cost is known"""
+        if not self.rate:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Lane:
+    """Request and token buckets for one kind of call, plus a pause set by 429 responses"""
+
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+
+    def reserve(self, tokens):
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens), self.paused_until - time.monotonic(), 0.0)
+        if wait:
+            THROTTLE_SECONDS.inc(wait, lane=self.name)
+        return wait
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def settle(self, estimated, usage):
+        """Correct the token bucket with the usage the API reported"""
+        actual = getattr(usage, "total_tokens", None) if usage is not None else None
+        if actual is not None:
+            self.tokens.adjust(estimated - actual)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is not None:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    return None
+
+
+class _Batch:
+    def __init__(self):
+        self.futures = {}  # text -> Future
+        self.closed = False
+        self.full = threading.Event()  # wakes a sync leader early once max_batch_size texts arrived
+
+
+class OpenAIGateway:
+    def __init__(self, client=None, async_client=None, chat_rpm=0, chat_tpm=0, embedding_rpm=0, embedding_tpm=0,
+                 max_retries=4, retry_base_seconds=0.5, retry_max_seconds=20.0, batch_window_seconds=0.005,
+                 max_batch_size=64):
+        self._client = client
+        self._async_client = async_client
+        self._client_lock = threading.Lock()
+        self.lanes = {
+            "chat": Lane("chat", chat_rpm, chat_tpm),
+            "embeddings": Lane("embeddings", embedding_rpm, embedding_tpm),
+        }
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.batch_window_seconds = batch_window_seconds
+        self.max_batch_size = max_batch_size
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self._batches = {}
+        self._batch_lock = threading.Lock()
+        self._query_callers = 0  # embed_query calls in progress
+        self._async_in_flight = {}
+        self._async_batches = {}
+        self._async_query_callers = 0
+        self._flush_tasks = set()  # the loop only keeps weak references to tasks
+
+    @classmethod
+    def from_env(cls, **overrides):
+        settings = {
+            "chat_rpm": float(os.getenv("OPENAI_CHAT_RPM", "0")),
+            "chat_tpm": float(os.getenv("OPENAI_CHAT_TPM", "0")),
+            "embedding_rpm": float(os.getenv("OPENAI_EMBEDDING_RPM", "0")),
+            "embedding_tpm": float(os.getenv("OPENAI_EMBEDDING_TPM", "0")),
+            "max_retries": int(os.getenv("OPENAI_MAX_RETRIES", "4")),
+            "batch_window_seconds": float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5")) / 1000,
+            "max_batch_size": int(os.getenv("EMBEDDING_BATCH_MAX", "64")),
+        }
+        settings.update(overrides)
+        return cls(**settings)
+
+    # Clients are created on first use (the async one only in the ASGI server)
+    @property
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+            return self._client
+
+    @property
+    def async_client(self):
+        with self._client_lock:
+            if self._async_client is None:
+                self._async_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+            return self._async_client
+
+    # -- shared helpers --------------------------------------------------------------------------
+
+    @staticmethod
+    def _chat_tokens(params):
+        prompt = sum(estimate_tokens(str(m.get("content") or "")) for m in params.get("messages", []))
+        return prompt + (params.get("max_tokens") or 500)
+
+    @staticmethod
+    def _key(lane, params):
+        return lane + ":" + json.dumps(params, sort_keys=True, default=str)
+
+    def _backoff(self, lane, attempt, error):
+        """Seconds to wait before retry number attempt (1-based), or None to give up"""
+        if attempt > self.max_retries:
+            return None
+        reason = error.__class__.__name__
+        RETRIES_TOTAL.inc(lane=lane.name, reason=reason)
+        delay = random.uniform(0, min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (attempt - 1)))
+        if isinstance(error, openai.RateLimitError):
+            retry_after = _retry_after(error)
+            if retry_after is not None:
+                # Everyone on this lane waits it out, not just this caller
+                lane.pause(retry_after)
+                delay = max(delay, retry_after)
+        print(f"OpenAI {lane.name} call failed ({reason}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+        return delay
+
+    # -- sync ------------------------------------------------------------------------------------
+
+    def _call(self, lane, tokens, fn):
+        """fn() under the lane's limits, retried on transient errors"""
+        attempt = 0
+        while True:
+            wait = lane.reserve(tokens)
+            if wait:
+                time.sleep(wait)
+            try:
+                return fn()
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                delay = self._backoff(lane, attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    def _coalesce(self, key, lane, fn):
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            COALESCED_TOTAL.inc(lane=lane.name)
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._in_flight_lock:
+                self._in_flight.pop(key, None)
+
+    def chat(self, **params):
+        """chat.completions.create(**params) without stream"""
+        lane = self.lanes["chat"]
+        tokens = self._chat_tokens(params)
+
+        def call():
+            response = self._call(lane, tokens, lambda: self.client.chat.completions.create(**params))
+            lane.settle(tokens, getattr(response, "usage", None))
+            return response
+
+        return self._coalesce(self._key("chat", params), lane, call)
+
+    def chat_stream(self, **params):
+        """chat.completions.create(stream=True, **params); throttled and retried until the stream opens"""
+        lane = self.lanes["chat"]
+        return self._call(
+            lane, self._chat_tokens(params), lambda: self.client.chat.completions.create(stream=True, **params)
+        )
+
+    def embed(self, texts, model):
+        """Embedding vectors for texts, in order"""
+        texts = list(texts)
+        lane = self.lanes["embeddings"]
+        tokens = sum(estimate_tokens(t) for t in texts)
+
+        def call():
+            response = self._call(lane, tokens, lambda: self.client.embeddings.create(input=texts, model=model))
+            lane.settle(tokens, getattr(response, "usage", None))
+            return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+        return self._coalesce(self._key("embeddings", {"model": model, "input": texts}), lane, call)
+
+    def embed_query(self, text, model):
+        """
+        One embedding, micro-batched with other callers' queries.  The first caller of a batch
+        waits up to batch_window_seconds, then sends every text that arrived in the meantime at
+        once; if no other query was being embedded when it arrived it sends right away.
+        """
+        if not self.batch_window_seconds:
+            return self.embed([text], model)[0]
+        with self._batch_lock:
+            self._query_callers += 1
+            alone = self._query_callers == 1
+            batch = self._batches.get(model)
+            leader = batch is None or batch.closed
+            if leader:
+                batch = self._batches[model] = _Batch()
+            future = batch.futures.get(text)
+            if future is None:
+                future = batch.futures[text] = Future()
+            if len(batch.futures) >= self.max_batch_size:
+                batch.closed = True
+                batch.full.set()
+        try:
+            if leader:
+                if not alone:
+                    batch.full.wait(self.batch_window_seconds)
+                with self._batch_lock:
+                    batch.closed = True
+                    if self._batches.get(model) is batch:
+                        del self._batches[model]
+                texts = list(batch.futures)
+                EMBEDDING_BATCH_SIZE.observe(len(texts))
+                try:
+                    for text_in_batch, vector in zip(texts, self.embed(texts, model)):
+                        batch.futures[text_in_batch].set_result(vector)
+                except Exception as e:
+                    for pending in batch.futures.values():
+                        if not pending.done():
+                            pending.set_exception(e)
+            return future.result()
+        finally:
+            with self._batch_lock:
+                self._query_callers -= 1
+
+    # -- async -----------------------------------------------------------------------------------
+
+    async def _acall(self, lane, tokens, make_coro):
+        attempt = 0
+        while True:
+            wait = lane.reserve(tokens)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                return await make_coro()
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                delay = self._backoff(lane, attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def _acoalesce(self, key, lane, make_coro):
+        future = self._async_in_flight.get(key)
+        if future is not None:
+            COALESCED_TOTAL.inc(lane=lane.name)
+            return await asyncio.shield(future)
+        future = self._async_in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await make_coro()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Don't warn about an exception nobody else was waiting for
+            future.exception()
+            raise
+        finally:
+            self._async_in_flight.pop(key, None)
+
+    async def achat(self, **params):
+        lane = self.lanes["chat"]
+        tokens = self._chat_tokens(params)
+
+        async def call():
+            response = await self._acall(lane, tokens, lambda: self.async_client.chat.completions.create(**params))
+            lane.settle(tokens, getattr(response, "usage", None))
+            return response
+
+        return await self._acoalesce(self._key("chat", params), lane, call)
+
+    async def achat_stream(self, **params):
+        lane = self.lanes["chat"]
+        return await self._acall(
+            lane, self._chat_tokens(params), lambda: self.async_client.chat.completions.create(stream=True, **params)
+        )
+
+    async def aembed(self, texts, model):
+        texts = list(texts)
+        lane = self.lanes["embeddings"]
+        tokens = sum(estimate_tokens(t) for t in texts)
+
+        async def call():
+            response = await self._acall(lane, tokens, lambda: self.async_client.embeddings.create(input=texts, model=model))
+            lane.settle(tokens, getattr(response, "usage", None))
+            return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+        return await self._acoalesce(self._key("embeddings", {"model": model, "input": texts}), lane, call)
+
+    async def aembed_query(self, text, model):
+        """Async counterpart of embed_query; the batch is flushed by a timer on the event loop"""
+        if not self.batch_window_seconds:
+            return (await self.aembed([text], model))[0]
+        loop = asyncio.get_running_loop()
+        self._async_query_callers += 1
+        try:
+            batch = self._async_batches.get(model)
+            if batch is None or batch.closed:
+                batch = self._async_batches[model] = _Batch()
+                if self._async_query_callers == 1:
+                    self._start_flush(loop, model, batch)
+                else:
+                    loop.call_later(self.batch_window_seconds, self._start_flush, loop, model, batch)
+            future = batch.futures.get(text)
+            if future is None:
+                future = batch.futures[text] = loop.create_future()
+            if len(batch.futures) >= self.max_batch_size:
+                batch.closed = True
+            return await asyncio.shield(future)
+        finally:
+            self._async_query_callers -= 1
+
+    def _start_flush(self, loop, model, batch):
+        task = loop.create_task(self._aflush(model, batch))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _aflush(self, model, batch):
+        batch.closed = True
+        if self._async_batches.get(model) is batch:
+            del self._async_batches[model]
+        texts = list(batch.futures)
+        EMBEDDING_BATCH_SIZE.observe(len(texts))
+        try:
+            vectors = await self.aembed(texts, model)
+            for text, vector in zip(texts, vectors):
+                if not batch.futures[text].done():
+                    batch.futures[text].set_result(vector)
+        except Exception as e:
+            for future in batch.futures.values():
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()
@@ -0,0 +1,132 @@
+"""
+Batched, set-based access to service reports and their parts.
+
+Context building used to issue one get_service_report_by_id() and one get_related_parts() query per
+report (N+1).  These helpers fetch every report and every part needed for a context in a fixed
+number of IN (...) / JOIN queries, and ContextBuilder assembles the text with a single join at the
+end instead of repeated string concatenation.
+"""
+
+# SQLite's default limit on bound parameters is 999 on older builds
+MAX_PARAMS = 900
+
+REPORT_COLUMNS = """
+        ServiceReport_id,
+        Date,
+        Model,
+        Serial,
+        WorkRequired,
+        ServicePerformed,
+        VerificationTest
+"""
+
+
+def _chunks(values, size=MAX_PARAMS):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _normalize_id(report_id):
+    """Vector store ids are strings while SQLite ids are usually integers; compare on str"""
+    return str(report_id)
+
+
+def fetch_reports(conn, report_ids):
+    """
+    Fetch reports by id in as few queries as possible.
+
+    Returns {str(ServiceReport_id): (ServiceReport_id, Date, Model, Serial, WorkRequired,
+    ServicePerformed, VerificationTest)}; ids that don't exist are simply absent.
+    """
+    reports = {}
+    unique_ids = list(dict.fromkeys(report_ids))
+    for chunk in _chunks(unique_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor = conn.execute(
+            f"SELECT {REPORT_COLUMNS} FROM ServiceReports WHERE ServiceReport_id IN ({placeholders})",
+            chunk
+        )
+        for row in cursor.fetchall():
+            reports[_normalize_id(row[0])] = row
+    return reports
+
+
+def fetch_parts(conn, report_ids, limit_per_report=None):
+    """Fetch parts for many reports at once: {str(ServiceReport_id): [(PartNumber, Description), ...]}"""
+    parts = {}
+    unique_ids = list(dict.fromkeys(report_ids))
+    for chunk in _chunks(unique_ids):
+        placeholders = ",".join("?" * len(chunk))
+        cursor = conn.execute(
+            f"""
+            SELECT ServiceReport_id, PartNumber, Description
+            FROM ServiceReportParts
+            WHERE ServiceReport_id IN ({placeholders})
+            ORDER BY ServiceReport_id, rowid
+            """,
+            chunk
+        )
+        for report_id, part_number, description in cursor.fetchall():
+            bucket = parts.setdefault(_normalize_id(report_id), [])
+            if limit_per_report is None or len(bucket) < limit_per_report:
+                bucket.append((part_number, description))
+    return parts
+
+
+def fetch_reports_with_parts(conn, where_sql, params):
+    """
+    Fetch reports matching where_sql (applied to ServiceReports as sr) together with all their parts
+    in two queries total, independent of how many reports match.
+
+    Returns a list of report rows and a {str(id): [(PartNumber, Description), ...]} dict.
+    """
+    cursor = conn.execute(
+        f"SELECT {REPORT_COLUMNS} FROM ServiceReports sr WHERE {where_sql} ORDER BY sr.ServiceReport_id",
+        params
+    )
+    reports = cursor.fetchall()
+    if not reports:
+        return [], {}
+
+    cursor = conn.execute(
+        f"""
+        SELECT p.ServiceReport_id, p.PartNumber, p.Description
+        FROM ServiceReportParts p
+        JOIN ServiceReports sr ON sr.ServiceReport_id = p.ServiceReport_id
+        WHERE {where_sql}
+        ORDER BY p.ServiceReport_id, p.rowid
+        """,
+        params
+    )
+    parts = {}
+    for report_id, part_number, description in cursor.fetchall():
+        parts.setdefault(_normalize_id(report_id), []).append((part_number, description))
+    return reports, parts
+
+
+def format_parts(parts, limit=3):
+    return ", ".join(f"{p[0]} ({p[1]})" for p in parts[:limit])
+
+
+class ContextBuilder:
+    """Collects context lines and joins them once"""
+
+    def __init__(self, header=None):
+        self._parts = []
+        if header:
+            self._parts.append(header)
+
+    def add(self, text):
+        self._parts.append(text)
+        return self
+
+    def line(self, text=""):
+        self._parts.append(text + "\n")
+        return self
+
+    def __len__(self):
+        return sum(len(p) for p in self._parts)
+
+    def build(self):
+        return "".join(self._parts)
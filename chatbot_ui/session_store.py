@@ -0,0 +1,237 @@
+"""
+Server-side chat sessions.
+
+Without sessions the browser re-POSTs the whole conversation on every turn, and the server
+rebuilds the machine context and re-fetches the same reports each time.  A session keeps, per
+conversation:
+
+- the machine model/serial and the message history,
+- the machine details context built on the first turn,
+- the rows and parts of every report retrieved so far, plus their latest relevance scores, so
+  follow-up turns only fetch reports they haven't seen and can carry earlier hits forward.
+
+With db_path set, sessions live in a SQLite table that every worker process shares, so a turn can
+land on any worker (uvicorn/gunicorn --workers N).  Each process keeps an LRU of parsed sessions in
+front of it, checked against the row's version on every get().  A finished turn is written in one
+IMMEDIATE transaction; if another worker saved a turn of the same session in the meantime, the
+stored session is reloaded and this turn is applied on top of it instead of overwriting it.  Turns
+of one session are also serialized within a process by a per-session lock.
+
+Without db_path sessions are in memory only, which needs a single worker (or sticky routing):
+a turn that reaches another process comes back as session_expired.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS Sessions (
+    session_id TEXT PRIMARY KEY,
+    updated REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_updated ON Sessions(updated);
+"""
+
+# Expired rows are purged every this many new sessions
+PURGE_EVERY = 500
+
+
+def new_session(model="", serial="", history=None):
+    now = time.time()
+    return {
+        "session_id": uuid.uuid4().hex,
+        "model": model or "",
+        "serial": serial or "",
+        "messages": list(history or []),
+        "machine_context": None,  # fixed context text, built on the first turn
+        "filter_model": None,  # model/serial used for retrieval, possibly filled in from Machines
+        "filter_serial": None,
+        "reports": {},  # report id -> [report row, parts]
+        "scores": {},  # report id -> most recent relevance score
+        "created": now,
+        "updated": now,
+        "version": 0,  # bumped by every save to the shared table
+    }
+
+
+class SessionStore:
+    def __init__(self, max_sessions=2000, ttl_seconds=6 * 3600, max_messages=200, max_reports=50, db_path=None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self.max_reports = max_reports
+        self.db_path = db_path
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._session_locks = {}
+        self._db_local = threading.local()
+        self.created = 0
+        self.expired = 0
+        self.loaded = 0
+        self.saved = 0
+        self.conflicts = 0
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._purge()
+
+    def _db(self):
+        conn = getattr(self._db_local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._db_local.conn = conn
+        return conn
+
+    def _purge(self):
+        self._db().execute("DELETE FROM Sessions WHERE updated < ?", (time.time() - self.ttl_seconds,))
+
+    def _session_lock(self, session_id):
+        with self._lock:
+            lock = self._session_locks.get(session_id)
+            if lock is None:
+                lock = self._session_locks[session_id] = threading.Lock()
+            return lock
+
+    def _cache(self, session):
+        """Keep a parsed session in this process's LRU (the shared table stays authoritative)"""
+        with self._lock:
+            self._sessions[session["session_id"]] = session
+            self._sessions.move_to_end(session["session_id"])
+            while len(self._sessions) > self.max_sessions:
+                oldest_id, _ = self._sessions.popitem(last=False)
+                self._session_locks.pop(oldest_id, None)
+
+    def _forget(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._session_locks.pop(session_id, None)
+
+    def _write(self, conn, session):
+        conn.execute(
+            "INSERT OR REPLACE INTO Sessions (session_id, updated, version, data) VALUES (?, ?, ?, ?)",
+            (session["session_id"], session["updated"], session["version"], json.dumps(session))
+        )
+        self.saved += 1
+
+    def create(self, model="", serial="", history=None):
+        session = new_session(model, serial, history)
+        if self.db_path:
+            self._write(self._db(), session)
+        self._cache(session)
+        with self._lock:
+            self.created += 1
+            purge = self.db_path and self.created % PURGE_EVERY == 0
+        if purge:
+            self._purge()
+        return session
+
+    def get(self, session_id):
+        """The session dict, or None if unknown or expired"""
+        if not session_id:
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if self.db_path:
+            # Another worker may have saved a newer turn; reload only when the version moved on
+            row = self._db().execute("SELECT version FROM Sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                session = None
+            elif session is None or session["version"] != row[0]:
+                session = self._load(session_id)
+        if session is None:
+            self._forget(session_id)
+            return None
+        if time.time() - session["updated"] > self.ttl_seconds:
+            self.delete(session_id)
+            with self._lock:
+                self.expired += 1
+            return None
+        self._cache(session)
+        return session
+
+    def _load(self, session_id):
+        row = self._db().execute("SELECT data FROM Sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        self.loaded += 1
+        return json.loads(row[0])
+
+    def _update(self, session, mutate):
+        """Apply mutate(session) and save it, on top of whatever another worker saved meanwhile"""
+        with self._session_lock(session["session_id"]):
+            if not self.db_path:
+                mutate(session)
+                return
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT version, data FROM Sessions WHERE session_id = ?", (session["session_id"],)
+                ).fetchone()
+                if row is not None and row[0] != session["version"]:
+                    self.conflicts += 1
+                    stored = json.loads(row[1])
+                    # Keep what this turn learned that the stored copy doesn't have yet
+                    if stored.get("machine_context") is None:
+                        for key in ("machine_context", "filter_model", "filter_serial"):
+                            stored[key] = session[key]
+                    stored["reports"] = dict(session["reports"], **stored["reports"])
+                    stored["scores"] = dict(session["scores"], **stored["scores"])
+                    session.clear()
+                    session.update(stored)
+                mutate(session)
+                session["version"] += 1
+                self._write(conn, session)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def append_turn(self, session, user_message, answer):
+        def mutate(session):
+            session["messages"].append(user_message)
+            session["messages"].append({"role": "assistant", "content": answer})
+            del session["messages"][:-self.max_messages]
+            session["updated"] = time.time()
+        self._update(session, mutate)
+
+    def remember_reports(self, session, reports, scores):
+        """
+        Merge newly fetched report data and the latest scores, keeping the max_reports best scored.
+        Only the in-process copy changes; it is saved with the turn (append_turn).
+        """
+        with self._session_lock(session["session_id"]):
+            session["reports"].update(reports)
+            session["scores"].update(scores)
+            if len(session["scores"]) > self.max_reports:
+                ranked = sorted(session["scores"], key=session["scores"].get, reverse=True)
+                for report_id in ranked[self.max_reports:]:
+                    del session["scores"][report_id]
+            for report_id in [r for r in session["reports"] if r not in session["scores"]]:
+                del session["reports"][report_id]
+
+    def delete(self, session_id):
+        self._forget(session_id)
+        if self.db_path:
+            self._db().execute("DELETE FROM Sessions WHERE session_id = ?", (session_id,))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "shared": bool(self.db_path),
+                "created": self.created,
+                "expired": self.expired,
+                "loaded": self.loaded,
+                "saved": self.saved,
+                "conflicts": self.conflicts,
+            }
@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+"""
+Blue/green index snapshots: build a complete index offline, then switch serving workers to it.
+
+Indexing in place writes into the collection /chat is reading from, so a rebuild serves partial
+results until it finishes.  A snapshot is instead built in a staging directory, validated, and
+only then published under the snapshot root (default <VECTOR_DB_DIR>/snapshots):
+
+    snapshots/
+        current.json                 {"version": ..., "previous": ...}, replaced atomically
+        20261017-093000-3fa2c1d0/
+            manifest.json            build settings, counts, source-DB fingerprint, validation
+            vectors/                 the Chroma persistence directory or memory-mapped store
+            index_state.sqlite3      indexed report hashes and near-duplicate groups (indexer.py)
+            aux.sqlite3              the snapshot's FTS, identifier, issue, catalog and timeline tables
+
+A snapshot is self-contained, so it can be built on another box from a copy of
+masterData.sqlite3 and shipped as a directory.  The app watches current.json; when it names
+another version the app opens that snapshot and swaps it in (requests already running finish on
+the old one).  activate and rollback only rewrite the pointer, and the previous snapshot stays on
+disk until pruned, so rolling back is as fast as switching.
+
+    python snapshots.py build --db ../masterData.sqlite3 --activate
+    python snapshots.py list
+    python snapshots.py activate 20261017-093000-3fa2c1d0 --install-aux
+    python snapshots.py rollback
+    python snapshots.py prune --keep 3
+
+A build starts from a copy of the active snapshot when that was built with the same settings, so
+only new and changed reports are embedded (--from-scratch embeds everything, which the shared
+embedding cache in <VECTOR_DB_DIR> keeps cheap).
+
+The build only reads masterData.sqlite3: the indexer keeps the lexical and other side tables in
+the staging aux.sqlite3 (starting from the base snapshot's, or from the serving database's when
+there is none), so the tables the current snapshot serves are never touched.  The app reads the
+active snapshot's aux.sqlite3 ahead of masterData.sqlite3 (db_pool.py) and switches it together
+with the vector store.  activate --install-aux still loads the tables into a database in one
+transaction, for tools that read masterData.sqlite3 directly.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from hybrid_search import FTS_SCHEMA, FTS_TABLE
+from identifier_index import SCHEMA as IDENTIFIER_SCHEMA
+from indexer import (CHROMA_PERSIST_DIR, CHUNK_COLLECTION_NAME, COLLECTION_NAME, DEFAULT_DB_PATH, EMBEDDING_MODEL,
+                     REPORT_QUERY, IncrementalIndexer, make_embedding_function, open_collection)
+from issue_summary import SCHEMA as ISSUE_SCHEMA
+from machine_timeline import SCHEMA as TIMELINE_SCHEMA
+from model_catalog import SCHEMA as CATALOG_SCHEMA
+
+POINTER_FILE = "current.json"
+MANIFEST_FILE = "manifest.json"
+VECTORS_DIR = "vectors"
+STATE_FILE = "index_state.sqlite3"
+AUX_FILE = "aux.sqlite3"
+STAGING_PREFIX = ".staging-"
+# prune leaves younger staging directories alone: a build may still be writing them
+STALE_STAGING_SECONDS = 24 * 3600
+
+# Validation: sampled vectors must find themselves (or an identical copy) at about distance 0
+PROBE_SAMPLES = 20
+PROBE_MAX_DISTANCE = 0.02
+
+# Side tables carried in aux.sqlite3, with the schema that creates them in a serving database
+AUX_TABLES = (
+    (FTS_TABLE, FTS_SCHEMA),
+    ("ReportIdentifiers", IDENTIFIER_SCHEMA),
+    ("IdentifierCounts", IDENTIFIER_SCHEMA),
+    ("IssueClusters", ISSUE_SCHEMA),
+    ("IssueTokenCounts", ISSUE_SCHEMA),
+    ("IssueSummaryState", ISSUE_SCHEMA),
+    ("ModelCatalog", CATALOG_SCHEMA),
+    ("MachineTimeline", TIMELINE_SCHEMA),
+    ("MachineSummary", TIMELINE_SCHEMA),
+)
+
+
+def default_root(persist_dir=None):
+    return os.path.join(persist_dir or os.getenv("VECTOR_DB_DIR") or CHROMA_PERSIST_DIR, "snapshots")
+
+
+def open_store(path, backend, embedding_function, chunked=False, dtype="float16", search_dims=None):
+    """The vector store inside a snapshot (or staging) directory"""
+    if backend == "mmap":
+        from vector_store import MmapVectorStore
+        return MmapVectorStore(os.path.join(path, VECTORS_DIR), embedding_function=embedding_function,
+                               dtype=dtype, search_dims=search_dims)
+    return open_collection(os.path.join(path, VECTORS_DIR), embedding_function,
+                           name=CHUNK_COLLECTION_NAME if chunked else COLLECTION_NAME)
+
+
+class Snapshot:
+    """A published snapshot directory and its manifest"""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = os.path.basename(os.path.normpath(path))
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+
+    @property
+    def state_path(self):
+        return os.path.join(self.path, STATE_FILE)
+
+    @property
+    def aux_path(self):
+        return os.path.join(self.path, AUX_FILE)
+
+    @property
+    def serves_side_tables(self):
+        """Whether aux.sqlite3 was indexed with the snapshot (older builds only carry an unindexed copy)"""
+        return self.manifest.get("side_tables") == "snapshot"
+
+    def mismatches(self, backend, chunked, dedup):
+        """Settings this snapshot was built with that differ from the given ones"""
+        wanted = {"backend": backend, "chunked": chunked, "dedup": dedup}
+        return [f"{key}={self.manifest.get(key)} (want {value})"
+                for key, value in wanted.items() if self.manifest.get(key) != value]
+
+    def open(self, embedding_function, search_dims=None):
+        return open_store(self.path, self.manifest["backend"], embedding_function,
+                          chunked=self.manifest["chunked"], search_dims=search_dims)
+
+
+def _write_json(path, data):
+    """Write then rename, so readers see either the old file or the complete new one"""
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_pointer(root):
+    """current.json as a dict ({} before the first activation)"""
+    try:
+        with open(os.path.join(root, POINTER_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def active_snapshot(root):
+    version = read_pointer(root).get("version")
+    return Snapshot(os.path.join(root, version)) if version else None
+
+
+def list_snapshots(root):
+    """Published versions, oldest first (version names start with their UTC build time)"""
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if not name.startswith(".") and os.path.exists(os.path.join(root, name, MANIFEST_FILE))
+    )
+
+
+def source_fingerprint(db_path):
+    """Report count, rowid and date high-water marks, and a digest of every field the indexer reads"""
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    digest = hashlib.sha256()
+    reports, max_rowid, max_date = 0, 0, ""
+    try:
+        for row in conn.execute(REPORT_QUERY + " ORDER BY rowid"):
+            digest.update("\x1f".join("" if v is None else str(v) for v in row).encode("utf-8") + b"\x1e")
+            reports += 1
+            max_rowid = max(max_rowid, row[0])
+            max_date = max(max_date, str(row[7] or ""))
+    finally:
+        conn.close()
+    return {"reports": reports, "max_rowid": max_rowid, "max_date": max_date, "digest": digest.hexdigest()}
+
+
+def _copy_table(conn, source, target, table):
+    columns = [r[1] for r in conn.execute(f"PRAGMA {source}.table_info({table})")]
+    if table == FTS_TABLE:
+        columns.insert(0, "rowid")  # Mirrors ServiceReports.rowid, see hybrid_search.upsert_fts
+    column_sql = ", ".join(columns)
+    conn.execute(f"INSERT INTO {target}.{table} ({column_sql}) SELECT {column_sql} FROM {source}.{table}")
+    return conn.execute(f"SELECT COUNT(*) FROM {target}.{table}").fetchone()[0]
+
+
+def export_aux(db_path, aux_path):
+    """Copy the side tables that exist in db_path (read only) into a new aux_path; returns {table: rows}"""
+    counts = {}
+    conn = sqlite3.connect(f"file:{os.path.abspath(aux_path)}", uri=True)
+    try:
+        conn.execute("ATTACH DATABASE ? AS source", (f"file:{os.path.abspath(db_path)}?mode=ro",))
+        definitions = dict(conn.execute("SELECT name, sql FROM source.sqlite_master WHERE type = 'table'").fetchall())
+        for table, _ in AUX_TABLES:
+            if table not in definitions:
+                continue
+            # The same definition and indexes, so the indexer can keep upserting into the copy
+            conn.execute(definitions[table])
+            index_sql = conn.execute(
+                "SELECT sql FROM source.sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,)
+            ).fetchall()
+            for (sql,) in index_sql:
+                conn.execute(sql)
+            counts[table] = _copy_table(conn, "source", "main", table)
+        conn.commit()
+        conn.execute("DETACH DATABASE source")
+    finally:
+        conn.close()
+    return counts
+
+
+def aux_counts(aux_path):
+    """{table: rows} for the side tables in aux_path"""
+    conn = sqlite3.connect(f"file:{os.path.abspath(aux_path)}?mode=ro", uri=True)
+    try:
+        existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table, _ in AUX_TABLES if table in existing}
+    finally:
+        conn.close()
+
+
+def install_aux(aux_path, db_path):
+    """Replace db_path's side tables with a snapshot's copies, in one transaction; returns {table: rows}"""
+    counts = {}
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS snapshot", (aux_path,))
+        shipped = {r[0] for r in conn.execute("SELECT name FROM snapshot.sqlite_master WHERE type = 'table'")}
+        tables = [(table, schema) for table, schema in AUX_TABLES if table in shipped]
+        for table, _ in tables:
+            # A table from an older schema is replaced by the snapshot's layout
+            columns = [r[1] for r in conn.execute(f"PRAGMA main.table_info({table})")]
+            if columns and columns != [r[1] for r in conn.execute(f"PRAGMA snapshot.table_info({table})")]:
+                conn.execute(f"DROP TABLE main.{table}")
+        for schema in dict.fromkeys(schema for _, schema in tables):
+            conn.executescript(schema)
+        conn.execute("BEGIN")
+        for table, _ in tables:
+            conn.execute(f"DELETE FROM main.{table}")
+            counts[table] = _copy_table(conn, "snapshot", "main", table)
+        conn.commit()
+        conn.execute("DETACH DATABASE snapshot")
+    finally:
+        conn.close()
+    print(f"Installed side tables: {', '.join(f'{t} ({n})' for t, n in counts.items()) or 'none'}")
+    return counts
+
+
+def validate_snapshot(path, collection, manifest):
+    """Check a built snapshot before it is published; returns the results, raises ValueError on failure"""
+    problems = []
+    state = sqlite3.connect(os.path.join(path, STATE_FILE))
+    try:
+        indexed = state.execute("SELECT COUNT(*) FROM indexed_reports").fetchone()[0]
+        members = state.execute("SELECT COUNT(*) FROM duplicates WHERE report_id != representative_id").fetchone()[0]
+    finally:
+        state.close()
+    vectors = collection.count()
+    expected = indexed - members
+    if manifest["chunked"] and vectors < expected:
+        problems.append(f"{vectors} chunk vectors for {expected} indexed reports")
+    elif not manifest["chunked"] and vectors != expected:
+        problems.append(f"{vectors} vectors for {expected} indexed reports")
+    if manifest["source"]["reports"] and not indexed:
+        problems.append("no reports indexed")
+
+    # Every sampled vector has to come back as its own nearest neighbour
+    dims, misses, probes = set(), [], 0
+    step = max(vectors // PROBE_SAMPLES, 1)
+    for offset in range(0, min(vectors, step * PROBE_SAMPLES), step):
+        entry = collection.get(limit=1, offset=offset, include=["embeddings"])
+        if not entry["ids"]:
+            continue
+        vector = np.asarray(entry["embeddings"][0], dtype=np.float32)
+        dims.add(int(vector.shape[0]))
+        result = collection.query(query_embeddings=[vector.tolist()], n_results=1, include=["distances"])
+        probes += 1
+        if not result["distances"][0] or result["distances"][0][0] > PROBE_MAX_DISTANCE:
+            misses.append(entry["ids"][0])
+    if misses:
+        problems.append(f"{len(misses)} of {probes} probe vectors not found by search (e.g. {misses[0]})")
+    if len(dims) > 1:
+        problems.append(f"mixed embedding dimensions {sorted(dims)}")
+
+    fts_rows = manifest["aux"].get(FTS_TABLE)
+    if fts_rows is not None and fts_rows != manifest["source"]["reports"]:
+        problems.append(f"FTS index holds {fts_rows} rows for {manifest['source']['reports']} reports")
+
+    results = {"ok": not problems, "vectors": vectors, "indexed_reports": indexed, "duplicates": members,
+               "dim": dims.pop() if len(dims) == 1 else None, "probes": probes, "problems": problems}
+    if problems:
+        raise ValueError("Snapshot failed validation: " + "; ".join(problems))
+    return results
+
+
+def build_snapshot(db_path, root, backend="chroma", chunked=False, dedup=False, persist_dir=None,
+                   from_scratch=False, api_base=None, dtype="float16", **indexer_options):
+    """
+    Index db_path into a new staging directory, validate it and publish it under root; returns the
+    Snapshot (not yet active).  A failed build leaves its staging directory for inspection.
+    """
+    start = time.time()
+    os.makedirs(root, exist_ok=True)
+    fingerprint = source_fingerprint(db_path)
+    version = time.strftime("%Y%m%d-%H%M%S", time.gmtime()) + "-" + fingerprint["digest"][:8]
+    staging = os.path.join(root, STAGING_PREFIX + version)
+
+    base = None if from_scratch else active_snapshot(root)
+    if base is not None and base.mismatches(backend, chunked, dedup):
+        print(f"Active snapshot {base.version} was built with other settings, building from scratch")
+        base = None
+    if base is not None:
+        print(f"Building snapshot {version} from {base.version}")
+        shutil.copytree(base.path, staging, ignore=shutil.ignore_patterns(MANIFEST_FILE, AUX_FILE))
+    else:
+        print(f"Building snapshot {version}")
+        os.makedirs(staging)
+
+    # The side tables are indexed into the staging aux.sqlite3, never into the serving database.
+    # The base snapshot's match its index state, so only what changed since is applied to them.
+    aux_path = os.path.join(staging, AUX_FILE)
+    export_aux(base.aux_path if base is not None and base.serves_side_tables else db_path, aux_path)
+
+    embedding_function = make_embedding_function(persist_dir or os.path.dirname(os.path.abspath(root)), api_base=api_base)
+    collection = open_store(staging, backend, embedding_function, chunked=chunked, dtype=dtype)
+    stats = IncrementalIndexer(
+        collection, db_path, os.path.join(staging, STATE_FILE), embedding_function=embedding_function,
+        chunked=chunked, dedup=dedup, side_db_path=aux_path, **indexer_options
+    ).run()
+    if stats["failed"]:
+        raise RuntimeError(f"{stats['failed']} reports failed to index; staging directory left in {staging}")
+
+    manifest = {
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "parent": base.version if base is not None else None,
+        "backend": backend,
+        "chunked": chunked,
+        "dedup": dedup,
+        "embedding_model": EMBEDDING_MODEL,
+        "source": dict(fingerprint, db=os.path.abspath(db_path)),
+        "side_tables": "snapshot",
+        "aux": aux_counts(aux_path),
+        "index": {k: v for k, v in stats.items() if k != "changed_models"},
+    }
+    try:
+        manifest["validation"] = validate_snapshot(staging, collection, manifest)
+    except ValueError as e:
+        raise ValueError(f"{e}; staging directory left in {staging}") from None
+    manifest["build_seconds"] = round(time.time() - start, 2)
+    _write_json(os.path.join(staging, MANIFEST_FILE), manifest)
+    os.rename(staging, os.path.join(root, version))
+    print(f"Published snapshot {version}: {manifest['validation']['vectors']} vectors, "
+          f"{manifest['validation']['indexed_reports']} reports in {manifest['build_seconds']}s")
+    return Snapshot(os.path.join(root, version))
+
+
+def activate(root, version, db_path=None, install=False):
+    """
+    Point current.json at version, remembering the one it replaces for rollback.  With db_path
+    the serving database is compared with the snapshot's source (a mismatch is only reported: the
+    database may simply have new reports since the build); install also loads aux.sqlite3 into it.
+    """
+    snapshot = Snapshot(os.path.join(root, version))
+    if not snapshot.manifest.get("validation", {}).get("ok"):
+        raise ValueError(f"Snapshot {version} has not passed validation")
+    if db_path and os.path.exists(db_path):
+        built_from, serving = snapshot.manifest["source"], source_fingerprint(db_path)
+        if serving["digest"] != built_from["digest"]:
+            print(f"Note: the serving database differs from the snapshot's source "
+                  f"({serving['reports']} reports up to rowid {serving['max_rowid']}, snapshot built from "
+                  f"{built_from['reports']} up to rowid {built_from['max_rowid']})")
+        if install:
+            install_aux(snapshot.aux_path, db_path)
+    pointer = read_pointer(root)
+    if pointer.get("version") == version:
+        print(f"Snapshot {version} is already active")
+        return snapshot
+    _write_json(os.path.join(root, POINTER_FILE),
+                {"version": version, "previous": pointer.get("version"), "activated_at": time.time()})
+    print(f"Activated snapshot {version} (previous: {pointer.get('version') or 'none'})")
+    return snapshot
+
+
+def rollback(root):
+    """Re-activate the previous snapshot (running rollback again goes forward again)"""
+    previous = read_pointer(root).get("previous")
+    if not previous:
+        raise ValueError("No previous snapshot to roll back to")
+    return activate(root, previous)
+
+
+def prune(root, keep=3):
+    """Delete all but the newest keep snapshots (never the active or previous one) and stale staging directories"""
+    pointer = read_pointer(root)
+    protected = {pointer.get("version"), pointer.get("previous")}
+    versions = list_snapshots(root)
+    removed = [v for v in versions[:max(len(versions) - keep, 0)] if v not in protected]
+    now = time.time()
+    removed += [
+        name for name in os.listdir(root) if name.startswith(STAGING_PREFIX)
+        and now - os.path.getmtime(os.path.join(root, name)) > STALE_STAGING_SECONDS
+    ] if os.path.isdir(root) else []
+    for name in removed:
+        shutil.rmtree(os.path.join(root, name))
+        print(f"Removed {name}")
+    return removed
+
+
+class SnapshotWatcher:
+    """
+    Polls current.json on a daemon thread and calls on_switch(Snapshot) when it names another
+    version.  If on_switch raises (e.g. the snapshot was built with other settings) the error is
+    kept for status() and the snapshot being served stays in place.
+    """
+
+    def __init__(self, root, on_switch, interval=5.0):
+        self.root = root
+        self.on_switch = on_switch
+        self.interval = interval
+        self.version = None  # The version last handed to on_switch
+        self.switches = 0
+        self.error = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def check(self):
+        """Switch if the pointer names a new version; returns True if it did"""
+        try:
+            version = read_pointer(self.root).get("version")
+        except ValueError as e:
+            self.error = f"unreadable {POINTER_FILE}: {e}"
+            return False
+        if not version or version == self.version:
+            return False
+        self.version = version
+        try:
+            self.on_switch(Snapshot(os.path.join(self.root, version)))
+        except Exception as e:
+            self.error = f"{version}: {e}"
+            print(f"Could not switch to index snapshot {version}: {e}")
+            return False
+        self.error = None
+        self.switches += 1
+        return True
+
+    def start(self):
+        """Start polling (once); the first check runs right away"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="snapshot-watcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.check()
+            time.sleep(self.interval)
+
+    def status(self):
+        return {"version": self.version, "switches": self.switches, "error": self.error}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, activate and roll back index snapshots")
+    parser.add_argument("--root", default=None, help="Snapshot directory (defaults to <VECTOR_DB_DIR>/snapshots)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Index into a new snapshot, validate and publish it")
+    build.add_argument("--db", default=os.getenv("HAAS_DB_PATH") or DEFAULT_DB_PATH, help="Path to masterData.sqlite3")
+    build.add_argument("--backend", default=os.getenv("VECTOR_BACKEND", "chroma"), choices=["chroma", "mmap"])
+    build.add_argument("--chunked", action="store_true", default=os.getenv("CHUNKED_RETRIEVAL") == "1")
+    build.add_argument("--dedup", action="store_true", default=os.getenv("DEDUP_REPORTS") == "1")
+    build.add_argument("--from-scratch", action="store_true", help="Don't start from a copy of the active snapshot")
+    build.add_argument("--workers", type=int, default=4, help="Concurrent embedding requests")
+    build.add_argument("--api-base", default=os.getenv("OPENAI_BASE_URL"), help="Embeddings API base URL")
+    build.add_argument("--activate", action="store_true", help="Activate the snapshot once it is published")
+
+    activate_cmd = commands.add_parser("activate", help="Switch serving to a published snapshot")
+    activate_cmd.add_argument("version")
+    activate_cmd.add_argument("--db", default=os.getenv("HAAS_DB_PATH") or DEFAULT_DB_PATH,
+                              help="Serving database to compare with (and install side tables into)")
+    activate_cmd.add_argument("--install-aux", action="store_true", help="Load the snapshot's side tables into --db")
+
+    commands.add_parser("rollback", help="Switch back to the previously active snapshot")
+    commands.add_parser("list", help="Show published snapshots")
+    prune_cmd = commands.add_parser("prune", help="Delete old snapshots")
+    prune_cmd.add_argument("--keep", type=int, default=3)
+    args = parser.parse_args()
+
+    root = args.root or default_root()
+    if args.command == "build":
+        snapshot = build_snapshot(args.db, root, backend=args.backend, chunked=args.chunked, dedup=args.dedup,
+                                  from_scratch=args.from_scratch, api_base=args.api_base, max_workers=args.workers)
+        if args.activate:
+            activate(root, snapshot.version)
+    elif args.command == "activate":
+        activate(root, args.version, db_path=args.db, install=args.install_aux)
+    elif args.command == "rollback":
+        rollback(root)
+    elif args.command == "prune":
+        prune(root, keep=args.keep)
+    else:
+        pointer = read_pointer(root)
+        for version in list_snapshots(root):
+            manifest = Snapshot(os.path.join(root, version)).manifest
+            marker = "*" if version == pointer.get("version") else ("-" if version == pointer.get("previous") else " ")
+            print(f"{marker} {version}  {manifest['backend']}{' chunked' if manifest['chunked'] else ''}"
+                  f"{' dedup' if manifest['dedup'] else ''}  {manifest['validation']['vectors']} vectors  "
+                  f"{manifest['source']['reports']} reports  built {manifest['created_at']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,8 @@ document.addEventListener("DOMContentLoaded", () => {
   let isConversationModified = false;
   // Flag to indicate if a conversation was loaded from storage
   let isResumed = false;
+  // Server-side session for the active conversation; once it exists only new messages are sent
+  let activeSessionId = null;
   
   // Toggle sidebar open/closed
   toggleSidebarBtn.addEventListener("click", () => {
@@ -47,6 +49,7 @@ document.addEventListener("DOMContentLoaded", () => {
     activeModel = model;
     activeConversation = [];
     activeConversationId = Date.now();
+    activeSessionId = null;
     isConversationModified = false;
     isResumed = false;
     chatLog.innerHTML = "";
@@ -71,16 +74,8 @@ document.addEventListener("DOMContentLoaded", () => {
     isConversationModified = true;
     
     try {
-      // Send the model and conversation to the /chat endpoint
-      const response = await fetch("/chat", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ model: activeModel, conversation: activeConversation })
-      });
-      const data = await response.json();
-      const reply = data.response;
+      const reply = await sendMessage(message, activeConversation.slice(0, -1));
       activeConversation.push({ role: "assistant", content: reply });
-      appendMessage("assistant", reply);
       // If this conversation is already stored, update its snippet
       if (savedConversations.hasOwnProperty(activeConversationId)) {
         updateConversationInSidebar(activeConversationId, savedConversations[activeConversationId]);
@@ -90,6 +85,138 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   });
   
+  // Sends one message in the active session (starting one, seeded with the local history, if needed).
+  // Streams the reply token by token and falls back to the plain /chat endpoint only if streaming
+  // fails before the server sent anything; a stream cut off later keeps its partial reply.
+  async function sendMessage(message, history) {
+    const payload = { model: activeModel, message: message };
+    if (activeSessionId) {
+      payload.session_id = activeSessionId;
+    } else if (history.length) {
+      payload.conversation = history;
+    }
+    let result;
+    try {
+      result = await streamReply(payload);
+    } catch (streamError) {
+      result = await fetchReply(payload);
+    }
+    if (result.sessionExpired && activeSessionId) {
+      // The server forgot the session; start a new one from the local history
+      activeSessionId = null;
+      return sendMessage(message, history);
+    }
+    return result.reply;
+  }
+  
+  // Non-streaming request: waits for the whole answer and renders it at once
+  async function fetchReply(payload) {
+    const response = await fetch("/chat", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(payload)
+    });
+    const data = await response.json();
+    if (data.session_expired) {
+      return { reply: "", sessionExpired: true };
+    }
+    if (data.session_id) activeSessionId = data.session_id;
+    appendMessage("assistant", data.response);
+    return { reply: data.response, sessionExpired: false };
+  }
+  
+  // Streaming request against /chat/stream (Server-Sent Events over a POST body).
+  // Throws before rendering anything if streaming isn't available, so the caller can fall back.
+  // Once the first event has arrived the server is already answering, so a broken connection
+  // leaves the partial reply marked as interrupted instead of throwing (which would ask twice).
+  async function streamReply(payload) {
+    const response = await fetch("/chat/stream", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(payload)
+    });
+    if (!response.ok || !response.body) {
+      throw new Error("Streaming unavailable");
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let reply = "";
+    let contentDiv = null;
+    let started = false;
+    let finished = false;
+    
+    while (true) {
+      let chunk;
+      try {
+        chunk = await reader.read();
+      } catch (readError) {
+        if (!started) throw readError;
+        break;
+      }
+      if (chunk.done) break;
+      buffer += decoder.decode(chunk.value, { stream: true });
+      // SSE events are separated by a blank line
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        const event = parseEvent(rawEvent);
+        if (!event) continue;
+        started = true;
+        if (event.type === "meta") {
+          if (event.data.session_id) activeSessionId = event.data.session_id;
+          contentDiv = appendMessage("assistant", "");
+          if (event.data.report_ids && event.data.report_ids.length) {
+            contentDiv.dataset.reportIds = event.data.report_ids.join(",");
+            contentDiv.title = "Based on service reports: " + event.data.report_ids.join(", ");
+          }
+        } else if (event.type === "token") {
+          if (!contentDiv) contentDiv = appendMessage("assistant", "");
+          reply += event.data.text;
+          contentDiv.innerText = reply;
+          chatLog.scrollTop = chatLog.scrollHeight;
+        } else if (event.type === "error") {
+          if (event.data.session_expired) {
+            return { reply: "", sessionExpired: true };
+          }
+          if (!contentDiv) contentDiv = appendMessage("assistant", "");
+          reply = reply ? reply + "\n" + event.data.message : event.data.message;
+          contentDiv.innerText = reply;
+          finished = true;
+        } else if (event.type === "done") {
+          finished = true;
+        }
+      }
+    }
+    if (!started) {
+      throw new Error("Empty stream");
+    }
+    if (!contentDiv) contentDiv = appendMessage("assistant", "");
+    if (!finished) {
+      contentDiv.classList.add("interrupted");
+      contentDiv.innerText = reply + (reply ? "\n\n" : "") + "[Reply interrupted: connection lost]";
+      return { reply: reply.trim(), sessionExpired: false, interrupted: true };
+    }
+    return { reply: reply.trim(), sessionExpired: false };
+  }
+  
+  // Parses one "event: ...\ndata: ..." block
+  function parseEvent(rawEvent) {
+    let type = "message";
+    let data = "";
+    rawEvent.split("\n").forEach(line => {
+      if (line.startsWith("event:")) type = line.slice(6).trim();
+      else if (line.startsWith("data:")) data += line.slice(5).trim();
+    });
+    if (!data) return null;
+    try {
+      return { type: type, data: JSON.parse(data) };
+    } catch (e) {
+      return null;
+    }
+  }
+  
   // Appends a single message to the chat log
   function appendMessage(sender, message) {
     const messageDiv = document.createElement("div");
@@ -102,6 +229,7 @@ document.addEventListener("DOMContentLoaded", () => {
     messageDiv.appendChild(contentDiv);
     chatLog.appendChild(messageDiv);
     chatLog.scrollTop = chatLog.scrollHeight;
+    return contentDiv;
   }
   
   // Adds a conversation snippet to the sidebar
@@ -137,6 +265,7 @@ document.addEventListener("DOMContentLoaded", () => {
       activeModel = convo.model;
       activeConversation = convo.messages.slice();
       activeConversationId = convoId;
+      activeSessionId = null;
       isResumed = true;
       isConversationModified = false;
       chatLog.innerHTML = "";
@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+In-process, memory-mapped vector store for service report embeddings.
+
+An optional replacement for the Chroma PersistentClient: embeddings are kept as raw float16 (or
+int8 + per-row scale) matrices, one file per canonical machine model family, memory-mapped on
+demand, with ids and metadata in a small SQLite sidecar.  Queries are exact (no HNSW recall loss)
+vectorized NumPy top-k over only the partitions or rows the filter allows, optionally on the
+first search_dims dimensions (text-embedding-3 models are Matryoshka-trained, so truncated
+prefixes stay meaningful).
+
+MmapVectorStore implements the subset of the Chroma collection API the app uses (count, upsert,
+delete, get, query with $eq/$in/$and/$or filters), so it is selected with VECTOR_BACKEND=mmap.
+
+    python vector_store.py --import-chroma   # copy vectors out of the existing Chroma collection
+    python vector_store.py --compact         # drop rows left behind by updates and deletes
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from model_catalog import model_family
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(__file__), 'vectordb', 'mmap_store')
+
+DTYPES = {"float16": np.float16, "float32": np.float32, "int8": np.int8}
+
+# Metadata keys with their own indexed column; everything else lives in the JSON blob
+# (service_report_id is the vector's parent report: its own id, or the report a chunk came from)
+INDEXED_KEYS = {"model": "model", "serial": "serial", "date": "date", "service_report_id": "report_id"}
+
+
+def partition_key(model):
+    return model_family(model) or "_unknown"
+
+
+class _Partition:
+    """One model family: a row-major matrix file plus an id and model per row (id None for dead rows)"""
+
+    def __init__(self, path, dim, dtype):
+        self.path = path
+        self.dim = dim
+        self.dtype = dtype
+        self.ids_by_row = []
+        self.models_by_row = []
+        self.loaded_rows = 0
+        self._matrix = None
+        self._scales = None
+
+    @property
+    def scale_path(self):
+        return self.path + ".scale"
+
+    def rows_on_disk(self):
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // (self.dim * np.dtype(self.dtype).itemsize)
+
+    def matrix(self):
+        rows = self.rows_on_disk()
+        if rows == 0:
+            return None, None
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            self._matrix = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(rows, self.dim))
+            if self.dtype == np.int8:
+                self._scales = np.memmap(self.scale_path, dtype=np.float32, mode="r", shape=(rows,))
+        return self._matrix, self._scales
+
+    def append(self, vectors):
+        """vectors: float32 (n, dim), already normalized; returns the first new row number"""
+        first_row = self.rows_on_disk()
+        if self.dtype == np.int8:
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+            with open(self.path, "ab") as f:
+                f.write(quantized.tobytes())
+            with open(self.scale_path, "ab") as f:
+                f.write(scales.astype(np.float32).tobytes())
+        else:
+            with open(self.path, "ab") as f:
+                f.write(vectors.astype(self.dtype).tobytes())
+        self._matrix = None
+        return first_row
+
+    def scores(self, query, rows=None, search_dims=None):
+        """Cosine similarity of query against all rows (or the given row numbers)"""
+        matrix, scales = self.matrix()
+        if matrix is None:
+            return np.empty(0, dtype=np.float32)
+        if rows is not None:
+            matrix = matrix[rows]
+            scales = scales[rows] if scales is not None else None
+        dims = search_dims or self.dim
+        block = np.asarray(matrix[:, :dims], dtype=np.float32)
+        if scales is not None:
+            block *= np.asarray(scales, dtype=np.float32)[:, None]
+        sims = block @ query[:dims]
+        if search_dims and search_dims < self.dim:
+            # Stored rows are unit length at full dimension; renormalize the truncated prefix
+            norms = np.linalg.norm(block, axis=1)
+            norms[norms == 0] = 1.0
+            sims = sims / norms
+        return sims
+
+    def alive_mask(self, size, allowed_models=None):
+        """
+        Which of the first size rows are live (and of an allowed model).  Rows another process has
+        appended but not yet recorded in the sidecar have no id yet and count as dead.
+        """
+        ids = self.ids_by_row[:size]
+        models = self.models_by_row[:size]
+        if allowed_models is None:
+            alive = [vid is not None for vid in ids]
+        else:
+            # A family partition can hold sibling models (VF-4 / VF-4SS) the filter excludes
+            alive = [vid is not None and model in allowed_models for vid, model in zip(ids, models)]
+        return np.array(alive + [False] * (size - len(alive)), dtype=bool)
+
+
+class MmapVectorStore:
+    def __init__(self, path=DEFAULT_STORE_DIR, embedding_function=None, dtype="float16", search_dims=None):
+        self.path = path
+        self.embedding_function = embedding_function
+        self.search_dims = search_dims
+        self._lock = threading.RLock()
+        os.makedirs(os.path.join(path, "partitions"), exist_ok=True)
+
+        self.conn = sqlite3.connect(os.path.join(path, "store.sqlite3"), check_same_thread=False)
+        self.conn.executescript("""
+        CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS vectors (
+            id TEXT PRIMARY KEY,
+            partition TEXT NOT NULL,
+            row INTEGER NOT NULL,
+            model TEXT,
+            serial TEXT,
+            date TEXT,
+            metadata TEXT,
+            document TEXT,
+            report_id TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_vectors_partition_row ON vectors(partition, row);
+        CREATE INDEX IF NOT EXISTS idx_vectors_serial ON vectors(serial);
+        CREATE INDEX IF NOT EXISTS idx_vectors_model ON vectors(model);
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(vectors)")}
+        if "report_id" not in columns:
+            # Stores written before chunked indexing: every vector was a whole report
+            self.conn.execute("ALTER TABLE vectors ADD COLUMN report_id TEXT")
+            self.conn.execute("UPDATE vectors SET report_id = id")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_vectors_report_id ON vectors(report_id)")
+        self.conn.commit()
+
+        stored_dtype = self._setting("dtype")
+        if stored_dtype is None:
+            self._set_setting("dtype", dtype)
+            stored_dtype = dtype
+        self.dtype = DTYPES[stored_dtype]
+        dim = self._setting("dim")
+        self.dim = int(dim) if dim else None
+        self._partitions = {}
+        self._generation = self._stored_generation()
+
+    # -- settings and partitions -------------------------------------------------------------
+
+    def _setting(self, key):
+        row = self.conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_setting(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
+        self.conn.commit()
+
+    # Several processes share a store (the app, the indexer cron, other workers).  Every write
+    # bumps a generation counter in the sidecar; a store whose in-memory row metadata was loaded at
+    # an older generation (or for a different number of rows on disk) re-reads it.
+
+    def _stored_generation(self):
+        value = self._setting("generation")
+        return int(value) if value else 0
+
+    def _begin_write(self):
+        """
+        Bump the generation as the first write of the transaction, which takes SQLite's write lock
+        and so also serializes matrix appends across processes.  Cached partitions are kept only
+        if nobody else wrote since they were loaded.
+        """
+        self.conn.execute(
+            "INSERT INTO settings (key, value) VALUES ('generation', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+        generation = self._stored_generation()
+        if generation != self._generation + 1:
+            self._partitions = {}
+            if self.dim is None:
+                dim = self._setting("dim")
+                self.dim = int(dim) if dim else None
+        self._generation = generation
+
+    def _refresh(self):
+        """Drop row metadata that other processes have changed since it was loaded"""
+        generation = self._stored_generation()
+        if generation != self._generation:
+            self._partitions = {}
+            self._generation = generation
+            if self.dim is None:
+                dim = self._setting("dim")
+                self.dim = int(dim) if dim else None
+
+    def _partition(self, name):
+        partition = self._partitions.get(name)
+        if partition is None or partition.loaded_rows != partition.rows_on_disk():
+            safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+            partition = _Partition(os.path.join(self.path, "partitions", safe + ".bin"), self.dim, self.dtype)
+            rows = partition.rows_on_disk()
+            partition.ids_by_row = [None] * rows
+            partition.models_by_row = [None] * rows
+            partition.loaded_rows = rows
+            for vector_id, row, model in self.conn.execute(
+                "SELECT id, row, model FROM vectors WHERE partition = ?", (name,)
+            ):
+                if row < rows:
+                    partition.ids_by_row[row] = vector_id
+                    partition.models_by_row[row] = model
+            self._partitions[name] = partition
+        return partition
+
+    def partitions(self):
+        with self._lock:
+            return [r[0] for r in self.conn.execute("SELECT DISTINCT partition FROM vectors")]
+
+    # -- Chroma-compatible API ---------------------------------------------------------------
+
+    def count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def _embed(self, texts):
+        if self.embedding_function is None:
+            raise ValueError("MmapVectorStore needs an embedding_function to embed texts")
+        return self.embedding_function(list(texts))
+
+    def upsert(self, ids, embeddings=None, documents=None, metadatas=None):
+        if embeddings is None:
+            embeddings = self._embed(documents)
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms[:, None]
+        metadatas = metadatas or [{} for _ in ids]
+        documents = documents or [None for _ in ids]
+
+        with self._lock:
+            self._begin_write()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                # Committed with the vectors, so the write lock is held until they are recorded
+                self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('dim', ?)", (str(self.dim),))
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {self.dim}")
+
+            self._forget_rows(ids)
+
+            groups = {}
+            for i, metadata in enumerate(metadatas):
+                groups.setdefault(partition_key(metadata.get("model")), []).append(i)
+
+            rows = []
+            for name, indexes in groups.items():
+                partition = self._partition(name)
+                first_row = partition.append(vectors[indexes])
+                partition.loaded_rows = first_row + len(indexes)
+                for offset, i in enumerate(indexes):
+                    metadata = metadatas[i]
+                    partition.ids_by_row.append(ids[i])
+                    partition.models_by_row.append(metadata.get("model"))
+                    rows.append((
+                        ids[i], name, first_row + offset,
+                        metadata.get("model"), metadata.get("serial"), metadata.get("date"),
+                        json.dumps(metadata), documents[i], str(metadata.get("service_report_id", ids[i]))
+                    ))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO vectors (id, partition, row, model, serial, date, metadata, document, report_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self.conn.commit()
+
+    add = upsert
+
+    def _forget_rows(self, ids):
+        """Tombstone the current rows of ids (the caller commits)"""
+        for start in range(0, len(ids), 500):
+            chunk = list(ids[start:start + 500])
+            placeholders = ",".join("?" * len(chunk))
+            for partition_name, row in self.conn.execute(
+                f"SELECT partition, row FROM vectors WHERE id IN ({placeholders})", chunk
+            ).fetchall():
+                partition = self._partition(partition_name)
+                if row < len(partition.ids_by_row):
+                    partition.ids_by_row[row] = None
+            self.conn.execute(f"DELETE FROM vectors WHERE id IN ({placeholders})", chunk)
+
+    def delete(self, ids=None, where=None):
+        with self._lock:
+            self._begin_write()
+            if ids is None and where is not None:
+                sql, params = self._where_sql(where)
+                ids = [r[0] for r in self.conn.execute(f"SELECT id FROM vectors WHERE {sql}", params)]
+            self._forget_rows(list(ids or []))
+            self.conn.commit()
+
+    def _where_sql(self, where):
+        """Translate the Chroma where subset ($eq/$ne/$in/$nin/$and/$or) to SQL over the sidecar"""
+        if not where:
+            return "1", []
+        clauses = []
+        params = []
+        for key, value in where.items():
+            if key in ("$and", "$or"):
+                parts = [self._where_sql(w) for w in value]
+                joiner = " AND " if key == "$and" else " OR "
+                clauses.append("(" + joiner.join(p[0] for p in parts) + ")")
+                for p in parts:
+                    params.extend(p[1])
+                continue
+            column = INDEXED_KEYS.get(key)
+            if column is None:
+                column = f"json_extract(metadata, '$.{key}')"
+            if not isinstance(value, dict):
+                value = {"$eq": value}
+            for op, operand in value.items():
+                if op == "$eq":
+                    clauses.append(f"{column} = ?")
+                    params.append(operand)
+                elif op == "$ne":
+                    clauses.append(f"{column} != ?")
+                    params.append(operand)
+                elif op in ("$in", "$nin"):
+                    if not operand:
+                        clauses.append("0" if op == "$in" else "1")
+                        continue
+                    placeholders = ",".join("?" * len(operand))
+                    clauses.append(f"{column} {'IN' if op == '$in' else 'NOT IN'} ({placeholders})")
+                    params.extend(operand)
+                else:
+                    raise ValueError(f"Unsupported filter operator {op}")
+        return " AND ".join(clauses) or "1", params
+
+    @staticmethod
+    def _model_only_filter(where):
+        """Models named by a filter that only constrains model, else None"""
+        if not where or set(where) != {"model"}:
+            return None
+        value = where["model"]
+        if isinstance(value, str):
+            return [value]
+        if isinstance(value, dict) and set(value) <= {"$eq", "$in"}:
+            return value.get("$in") or [value.get("$eq")]
+        return None
+
+    def _search_one(self, query, n_results, where):
+        scored = []  # (similarity, id)
+        models = self._model_only_filter(where)
+        if where is None or models is not None:
+            # Whole partitions: every model family, or only those the filter names
+            names = self.partitions() if models is None else sorted({partition_key(m) for m in models})
+            allowed_models = set(models) if models is not None else None
+            for name in names:
+                partition = self._partition(name)
+                sims = partition.scores(query, search_dims=self.search_dims)
+                if sims.size == 0:
+                    continue
+                sims = np.where(partition.alive_mask(sims.size, allowed_models), sims, -np.inf)
+                k = min(n_results, sims.size)
+                top = np.argpartition(-sims, k - 1)[:k]
+                for row in top:
+                    if np.isfinite(sims[row]):
+                        scored.append((float(sims[row]), partition.ids_by_row[row]))
+        else:
+            # Arbitrary filter: resolve matching rows in SQL, score only those rows
+            sql, params = self._where_sql(where)
+            by_partition = {}
+            for vector_id, name, row in self.conn.execute(f"SELECT id, partition, row FROM vectors WHERE {sql}", params):
+                by_partition.setdefault(name, ([], []))
+                by_partition[name][0].append(row)
+                by_partition[name][1].append(vector_id)
+            for name, (rows, ids) in by_partition.items():
+                sims = self._partition(name).scores(query, rows=np.array(rows), search_dims=self.search_dims)
+                scored.extend(zip(sims.tolist(), ids))
+
+        scored.sort(key=lambda s: s[0], reverse=True)
+        return scored[:n_results]
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, where=None,
+              include=("metadatas", "documents", "distances")):
+        if query_embeddings is None:
+            query_embeddings = self._embed(query_texts)
+        results = {"ids": [], "distances": [], "metadatas": [], "documents": []}
+        with self._lock:
+            self._refresh()
+            if self.dim is None:
+                return {key: [[] for _ in query_embeddings] for key in results}
+            for query in query_embeddings:
+                query = np.asarray(query, dtype=np.float32)
+                norm = np.linalg.norm(query[:self.search_dims or self.dim])
+                query = query / (norm or 1.0)
+                top = self._search_one(query, n_results, where)
+                ids = [vid for _, vid in top]
+                results["ids"].append(ids)
+                results["distances"].append([1.0 - sim for sim, _ in top])
+                details = {}
+                if ids and ("metadatas" in include or "documents" in include):
+                    placeholders = ",".join("?" * len(ids))
+                    for vid, metadata, document in self.conn.execute(
+                        f"SELECT id, metadata, document FROM vectors WHERE id IN ({placeholders})", ids
+                    ):
+                        details[vid] = (json.loads(metadata) if metadata else {}, document)
+                results["metadatas"].append([details.get(vid, ({}, None))[0] for vid in ids])
+                results["documents"].append([details.get(vid, ({}, None))[1] for vid in ids])
+        return results
+
+    def get(self, ids=None, limit=None, offset=0, include=("metadatas", "documents")):
+        """Stored entries by id, or a page of them in id order; "embeddings" returns the stored (unit) vectors"""
+        with self._lock:
+            self._refresh()
+            columns = "SELECT id, partition, row, metadata, document FROM vectors"
+            if ids is not None:
+                found = {}
+                for start in range(0, len(ids), 500):
+                    chunk = [str(i) for i in ids[start:start + 500]]
+                    for entry in self.conn.execute(f"{columns} WHERE id IN ({','.join('?' * len(chunk))})", chunk):
+                        found[entry[0]] = entry
+                rows = [found[str(i)] for i in ids if str(i) in found]
+            else:
+                rows = self.conn.execute(
+                    f"{columns} ORDER BY id LIMIT ? OFFSET ?", (-1 if limit is None else limit, offset)
+                ).fetchall()
+            results = {"ids": [r[0] for r in rows]}
+            if "embeddings" in include:
+                embeddings = []
+                for _, name, row, _, _ in rows:
+                    matrix, scales = self._partition(name).matrix()
+                    vector = np.asarray(matrix[row], dtype=np.float32)
+                    embeddings.append(vector * scales[row] if scales is not None else vector)
+                results["embeddings"] = embeddings
+            if "metadatas" in include:
+                results["metadatas"] = [json.loads(r[3]) if r[3] else {} for r in rows]
+            if "documents" in include:
+                results["documents"] = [r[4] for r in rows]
+        return results
+
+    # -- maintenance -------------------------------------------------------------------------
+
+    def compact(self):
+        """Rewrite every partition with only its live rows"""
+        with self._lock:
+            self._begin_write()
+            for name in self.partitions():
+                partition = self._partition(name)
+                matrix, scales = partition.matrix()
+                if matrix is None:
+                    continue
+                live = [(row, vid) for row, vid in enumerate(partition.ids_by_row) if vid is not None]
+                live_models = [partition.models_by_row[row] for row, _ in live]
+                rows = np.array([row for row, _ in live], dtype=np.int64)
+                data = np.array(matrix[rows])
+                scale_data = np.array(scales[rows]) if scales is not None else None
+                partition._matrix = partition._scales = None
+                with open(partition.path + ".tmp", "wb") as f:
+                    f.write(data.tobytes())
+                os.replace(partition.path + ".tmp", partition.path)
+                if scale_data is not None:
+                    with open(partition.scale_path + ".tmp", "wb") as f:
+                        f.write(scale_data.tobytes())
+                    os.replace(partition.scale_path + ".tmp", partition.scale_path)
+                self.conn.executemany(
+                    "UPDATE vectors SET row = ? WHERE id = ?",
+                    [(new_row, vid) for new_row, (_, vid) in enumerate(live)]
+                )
+                partition.ids_by_row = [vid for _, vid in live]
+                partition.models_by_row = live_models
+                partition.loaded_rows = len(live)
+            self.conn.commit()
+
+    def stats(self):
+        size = 0
+        for name in os.listdir(os.path.join(self.path, "partitions")):
+            size += os.path.getsize(os.path.join(self.path, "partitions", name))
+        return {
+            "vectors": self.count(),
+            "partitions": len(self.partitions()),
+            "dim": self.dim,
+            "dtype": np.dtype(self.dtype).name,
+            "search_dims": self.search_dims,
+            "matrix_bytes": size,
+        }
+
+
+def import_from_chroma(store, collection, batch_size=1000):
+    """Copy every vector, document and metadata out of a Chroma collection"""
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        batch = collection.get(limit=batch_size, offset=offset, include=["embeddings", "metadatas", "documents"])
+        if not batch["ids"]:
+            break
+        store.upsert(batch["ids"], embeddings=batch["embeddings"], documents=batch["documents"],
+                     metadatas=batch["metadatas"])
+        print(f"Imported {min(offset + batch_size, total)} of {total} vectors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the memory-mapped vector store")
+    parser.add_argument("--path", default=DEFAULT_STORE_DIR, help="Store directory")
+    parser.add_argument("--dtype", default="float16", choices=sorted(DTYPES), help="Storage type for a new store")
+    parser.add_argument("--import-chroma", action="store_true", help="Copy vectors from the Chroma collection")
+    parser.add_argument("--compact", action="store_true", help="Drop dead rows left by updates and deletes")
+    args = parser.parse_args()
+
+    store = MmapVectorStore(args.path, dtype=args.dtype)
+    if args.import_chroma:
+        from indexer import open_collection
+        import_from_chroma(store, open_collection())
+    if args.compact:
+        store.compact()
+    print(store.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The app's modules import each other as siblings, like when run from chatbot_ui/
+sys.path.insert(0, os.path.join(ROOT, "chatbot_ui"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+# HaasServiceAssistant.py sits at the top level
+sys.path.insert(0, ROOT)
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def stub():
+    """The benchmarks' local OpenAI stand-in, without simulated latency"""
+    from stub_openai import StubConfig, StubOpenAIServer
+    server = StubOpenAIServer(config=StubConfig(
+        embedding_latency=0, embedding_latency_per_input=0, chat_latency=0, token_latency=0, answer_tokens=8, seed=0
+    )).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope="session")
+def synthetic_db(tmp_path_factory):
+    """A small synthetic masterData.sqlite3 with its side tables built"""
+    from synthetic_db import generate, prepare
+    path = str(tmp_path_factory.mktemp("data") / "masterData.sqlite3")
+    generate(path, reports=300, machines=20, seed=0)
+    prepare(path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def app_module(synthetic_db, stub, tmp_path_factory):
+    """The Flask app over the synthetic database and the stub (it reads its settings at import time)"""
+    state = tmp_path_factory.mktemp("state")
+    os.environ.update({
+        "HAAS_DB_PATH": synthetic_db,
+        "VECTOR_DB_DIR": str(state / "vectordb"),
+        "VECTOR_BACKEND": "mmap",
+        "INDEX_ON_STARTUP": "0",
+        "ANSWER_CACHE_SIZE": "0",
+        "SESSION_DB_PATH": str(state / "sessions.sqlite3"),
+        "OPENAI_BASE_URL": stub.base_url,
+        "OPENAI_API_KEY": "stub",
+    })
+    import app
+    app.index_service_reports()
+    return app
@@ -0,0 +1,17 @@
+from answer_cache import SemanticAnswerCache
+
+QUESTION = [{"role": "user", "content": "spindle won't orient"}]
+
+
+def test_answers_are_keyed_on_the_exact_model():
+    cache = SemanticAnswerCache(max_entries=10, ttl_seconds=60, threshold=0.9)
+    cache.store("VF-4SS", "", QUESTION, [1.0, 0.0], "check the 4SS orientation sensor")
+    assert cache.lookup("vf 4ss", "", QUESTION, [1.0, 0.01]) == "check the 4SS orientation sensor"
+    assert cache.lookup("VF-4", "", QUESTION, [1.0, 0.0]) is None
+
+
+def test_indexing_a_model_invalidates_its_family():
+    cache = SemanticAnswerCache(max_entries=10, ttl_seconds=60, threshold=0.9)
+    cache.store("VF-4SS", "", QUESTION, [1.0, 0.0], "answer")
+    cache.invalidate_model("VF-4")
+    assert cache.lookup("VF-4SS", "", QUESTION, [1.0, 0.0]) is None
@@ -0,0 +1,35 @@
+import asyncio
+import sqlite3
+import threading
+
+
+def test_chat_runs_blocking_steps_off_the_event_loop(app_module, synthetic_db, monkeypatch):
+    import asgi
+    model = sqlite3.connect(synthetic_db).execute("SELECT Model FROM ServiceReports LIMIT 1").fetchone()[0]
+    loop_threads = set()
+    resolve_threads = []
+    resolve_chat = asgi.resolve_chat
+
+    def recording_resolve_chat(data):
+        resolve_threads.append(threading.get_ident())
+        return resolve_chat(data)
+    monkeypatch.setattr(asgi, "resolve_chat", recording_resolve_chat)
+    index_check_threads = []
+    vector_index_ready = asgi.vector_index_ready
+
+    def recording_vector_index_ready():
+        index_check_threads.append(threading.get_ident())
+        return vector_index_ready()
+    monkeypatch.setattr(asgi, "vector_index_ready", recording_vector_index_ready)
+
+    async def run():
+        loop_threads.add(threading.get_ident())
+        first = await asgi.chat({"model": model, "message": "spindle overheating"})
+        second = await asgi.chat({"session_id": first["session_id"], "message": "and the coolant pump?"})
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first["response"] and second["response"]
+    assert first["session_id"] == second["session_id"]
+    assert resolve_threads and not loop_threads & set(resolve_threads)
+    assert index_check_threads and not loop_threads & set(index_check_threads)
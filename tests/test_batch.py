@@ -0,0 +1,53 @@
+import json
+import sqlite3
+
+from HaasServiceAssistant import SpecializedGPTAgent, run_batch
+
+
+def make_agent(monkeypatch, stub, synthetic_db):
+    monkeypatch.setenv("OPENAI_BASE_URL", stub.base_url)
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    return SpecializedGPTAgent(synthetic_db)
+
+
+def busiest_model(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT Model FROM ServiceReports GROUP BY Model ORDER BY COUNT(*) DESC LIMIT 1"
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_context_is_packed_within_the_token_budget(monkeypatch, stub, synthetic_db):
+    agent = make_agent(monkeypatch, stub, synthetic_db)
+    agent.context_packer.max_prompt_tokens = 800
+    model = busiest_model(synthetic_db)
+    context = agent.build_context(model)
+    messages = agent.build_messages(context, model, "spindle overheating alarm")
+    prompt = "".join(m["content"] for m in messages)
+    assert agent.context_packer.tokenizer.count(prompt) <= 800
+    included = [c["id"] for c in context if f"Service Report ID: {c['id']}\n" in prompt]
+    assert 0 < len(included) < len(context)
+    assert agent.build_messages([], "NO-SUCH", "noise")[1]["content"].startswith("No service reports found")
+
+
+def test_rerun_counts_only_input_tickets_already_done(monkeypatch, stub, synthetic_db, tmp_path):
+    agent = make_agent(monkeypatch, stub, synthetic_db)
+    model = busiest_model(synthetic_db)
+    tickets = tmp_path / "tickets.jsonl"
+    output = tmp_path / "results.jsonl"
+    tickets.write_text("".join(
+        json.dumps({"id": f"t{i}", "model": model, "symptoms": "coolant leak"}) + "\n" for i in range(3)
+    ))
+    # Answers from an earlier batch with other tickets are in the same output file
+    output.write_text(json.dumps({"ticket_id": "other", "status": "ok"}) + "\n")
+
+    stats = run_batch(agent, str(tickets), str(output), concurrency=2)
+    assert (stats["skipped"], stats["total"], stats["ok"]) == (0, 3, 3)
+
+    with open(tickets, "a") as f:
+        f.write(json.dumps({"id": "t3", "model": model, "symptoms": "coolant leak"}) + "\n")
+    stats = run_batch(agent, str(tickets), str(output), concurrency=2)
+    assert (stats["skipped"], stats["total"], stats["ok"]) == (3, 1, 1)
@@ -0,0 +1,31 @@
+import sqlite3
+
+import pytest
+
+from db_pool import ConnectionManager, enable_wal
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "masterData.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE ServiceReports (ServiceReport_id INTEGER)")
+    conn.execute("INSERT INTO ServiceReports VALUES (1)")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_pool_leaves_the_journal_mode_alone(database):
+    manager = ConnectionManager(database)
+    assert manager.connection().execute("SELECT COUNT(*) FROM ServiceReports").fetchone()[0] == 1
+    assert manager.stats()["journal_mode"] == "delete"
+    with pytest.raises(sqlite3.OperationalError):
+        manager.connection().execute("INSERT INTO ServiceReports VALUES (2)")
+
+
+def test_pool_reports_wal_after_bootstrap(database):
+    enable_wal(database)
+    manager = ConnectionManager(database)
+    assert manager.connection().execute("SELECT COUNT(*) FROM ServiceReports").fetchone()[0] == 1
+    assert manager.stats()["journal_mode"] == "wal"
@@ -0,0 +1,44 @@
+import sqlite3
+
+from hybrid_search import HybridRetriever
+
+
+class EmptyCollection:
+    def __init__(self):
+        self.wheres = []
+
+    def query(self, n_results, where=None, include=None, **kwargs):
+        self.wheres.append(where)
+        return {"ids": [[]], "distances": [[]]}
+
+
+def traced(db_path):
+    conn = sqlite3.connect(db_path)
+    statements = []
+    conn.set_trace_callback(statements.append)
+    return conn, statements
+
+
+def like_scans(statements):
+    return [s for s in statements if "SELECT DISTINCT Model" in s]
+
+
+def test_models_without_a_catalog_come_from_the_candidate_rows(synthetic_db):
+    collection = EmptyCollection()
+    retriever = HybridRetriever(collection, mmr_lambda=1)
+    conn, statements = traced(synthetic_db)
+    model = conn.execute("SELECT Model FROM ServiceReports LIMIT 1").fetchone()[0]
+    retriever.search(conn, "spindle alarm", model=model, query_embedding=[1.0, 0.0])
+    assert not like_scans(statements)
+    assert collection.wheres[-1]["service_report_id"]["$in"]
+
+
+def test_broad_model_filters_scan_for_models_once_per_input(synthetic_db):
+    collection = EmptyCollection()
+    retriever = HybridRetriever(collection, max_candidate_ids=1, mmr_lambda=1)
+    conn, statements = traced(synthetic_db)
+    for _ in range(3):
+        retriever.search(conn, "spindle alarm", model="VF", query_embedding=[1.0, 0.0])
+    assert len(like_scans(statements)) == 1
+    models = collection.wheres[-1]["model"]["$in"]
+    assert models and all("VF" in m for m in models)
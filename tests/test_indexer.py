@@ -0,0 +1,119 @@
+import sqlite3
+
+import pytest
+
+from indexer import IncrementalIndexer, IndexState
+from stub_openai import hashed_embedding
+from synthetic_db import generate
+from vector_store import MmapVectorStore
+
+
+class StubEmbeddings:
+    """The stub server's hashed vectors, in process; fails the calls listed in fail_calls"""
+
+    def __init__(self, fail_calls=()):
+        self.calls = 0
+        self.texts = 0
+        self.fail_calls = set(fail_calls)
+
+    def __call__(self, texts):
+        self.calls += 1
+        if self.calls in self.fail_calls:
+            raise RuntimeError("stub embedding outage")
+        self.texts += len(texts)
+        return [hashed_embedding(text, 16) for text in texts]
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / "masterData.sqlite3")
+    generate(path, reports=200, machines=10, seed=3)
+    return path
+
+
+def make_indexer(tmp_path, source, embeddings, **settings):
+    settings.setdefault("batch_size", 20)
+    settings.setdefault("max_workers", 1)
+    return IncrementalIndexer(
+        MmapVectorStore(str(tmp_path / "vectors")), db_path=source,
+        state_path=str(tmp_path / "index_state.sqlite3"), embedding_function=embeddings, **settings
+    )
+
+
+def test_second_run_is_a_no_op_and_only_changes_are_reembedded(tmp_path, source):
+    first = make_indexer(tmp_path, source, StubEmbeddings()).run()
+    indexed = first["added"]
+    assert indexed and not first["failed"]
+
+    embeddings = StubEmbeddings()
+    again = make_indexer(tmp_path, source, embeddings).run()
+    assert (again["added"], again["updated"], again["deleted"], again["embedded"]) == (0, 0, 0, 0)
+    assert again["unchanged"] == indexed
+    assert embeddings.calls == 0
+
+    conn = sqlite3.connect(source)
+    changed, removed = [r[0] for r in conn.execute(
+        "SELECT ServiceReport_id FROM ServiceReports WHERE length(WorkRequired) > 20 ORDER BY rowid LIMIT 2"
+    )]
+    conn.execute("UPDATE ServiceReports SET ServicePerformed = 'Replaced spindle drive belt.' WHERE ServiceReport_id = ?", (changed,))
+    conn.execute("DELETE FROM ServiceReports WHERE ServiceReport_id = ?", (removed,))
+    conn.commit()
+    conn.close()
+
+    embeddings = StubEmbeddings()
+    indexer = make_indexer(tmp_path, source, embeddings)
+    stats = indexer.run()
+    assert (stats["added"], stats["updated"], stats["deleted"], stats["embedded"]) == (0, 1, 1, 1)
+    assert embeddings.texts == 1
+    assert indexer.collection.count() == indexed - 1
+
+
+def test_failed_batch_is_retried_from_the_checkpoint(tmp_path, source):
+    # The third batch fails; the batches after it are still stored
+    interrupted = make_indexer(tmp_path, source, StubEmbeddings(fail_calls={3})).run()
+    assert interrupted["failed"] == 20
+    state = IndexState(str(tmp_path / "index_state.sqlite3"))
+    checkpoint = int(state.get_watermark("max_rowid"))
+    state.close()
+    assert checkpoint > 0
+
+    embeddings = StubEmbeddings()
+    indexer = make_indexer(tmp_path, source, embeddings)
+    resumed = indexer.run(append_only=True)
+    # Only rows past the checkpoint are read again, and only the failed batch is embedded
+    conn = sqlite3.connect(source)
+    assert resumed["scanned"] == conn.execute("SELECT COUNT(*) FROM ServiceReports WHERE rowid > ?", (checkpoint,)).fetchone()[0]
+    conn.close()
+    assert (resumed["added"], resumed["failed"], embeddings.texts) == (20, 0, 20)
+    assert indexer.collection.count() == interrupted["added"] + interrupted["updated"]
+
+    assert make_indexer(tmp_path, source, StubEmbeddings()).run()["embedded"] == 0
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_interruption_after_a_batch_is_stored_resumes_at_the_row_being_read(tmp_path, source):
+    # With one batch in flight, submit() stores the previous batch (and checkpoints) before the row
+    # that filled it is added to the next one; stop the run right there
+    calls = []
+
+    def progress(stats):
+        calls.append(stats)
+        if len(calls) == 2:
+            raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        make_indexer(tmp_path, source, StubEmbeddings(), max_in_flight=1, progress=progress).run()
+    state = IndexState(str(tmp_path / "index_state.sqlite3"))
+    assert state.count() == 20
+    checkpoint = int(state.get_watermark("max_rowid"))
+    stored = max(r[0] for r in state.conn.execute("SELECT source_rowid FROM indexed_reports"))
+    state.close()
+    assert checkpoint <= stored
+
+    make_indexer(tmp_path, source, StubEmbeddings()).run(append_only=True)
+    full = make_indexer(tmp_path, source, StubEmbeddings()).run()
+    # Resuming from the checkpoint alone indexed every report
+    assert (full["added"], full["embedded"]) == (0, 0)
@@ -0,0 +1,57 @@
+import collections
+import json
+import sqlite3
+
+from issue_summary import refresh_summary, top_issues
+from model_catalog import model_family
+from synthetic_db import generate
+
+
+def seeded_issue(model, work_required, service_performed):
+    """(family, symptom, fix) as synthetic_db.generate() wrote them"""
+    return model_family(model), work_required.split(".")[0], service_performed.split(". ")[1].rstrip(".")
+
+
+def test_synthetic_reports_collapse_to_their_seeded_issues(tmp_path):
+    path = str(tmp_path / "masterData.sqlite3")
+    generate(path, reports=2000, seed=3)
+    conn = sqlite3.connect(path)
+    refresh_summary(conn, rebuild=True)
+
+    issue_of = {str(r[0]): seeded_issue(*r[1:]) for r in conn.execute(
+        "SELECT ServiceReport_id, Model, WorkRequired, ServicePerformed FROM ServiceReports"
+    )}
+    seeded = len(set(issue_of.values()))
+    clusters, reports = conn.execute("SELECT COUNT(*), SUM(report_count) FROM IssueClusters").fetchone()
+    assert reports == 2000
+    assert 0.8 * seeded <= clusters <= 1.2 * seeded
+
+    # Representatives of a cluster are (nearly always) the same seeded issue
+    mixed = 0
+    for (representatives,) in conn.execute("SELECT representative_ids FROM IssueClusters WHERE report_count > 1"):
+        issues = collections.Counter(issue_of[r] for r in json.loads(representatives))
+        mixed += sum(issues.values()) - issues.most_common(1)[0][1]
+    total = conn.execute("SELECT SUM(min(report_count, 5)) FROM IssueClusters WHERE report_count > 1").fetchone()[0]
+    assert mixed / total < 0.1
+
+
+def test_incremental_refresh_and_family_lookup(tmp_path):
+    path = str(tmp_path / "masterData.sqlite3")
+    generate(path, reports=500, seed=4)
+    conn = sqlite3.connect(path)
+    refresh_summary(conn)
+    clusters = conn.execute("SELECT COUNT(*) FROM IssueClusters").fetchone()[0]
+
+    # A copy of an existing report (with a different note) joins its cluster
+    conn.execute(
+        "INSERT INTO ServiceReports (ServiceReport_id, Model, Serial, WorkRequired, ServicePerformed, Date) "
+        "SELECT 100000, 'VF-4SS', Serial, WorkRequired || ' Second visit for this issue.', ServicePerformed, '2030-01-01' "
+        "FROM ServiceReports WHERE Model = 'VF-4' LIMIT 1"
+    )
+    conn.commit()
+    assert refresh_summary(conn) == 1
+    assert conn.execute("SELECT COUNT(*) FROM IssueClusters").fetchone()[0] == clusters
+
+    # VF-4 and VF-4SS share their family's clusters
+    assert top_issues(conn, ["VF-4"], limit=50) == top_issues(conn, ["VF-4SS"], limit=50)
+    assert any("100000" in issue[4] for issue in top_issues(conn, ["VF-4"], limit=50))
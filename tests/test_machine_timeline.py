@@ -0,0 +1,61 @@
+import sqlite3
+
+from machine_timeline import bootstrap_timeline, machine_timeline, normalize_date, upsert_timeline
+from synthetic_db import generate
+
+MIXED_DATES = ["12/01/2019", "2/01/2020", "2020-02-01", "Jan 5, 2021", "", "2019-12-01 08:30", "2/01/2020"]
+
+
+def busiest_serial(conn):
+    return conn.execute(
+        "SELECT Serial FROM ServiceReports GROUP BY Serial ORDER BY COUNT(*) DESC LIMIT 1"
+    ).fetchone()[0]
+
+
+def test_cursor_pages_walk_a_machines_history_newest_first(tmp_path):
+    path = str(tmp_path / "masterData.sqlite3")
+    generate(path, reports=300, machines=10, seed=5)
+    conn = sqlite3.connect(path)
+    serial = busiest_serial(conn)
+    report_ids = [r[0] for r in conn.execute("SELECT ServiceReport_id FROM ServiceReports WHERE Serial = ?", (serial,))]
+    # Dates in mixed formats, with ties, so ordering has to fall back to the report id
+    for i, report_id in enumerate(report_ids):
+        conn.execute("UPDATE ServiceReports SET Date = ? WHERE ServiceReport_id = ?", (MIXED_DATES[i % len(MIXED_DATES)], report_id))
+    conn.commit()
+    conn.close()
+    bootstrap_timeline(path)
+
+    conn = sqlite3.connect(path)
+    expected = sorted(
+        ((normalize_date(MIXED_DATES[i % len(MIXED_DATES)]), str(report_id)) for i, report_id in enumerate(report_ids)),
+        reverse=True
+    )
+    pages, before = [], None
+    while True:
+        page = machine_timeline(conn, serial, limit=4, before=before)
+        if not page:
+            break
+        assert len(page) <= 4
+        pages.append(page)
+        before = page[-1][8]
+    seen = [str(row[0]) for page in pages for row in page]
+    assert seen == [report_id for _, report_id in expected]
+    assert len(pages) == -(-len(report_ids) // 4)
+    # "12/01/2019" is older than "2/01/2020", and undated reports come last
+    assert pages[0][0][1] == "Jan 5, 2021"
+    assert pages[-1][-1][1] == ""
+
+    # A report added after the first page was served shows up on a fresh first page, without
+    # shifting the older pages that a cursor points into
+    cursor = pages[0][-1][8]
+    new_id = max(int(r) for r in report_ids) + 100000
+    conn.execute(
+        "INSERT INTO ServiceReports (ServiceReport_id, Date, Model, Serial, WorkRequired, ServicePerformed, VerificationTest) "
+        "SELECT ?, '2022-03-04', Model, Serial, 'Spindle alarm', 'Replaced encoder', 'Ran spindle warmup' "
+        "FROM ServiceReports WHERE Serial = ? LIMIT 1",
+        (new_id, serial)
+    )
+    upsert_timeline(conn, [new_id])
+    assert str(machine_timeline(conn, serial, limit=1)[0][0]) == str(new_id)
+    assert machine_timeline(conn, serial, limit=4, before=cursor) == pages[1]
+    conn.close()
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+
+import openai
+import pytest
+
+from openai_gateway import OpenAIGateway
+from stub_openai import StubConfig, StubOpenAIServer
+
+MODEL = "text-embedding-3-small"
+
+
+@contextmanager
+def stub_server(**config):
+    settings = dict(embedding_latency=0, embedding_latency_per_input=0, chat_latency=0, token_latency=0,
+                    answer_tokens=8, dims=8, jitter=0, seed=0)
+    settings.update(config)
+    server = StubOpenAIServer(config=StubConfig(**settings)).start()
+    try:
+        yield server
+    finally:
+        server.stop()
+
+
+def make_gateway(server, **settings):
+    settings.setdefault("retry_base_seconds", 0.01)
+    return OpenAIGateway(
+        client=openai.OpenAI(base_url=server.base_url, api_key="stub", max_retries=0),
+        async_client=openai.AsyncOpenAI(base_url=server.base_url, api_key="stub", max_retries=0),
+        **settings
+    )
+
+
+def run_threads(count, target):
+    results = [None] * count
+
+    def worker(i):
+        results[i] = target(i)
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_rate_limited_calls_are_retried_until_they_succeed():
+    with stub_server(error_rate=0.5) as server:
+        gateway = make_gateway(server, max_retries=20)
+        vectors = [gateway.embed([f"alarm {i}"], MODEL)[0] for i in range(10)]
+        stats = server.stats.snapshot()
+    assert all(len(v) == 8 for v in vectors)
+    assert stats["embedding_requests"] == 10
+    assert stats["rate_limited"] > 0
+    # The stub's Retry-After paused the lane at least once
+    assert gateway.lanes["embeddings"].paused_until > 0
+
+
+def test_rate_limit_error_is_raised_after_max_retries():
+    with stub_server(error_rate=1.0) as server:
+        gateway = make_gateway(server, max_retries=2)
+        gateway.lanes["embeddings"].pause = lambda seconds: None  # don't sit out Retry-After here
+        with pytest.raises(openai.RateLimitError):
+            gateway.embed(["alarm 108"], MODEL)
+        assert server.stats.snapshot()["rate_limited"] == 3
+
+
+def test_identical_concurrent_chats_share_one_call():
+    with stub_server(chat_latency=0.3) as server:
+        gateway = make_gateway(server)
+        messages = [{"role": "user", "content": "spindle won't orient"}]
+        answers = run_threads(5, lambda i: gateway.chat(model="gpt-4o-mini", messages=messages).choices[0].message.content)
+        stats = server.stats.snapshot()
+    assert len(set(answers)) == 1
+    assert stats["chat_requests"] == 1
+
+
+def test_concurrent_query_embeddings_are_batched():
+    with stub_server(embedding_latency=0.05) as server:
+        gateway = make_gateway(server, batch_window_seconds=0.05)
+        vectors = run_threads(8, lambda i: gateway.embed_query(f"query {i}", MODEL))
+        stats = server.stats.snapshot()
+    assert all(len(v) == 8 for v in vectors)
+    assert stats["embedding_inputs"] == 8
+    assert stats["embedding_requests"] < 8
+
+
+def test_lone_query_embedding_does_not_wait_for_the_batch_window():
+    with stub_server() as server:
+        gateway = make_gateway(server, batch_window_seconds=2)
+        gateway.embed_query("warm up the connection", MODEL)
+        start = time.monotonic()
+        gateway.embed_query("spindle alarm 108", MODEL)
+        assert time.monotonic() - start < 1
+
+
+def test_async_query_embeddings_are_batched_and_flush_tasks_released():
+    with stub_server(embedding_latency=0.05) as server:
+        gateway = make_gateway(server, batch_window_seconds=0.05)
+
+        async def run():
+            lone = await asyncio.wait_for(gateway.aembed_query("first query", MODEL), 1)
+            many = await asyncio.gather(*(gateway.aembed_query(f"query {i}", MODEL) for i in range(8)))
+            return [lone] + many
+
+        vectors = asyncio.run(run())
+        stats = server.stats.snapshot()
+    assert all(len(v) == 8 for v in vectors)
+    assert stats["embedding_inputs"] == 9
+    assert stats["embedding_requests"] == 2
+    assert not gateway._flush_tasks
@@ -0,0 +1,96 @@
+import threading
+import time
+
+from session_store import SessionStore
+
+
+def test_turns_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    first, second = SessionStore(db_path=path), SessionStore(db_path=path)
+
+    session = first.create("VF-2", "", [{"role": "user", "content": "earlier"}])
+    first.append_turn(session, {"role": "user", "content": "one"}, "answer one")
+
+    other = second.get(session["session_id"])
+    assert [m["content"] for m in other["messages"]] == ["earlier", "one", "answer one"]
+    second.append_turn(other, {"role": "user", "content": "two"}, "answer two")
+
+    again = first.get(session["session_id"])
+    assert [m["content"] for m in again["messages"]][-2:] == ["two", "answer two"]
+
+
+def test_concurrent_turns_are_not_lost(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    first, second = SessionStore(db_path=path), SessionStore(db_path=path)
+    session_id = first.create("VF-2")["session_id"]
+    # Both workers loaded the session before either turn was saved
+    a, b = first.get(session_id), second.get(session_id)
+    first.remember_reports(a, {"1": [["1"], []]}, {"1": 0.5})
+    first.append_turn(a, {"role": "user", "content": "a"}, "answer a")
+    second.remember_reports(b, {"2": [["2"], []]}, {"2": 0.7})
+    second.append_turn(b, {"role": "user", "content": "b"}, "answer b")
+
+    stored = SessionStore(db_path=path).get(session_id)
+    assert [m["content"] for m in stored["messages"]] == ["a", "answer a", "b", "answer b"]
+    assert set(stored["scores"]) == {"1", "2"}
+    assert second.stats()["conflicts"] == 1
+
+
+def test_turns_within_a_process_are_serialized(tmp_path):
+    store = SessionStore(db_path=str(tmp_path / "sessions.sqlite3"))
+    session = store.create("VF-2")
+
+    def turn(i):
+        store.append_turn(store.get(session["session_id"]), {"role": "user", "content": str(i)}, f"answer {i}")
+
+    threads = [threading.Thread(target=turn, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stored = SessionStore(db_path=str(tmp_path / "sessions.sqlite3")).get(session["session_id"])
+    assert len(stored["messages"]) == 16
+    assert stored["version"] == 8
+
+
+def test_expired_sessions_are_dropped(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    store = SessionStore(ttl_seconds=60, db_path=path)
+    session = store.create("VF-2")
+    store._update(session, lambda s: s.update(updated=time.time() - 120))
+
+    assert store.get(session["session_id"]) is None
+    assert SessionStore(ttl_seconds=60, db_path=path).get(session["session_id"]) is None
+    assert store.stats()["expired"] == 1
+
+
+def test_memory_only_sessions(tmp_path):
+    store = SessionStore(max_sessions=2)
+    sessions = [store.create("VF-2") for _ in range(3)]
+    assert store.get(sessions[0]["session_id"]) is None
+    assert store.get(sessions[2]["session_id"]) is sessions[2]
+
+
+def test_remember_reports_keeps_the_best_scored():
+    store = SessionStore(max_reports=2)
+    session = store.create("VF-2")
+    store.remember_reports(session, {"1": [[], []], "2": [[], []], "3": [[], []]}, {"1": 0.1, "2": 0.9, "3": 0.5})
+    assert set(session["reports"]) == set(session["scores"]) == {"2", "3"}
+
+
+def test_expired_session_is_resumed_from_client_history(app_module):
+    client = app_module.app.test_client()
+    first = client.post("/chat", json={"model": "VF-2", "message": "Spindle noise at high RPM"}).get_json()
+    session_id = first["session_id"]
+    assert not first.get("session_expired")
+
+    app_module.session_store.delete(session_id)
+    expired = client.post("/chat", json={"session_id": session_id, "message": "and then?"}).get_json()
+    assert expired["session_expired"]
+
+    # The UI resends with its local history, which seeds a new session
+    history = [{"role": "user", "content": "Spindle noise at high RPM"}, {"role": "assistant", "content": first["response"]}]
+    resumed = client.post("/chat", json={"model": "VF-2", "message": "and then?", "conversation": history}).get_json()
+    assert resumed["session_id"] != session_id
+    messages = app_module.session_store.get(resumed["session_id"])["messages"]
+    assert [m["content"] for m in messages][:3] == ["Spindle noise at high RPM", first["response"], "and then?"]
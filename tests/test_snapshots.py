@@ -0,0 +1,62 @@
+import hashlib
+import sqlite3
+
+from db_pool import ConnectionManager
+from hybrid_search import FTS_TABLE
+from snapshots import activate, build_snapshot
+from synthetic_db import generate, prepare
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def add_report(db_path, report_id):
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "INSERT INTO ServiceReports (ServiceReport_id, Date, Model, Serial, WorkRequired, ServicePerformed, VerificationTest) "
+        "SELECT ?, '2026-10-01', Model, Serial, 'Alarm 9999 on tool changer', 'Replaced carousel motor', 'Ran 50 tool changes' "
+        "FROM ServiceReports LIMIT 1",
+        (report_id,)
+    )
+    conn.commit()
+    conn.close()
+
+
+def fts_ids(conn):
+    return {str(r[0]) for r in conn.execute(f"SELECT report_id FROM {FTS_TABLE}")}
+
+
+def test_build_leaves_serving_tables_alone_and_promote_switches_them(tmp_path, stub, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    db_path = str(tmp_path / "masterData.sqlite3")
+    generate(db_path, reports=150, machines=10, seed=7)
+    prepare(db_path)
+    root = str(tmp_path / "vectordb" / "snapshots")
+
+    blue = build_snapshot(db_path, root, backend="mmap", api_base=stub.base_url, max_workers=1)
+    activate(root, blue.version)
+    add_report(db_path, 990001)
+    serving_before = file_digest(db_path)
+
+    green = build_snapshot(db_path, root, backend="mmap", api_base=stub.base_url, max_workers=1)
+    assert green.manifest["parent"] == blue.version
+    assert green.manifest["index"]["added"] == 1
+    # The build only read the serving database; its side tables lack the new report
+    assert file_digest(db_path) == serving_before
+    conn = sqlite3.connect(db_path)
+    assert "990001" not in fts_ids(conn)
+    conn.close()
+    assert green.manifest["aux"][FTS_TABLE] == blue.manifest["aux"][FTS_TABLE] + 1
+    assert green.manifest["aux"]["MachineTimeline"] == blue.manifest["aux"]["MachineTimeline"] + 1
+
+    pool = ConnectionManager(db_path, overlay_path=blue.aux_path)
+    conn = pool.connection()
+    assert "990001" not in fts_ids(conn)
+    # Report tables still come from the serving database
+    assert conn.execute("SELECT COUNT(*) FROM ServiceReports WHERE ServiceReport_id = 990001").fetchone()[0] == 1
+
+    activate(root, green.version)
+    pool.set_overlay(green.aux_path)
+    assert "990001" in fts_ids(pool.connection())
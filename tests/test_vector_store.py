@@ -0,0 +1,59 @@
+import numpy as np
+
+from vector_store import MmapVectorStore, partition_key
+
+
+def unit(*values, dim=8):
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[:len(values)] = values
+    return vector / np.linalg.norm(vector)
+
+
+def test_query_sees_appends_from_another_instance(tmp_path):
+    writer = MmapVectorStore(str(tmp_path))
+    writer.upsert(["1", "2"], embeddings=[unit(1, 0), unit(0, 1)], metadatas=[{"model": "VF-2"}, {"model": "VF-2"}])
+
+    reader = MmapVectorStore(str(tmp_path))
+    assert reader.query(query_embeddings=[unit(1, 0)], n_results=2)["ids"] == [["1", "2"]]
+
+    writer.upsert(["3"], embeddings=[unit(1, 0.1)], metadatas=[{"model": "VF-2"}])
+    assert reader.query(query_embeddings=[unit(1, 0)], n_results=3)["ids"] == [["1", "3", "2"]]
+
+
+def test_reupsert_and_delete_from_another_instance_with_model_filter(tmp_path):
+    writer = MmapVectorStore(str(tmp_path))
+    writer.upsert(["1", "2"], embeddings=[unit(1, 0), unit(0, 1)], metadatas=[{"model": "VF-4"}, {"model": "VF-4SS"}])
+
+    reader = MmapVectorStore(str(tmp_path))
+    where = {"model": {"$in": ["VF-4"]}}
+    assert reader.query(query_embeddings=[unit(1, 0)], n_results=5, where=where)["ids"] == [["1"]]
+
+    # Re-upserting tombstones the old rows; the reader must not return them or fail on the new ones
+    writer.upsert(["1", "2"], embeddings=[unit(0, 1), unit(1, 0)], metadatas=[{"model": "VF-4"}, {"model": "VF-4"}])
+    result = reader.query(query_embeddings=[unit(1, 0)], n_results=5, where=where)
+    assert result["ids"] == [["2", "1"]]
+
+    writer.delete(ids=["2"])
+    assert reader.query(query_embeddings=[unit(1, 0)], n_results=5, where=where)["ids"] == [["1"]]
+    assert reader.count() == 1
+
+
+def test_rows_appended_before_the_sidecar_commit_are_ignored(tmp_path):
+    store = MmapVectorStore(str(tmp_path))
+    store.upsert(["1"], embeddings=[unit(1, 0)], metadatas=[{"model": "VF-2"}])
+    store.query(query_embeddings=[unit(1, 0)], n_results=1)
+
+    # Another writer's matrix append lands before its ids are committed
+    store._partition(partition_key("VF-2")).append(np.stack([unit(1, 0)]))
+    assert store.query(query_embeddings=[unit(1, 0)], n_results=5)["ids"] == [["1"]]
+
+
+def test_compact_in_another_instance(tmp_path):
+    writer = MmapVectorStore(str(tmp_path), dtype="int8")
+    writer.upsert(["1", "2", "3"], embeddings=[unit(1, 0), unit(0, 1), unit(1, 1)], metadatas=[{"model": "VF-2"}] * 3)
+    reader = MmapVectorStore(str(tmp_path))
+    reader.query(query_embeddings=[unit(1, 0)], n_results=3)
+
+    writer.delete(ids=["1"])
+    writer.compact()
+    assert reader.query(query_embeddings=[unit(1, 0)], n_results=3)["ids"] == [["3", "2"]]